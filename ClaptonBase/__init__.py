@@ -16,4 +16,9 @@ any computer with serial port.
 
 __author__ = 'Bruno Geninatti'
 __all__ = ["exceptions", "decode", "encode", "utils", "serial",
-           "containers"]
+           "containers", "transports", "apps", "bus_manager", "broker",
+           "capture", "scanner", "analyzer",
+           "capture_index", "admission", "publisher",
+           "shared_image", "node_state",
+           "health", "retry", "deadline",
+           "bus_reader", "planner", "autobaud"]
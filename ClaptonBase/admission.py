@@ -0,0 +1,273 @@
+"""
+.. module:: admission
+    :platform: Unix
+    :synopsis: Admission control of the requests to a TKLan
+
+The TKLan serves one transaction at a time and at 2400 bps a read of a few
+bytes takes tens of milliseconds, so when the threads of an application ask
+for more than the bus can carry the requests pile up behind the port lock
+and an interactive request can wait seconds behind a backlog of polls.
+
+:class:`AdmissionController` estimates the time of each transaction from its
+size and the baudrate and serves the requests by priority class, each one
+with a bounded queue:
+
+* ``PRIORITY_INTERACTIVE``: requests of an operator, served first.
+* ``PRIORITY_NORMAL``: the default.
+* ``PRIORITY_POLLING``: periodic reads. When the estimated wait is more
+  than its maximum wait the poll is rejected, and a poll that is still in
+  the queue at that time is shed, because a newer one will come anyway.
+
+A rejected or shed request raises :class:`OverloadException`.
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, local
+
+from . import cfg
+from .cfg import PRIORITY_NORMAL
+from .exceptions import OverloadException
+from .utils import get_logger, wire_time
+
+logger = get_logger('admission')
+
+# Longitud del encabezado y el checksum de un paquete.
+FRAME_OVERHEAD = 3
+
+
+def transaction_bytes(package):
+    """
+    :param package: The request.
+    :type package: :class:`Package`
+    :return: Estimated bytes in the bus for the transaction of ``package``:
+        the request and the answer. The echo is read while the request is
+        written, so it doesn't add bytes.
+    """
+    if package.function in (1, 3, 5) and package.data:
+        answer = package.data[-1] + FRAME_OVERHEAD
+    elif package.function == 0:
+        answer = cfg.IDENTIFY_ANSWER_SIZE
+    elif package.function in (2, 4):
+        # Las escrituras se responden sin datos.
+        answer = FRAME_OVERHEAD
+    else:
+        answer = FRAME_OVERHEAD + 1
+    return len(package.bytes_chain) + answer
+
+
+def transaction_time(package, baudrate, turnaround=None):
+    """
+    :param baudrate: Speed of the bus.
+    :param turnaround: Seconds that the node takes to answer. By default
+        ``NODE_TURNAROUND``.
+    :return: Estimated seconds that the bus is busy with the transaction of
+        ``package``.
+    """
+    if turnaround is None:
+        turnaround = cfg.NODE_TURNAROUND
+    return wire_time(transaction_bytes(package), baudrate) + turnaround
+
+
+class _Ticket(object):
+
+    def __init__(self, priority, estimate):
+        self.priority = priority
+        self.estimate = estimate
+        self.queued = time.monotonic()
+
+
+class _Stats(object):
+
+    def __init__(self):
+        self.admitted = 0
+        self.rejected = 0
+        self.shed = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+
+class AdmissionController(object):
+    """
+    Bounded queues by priority in front of the port of a
+    :class:`SerialInterface`. Use it with :func:`admit`::
+
+        with controller.admit(package):
+            answer = ser._transaction(package)
+    """
+
+    def __init__(self, baudrate=cfg.DEFAULT_BAUDRATE,
+                 limits=cfg.ADMISSION_QUEUE_LIMITS,
+                 max_wait=cfg.ADMISSION_MAX_WAIT):
+        """
+        :param baudrate: Speed of the bus, to estimate the time of each
+            transaction.
+        :type baudrate: int
+        :param limits: Maximum amount of requests waiting, for each priority.
+        :type limits: tuple of int
+        :param max_wait: Maximum wait in seconds for each priority, None is
+            without limit.
+        :type max_wait: tuple of float | None
+        """
+        if len(limits) != len(max_wait):
+            raise ValueError('Se necesita un limite y una espera por prioridad.')
+        self.baudrate = baudrate
+        self.limits = tuple(limits)
+        self.max_wait = tuple(max_wait)
+        self._queues = [deque() for _ in self.limits]
+        self._stats = [_Stats() for _ in self.limits]
+        self._condition = Condition()
+        self._busy = None
+        self._busy_time = 0.
+        self._created = time.monotonic()
+        self._local = local()
+
+    def estimate(self, package):
+        """
+        :param package: The request, or a list of requests sent in a batch.
+        :type package: :class:`Package` | list
+        :return: Estimated seconds that the bus is busy with the transaction
+            of ``package``: the request, the answer and the time that the
+            node takes to answer (see :func:`transaction_bytes`).
+        """
+        if isinstance(package, list):
+            return sum(transaction_time(item, self.baudrate) for item in package)
+        return transaction_time(package, self.baudrate)
+
+    @property
+    def capacity(self):
+        """
+        Transactions per second that the bus can serve, estimated for a
+        read of one byte.
+        """
+        return 1. / (wire_time(2 * FRAME_OVERHEAD + 3, self.baudrate) + cfg.NODE_TURNAROUND)
+
+    def _backlog(self, priority):
+        # Tiempo estimado de los pedidos que se atienden antes que uno nuevo.
+        backlog = self._busy.estimate if self._busy is not None else 0.
+        for queue in self._queues[:priority + 1]:
+            backlog += sum(ticket.estimate for ticket in queue)
+        return backlog
+
+    def _next(self):
+        for queue in self._queues:
+            if queue:
+                return queue[0]
+        return None
+
+    @contextmanager
+    def priority(self, priority, shed=True):
+        """
+        Use ``priority`` for the requests of the current thread that don't
+        give one, like the ones of :class:`Node`.
+
+        :param shed: If False the requests of the thread are not rejected
+            nor shed for their wait, only if the queue is full. For the
+            requests that have low priority but must be done anyway.
+        :type shed: bool
+        """
+        previous = getattr(self._local, 'priority', None), getattr(self._local, 'shed', True)
+        self._local.priority = priority
+        self._local.shed = shed
+        try:
+            yield self
+        finally:
+            self._local.priority, self._local.shed = previous
+
+    @contextmanager
+    def admit(self, package, priority=None, deadline=None):
+        """
+        Wait the turn of ``package`` in the bus. The bus is considered busy
+        until the block ends.
+
+        :param package: The request, or a list of requests sent one after
+            the other without releasing the bus.
+        :type package: :class:`Package` | list
+        :param priority: Priority class. By default the one of
+            :func:`priority` or :data:`PRIORITY_NORMAL`.
+        :type priority: int
+        :param deadline: Time limit of the request.
+        :type deadline: :class:`Deadline`
+
+        raises:
+            * OverloadException: If the queue of the priority is full, the
+              estimated wait is more than the maximum or the wait expired.
+            * DeadlineException: If ``deadline`` expires or is cancelled while
+              waiting.
+        """
+        if priority is None:
+            priority = getattr(self._local, 'priority', None)
+            if priority is None:
+                priority = PRIORITY_NORMAL
+        stats = self._stats[priority]
+        queue = self._queues[priority]
+        max_wait = self.max_wait[priority]
+        if not getattr(self._local, 'shed', True):
+            max_wait = None
+        ticket = _Ticket(priority, self.estimate(package))
+        with self._condition:
+            if len(queue) >= self.limits[priority] or \
+                    (max_wait is not None and self._backlog(priority) > max_wait):
+                stats.rejected += 1
+                logger.warning("Pedido de prioridad {0} rechazado, {1} en espera.".format(
+                    priority, len(queue)))
+                raise OverloadException()
+            queue.append(ticket)
+            expires = None if max_wait is None else ticket.queued + max_wait
+            while self._busy is not None or self._next() is not ticket:
+                remaining = None if expires is None else expires - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    queue.remove(ticket)
+                    stats.shed += 1
+                    self._condition.notify_all()
+                    logger.warning("Pedido de prioridad {0} descartado luego de {1:.3f} s.".format(
+                        priority, max_wait))
+                    raise OverloadException()
+                if deadline is not None:
+                    if deadline.expired:
+                        queue.remove(ticket)
+                        stats.shed += 1
+                        self._condition.notify_all()
+                        deadline.check()
+                    remaining = deadline.slice(remaining)
+                self._condition.wait(remaining)
+            queue.popleft()
+            self._busy = ticket
+            started = time.monotonic()
+            wait = started - ticket.queued
+            stats.admitted += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+        try:
+            yield ticket
+        finally:
+            with self._condition:
+                self._busy = None
+                self._busy_time += time.monotonic() - started
+                self._condition.notify_all()
+
+    def report(self):
+        """
+        :return: dict with the estimated ``capacity`` in transactions per
+            second, the ``utilization`` of the bus since the controller was
+            created and, in ``priorities``, a dict for each priority with the
+            ``depth`` of its queue, the requests ``admitted``, ``rejected``
+            and ``shed``, and the ``mean_wait`` and ``max_wait`` in seconds.
+        """
+        with self._condition:
+            priorities = list()
+            for queue, stats in zip(self._queues, self._stats):
+                priorities.append({
+                    'depth': len(queue),
+                    'admitted': stats.admitted,
+                    'rejected': stats.rejected,
+                    'shed': stats.shed,
+                    'mean_wait': stats.total_wait / stats.admitted if stats.admitted else 0.,
+                    'max_wait': stats.max_wait,
+                })
+            elapsed = time.monotonic() - self._created
+            return {
+                'capacity': self.capacity,
+                'utilization': self._busy_time / elapsed if elapsed > 0 else 0.,
+                'priorities': priorities,
+            }
@@ -0,0 +1,277 @@
+"""
+Offline analysis of capture files (see :mod:`capture`).
+
+The capture is split in chunks at record boundaries and each chunk is decoded
+in a process of a pool. Every process maps the file by itself, so only the
+statistics travel between processes. The frames are found in the bytes read
+from the bus with :func:`scanner.scan` and the statistics of the chunks are
+merged at the end. :func:`read_chunk` and :func:`frame_times` are shared with
+:mod:`capture_index`, that decodes the chunks the same way.
+
+Requires ``numpy`` (``pip install ClaptonBase[analysis]``).
+"""
+import binascii
+import csv
+import os
+import shutil
+import struct
+import tempfile
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .capture import RX, SESSION, CaptureReader
+from .cfg import ANALYZER_CHUNK_SIZE, ANALYZER_GAP_BINS, MAX_DATA_LENGTH
+from .scanner import scan
+from .utils import get_logger
+
+logger = get_logger('analyzer')
+
+MAX_FRAME = MAX_DATA_LENGTH + 3
+FRAME_COLUMNS = ('timestamp', 'sender', 'destination', 'function', 'length', 'data')
+
+
+def read_chunk(reader, start, end):
+    """
+    :return: The bytes read from the bus in the records between ``start`` and
+        ``end`` followed by the ones needed to complete the last frame, the
+        position in the stream, monotonic time and position in the file of
+        each record and the sessions found (position in the stream, epoch).
+    """
+    stream = bytearray()
+    positions = list()
+    times = list()
+    records = list()
+    sessions = list()
+    for offset, monotonic, direction, data in reader.records(start, end, raw=True):
+        if direction == SESSION:
+            sessions.append((len(stream), struct.unpack('<d', data)[0]))
+        elif direction == RX:
+            positions.append(len(stream))
+            times.append(monotonic)
+            records.append(offset)
+            stream += data
+    size = len(stream)
+    for offset, monotonic, direction, data in reader.records(end, raw=True):
+        if len(stream) >= size + MAX_FRAME:
+            break
+        if direction == RX:
+            stream += data
+    return stream, size, positions, times, records, sessions
+
+
+def frame_times(frames, positions, times):
+    """
+    :return: array with the monotonic time of the record where each frame
+        starts.
+    """
+    return np.asarray(times)[np.searchsorted(positions, frames.offsets, 'right') - 1]
+
+
+def analyze_chunk(path, start, end):
+    """
+    Decode the records of the capture ``path`` between ``start`` and ``end``.
+    Executed in the processes of the pool.
+
+    :return: dict with the statistics of the chunk.
+    """
+    reader = CaptureReader(path)
+    try:
+        stream, size, positions, times, records, sessions = read_chunk(reader, start, end)
+    finally:
+        reader.close()
+    frames = scan(stream, size)
+    monotonic = frame_times(frames, positions, times)
+    # Cada sesion se asocia a la cantidad de paquetes que la preceden.
+    frame_sessions = [(int(np.searchsorted(frames.offsets, position)), epoch)
+                      for position, epoch in sessions]
+    gaps = np.diff(monotonic)
+    # No hay tiempo entre paquetes de distintas sesiones.
+    breaks = [index - 1 for index, epoch in frame_sessions if 0 < index < len(frames)]
+    gaps = np.delete(gaps, breaks)
+    bins = len(ANALYZER_GAP_BINS) + 1
+    return {
+        'frames': len(frames),
+        'bytes': size,
+        'lead': frames.lead,
+        'errors': frames.errors,
+        'overhang': max(frames.stop - size, 0),
+        'senders': np.bincount(frames.senders, minlength=16).tolist(),
+        'destinations': np.bincount(frames.destinations, minlength=16).tolist(),
+        'node_bytes': np.bincount(frames.senders, frames.sizes, minlength=16).astype(int).tolist(),
+        'functions': np.bincount(frames.functions, minlength=8).tolist(),
+        'gaps': np.bincount(np.searchsorted(ANALYZER_GAP_BINS, gaps, 'right'),
+                            minlength=bins).tolist(),
+        'sessions': frame_sessions,
+        'first_time': float(monotonic[0]) if len(frames) else None,
+        'last_time': float(monotonic[-1]) if len(frames) else None,
+    }
+
+
+def export_chunk(path, start, end, epoch, part_path):
+    """
+    Write the frames of the chunk in a CSV file without header. Executed in
+    the processes of the pool.
+
+    :param epoch: Epoch of the session at the start of the chunk.
+    """
+    reader = CaptureReader(path)
+    try:
+        stream, size, positions, times, records, sessions = read_chunk(reader, start, end)
+    finally:
+        reader.close()
+    frames = scan(stream, size)
+    epochs = np.full(len(frames), epoch)
+    for position, session_epoch in sessions:
+        epochs[np.searchsorted(frames.offsets, position):] = session_epoch
+    timestamps = epochs + frame_times(frames, positions, times)
+    with open(part_path, 'w', newline='') as part:
+        writer = csv.writer(part)
+        for row in zip(timestamps.tolist(), frames.offsets.tolist(), frames.sizes.tolist(),
+                       frames.senders.tolist(), frames.destinations.tolist(),
+                       frames.functions.tolist()):
+            timestamp, offset, frame_size, sender, destination, function = row
+            writer.writerow((
+                '{:.6f}'.format(timestamp), sender, destination, function, frame_size - 3,
+                binascii.hexlify(stream[offset + 2:offset + frame_size - 1]).decode()))
+
+
+class CaptureAnalyzer(object):
+    """
+    Statistics of the traffic in a capture file, computed in parallel.
+    """
+
+    def __init__(self, path, workers=None, chunk_size=ANALYZER_CHUNK_SIZE):
+        """
+        :param path: The capture file.
+        :type path: str
+        :param workers: Amount of processes. By default one per CPU. With 1
+            everything runs in this process.
+        :type workers: int
+        :param chunk_size: Approximated size of each chunk in bytes.
+        :type chunk_size: int
+        """
+        self.path = path
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.stats = None
+        self._chunks = None
+        self._epochs = None
+
+    def chunks(self):
+        """
+        :return: list of (``start``, ``end``) of each chunk.
+        """
+        if self._chunks is None:
+            reader = CaptureReader(self.path)
+            try:
+                count = max(1, -(-len(reader) // self.chunk_size))
+                bounds = reader.chunks(count)
+            finally:
+                reader.close()
+            self._chunks = list(zip(bounds[:-1], bounds[1:]))
+        return self._chunks
+
+    def _map(self, function, arguments):
+        if self.workers == 1 or len(arguments) == 1:
+            return [function(*args) for args in arguments]
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(function, *args) for args in arguments]
+            return [future.result() for future in futures]
+
+    def run(self):
+        """
+        Analyze the capture.
+
+        :return: dict with the amount of ``frames`` and ``bytes`` read, the
+            ``error_bytes`` that don't belong to any frame and the
+            ``error_rate``, the ``nodes`` statistics by ``lan_dir`` (frames
+            ``sent`` and ``received`` and ``bytes`` sent), the frames by
+            ``functions``, the histogram of the ``gaps`` between frames as
+            (upper limit, amount) and the time of the first and last frames.
+        """
+        chunks = self.chunks()
+        results = self._map(analyze_chunk, [(self.path, start, end) for start, end in chunks])
+        stats = {
+            'frames': 0, 'bytes': 0, 'error_bytes': 0,
+            'nodes': dict(), 'functions': dict(),
+            'gaps': [0] * (len(ANALYZER_GAP_BINS) + 1),
+            'start': None, 'end': None,
+        }
+        senders = [0] * 16
+        destinations = [0] * 16
+        node_bytes = [0] * 16
+        functions = [0] * 8
+        epoch = 0.
+        overhang = 0
+        last_time = None
+        self._epochs = list()
+        for result in results:
+            self._epochs.append(epoch)
+            stats['frames'] += result['frames']
+            stats['bytes'] += result['bytes']
+            # Los primeros bytes pueden ser el final de un paquete del bloque
+            # anterior, que ya fue contado.
+            stats['error_bytes'] += result['errors'] + max(result['lead'] - overhang, 0)
+            overhang = result['overhang']
+            for totals, values in ((senders, result['senders']),
+                                   (destinations, result['destinations']),
+                                   (node_bytes, result['node_bytes']),
+                                   (functions, result['functions']),
+                                   (stats['gaps'], result['gaps'])):
+                for index, value in enumerate(values):
+                    totals[index] += value
+            first_epoch = last_epoch = epoch
+            for index, session_epoch in result['sessions']:
+                if index == 0:
+                    first_epoch = session_epoch
+                    last_time = None
+                if index < result['frames']:
+                    last_epoch = session_epoch
+                epoch = session_epoch
+            if result['first_time'] is not None:
+                if stats['start'] is None:
+                    stats['start'] = first_epoch + result['first_time']
+                if last_time is not None:
+                    gap = result['first_time'] - last_time
+                    stats['gaps'][bisect_right(ANALYZER_GAP_BINS, gap)] += 1
+                last_time = result['last_time']
+                stats['end'] = last_epoch + last_time
+            if result['sessions'] and result['sessions'][-1][0] == result['frames']:
+                last_time = None
+        stats['error_rate'] = stats['error_bytes'] / stats['bytes'] if stats['bytes'] else 0.
+        for lan_dir in range(16):
+            if senders[lan_dir] or destinations[lan_dir]:
+                stats['nodes'][lan_dir] = {'sent': senders[lan_dir],
+                                           'received': destinations[lan_dir],
+                                           'bytes': node_bytes[lan_dir]}
+        stats['functions'] = dict((function, count)
+                                  for function, count in enumerate(functions) if count)
+        stats['gaps'] = list(zip(ANALYZER_GAP_BINS + (float('inf'),), stats['gaps']))
+        self.stats = stats
+        logger.info("Analizados {0} paquetes en {1} bloques de la captura {2}.".format(
+            stats['frames'], len(chunks), self.path))
+        return stats
+
+    def export_frames(self, path):
+        """
+        Write a CSV file with a row for each frame: ``timestamp``, ``sender``,
+        ``destination``, ``function``, ``length`` and ``data`` in hexadecimal.
+        """
+        if self._epochs is None:
+            self.run()
+        directory = tempfile.mkdtemp(prefix='clapton-')
+        try:
+            parts = [os.path.join(directory, '{}.csv'.format(index))
+                     for index in range(len(self._chunks))]
+            self._map(export_chunk, [(self.path, start, end, epoch, part)
+                                     for (start, end), epoch, part
+                                     in zip(self._chunks, self._epochs, parts)])
+            with open(path, 'w', newline='') as table:
+                csv.writer(table).writerow(FRAME_COLUMNS)
+                for part in parts:
+                    with open(part) as part_file:
+                        shutil.copyfileobj(part_file, table)
+        finally:
+            shutil.rmtree(directory)
@@ -1,168 +1,648 @@
+"""
+Tools to write the application (program memory) of a node from an Intel HEX
+file.
 
-    def read_app_line(self, inicio, longitud):
-        """
-        :param inicio: int Indice indicando a partir de que registro de la
-        memoria de la aplicacion se quiere leer.
-        :param longitud: int que indica la longitud en bytes que se quiere leer
-        :return: Line instance
-        :raise:
-          ActiveAppException: Si la aplicacion esta inactiva
-          TypeError: Si el tipo de los parametros recibidos no es correcto
-          WriteException: Si no se pudo escribir el paquete.
-          ReadException: Si no se pudo leer la respuesta del nodoself.
-        """
-
-        if not self.aplicacion_activa:
-            raise InactiveAppException
-
-        paq = Paquete(
-            destino=self.lan_dir,
-            funcion=5,
-            datos=struct.pack('Hb', inicio, longitud)
-        )
-        self._logger.info(
-            "Leyendo linea del nodo {0}, inicio {1}, longitud {2}.".format(
-                self.lan_dir), inicio, longitud)
-        rta = self._ser.send_paq(paq)
-        line = AppLine(inicio=inicio*2, paq=rta)
-        return line
-
-    def deactivate_app(self, blocking=True):
-        """
-        :return: None
-        :raise:
-          InactiveAppException: Si la aplicacion ya esta inactiva.
-          ActiveAppException: Si hubo un error desactivando la aplicacion.
-          WriteException: Si no se pudo escribir el paquete.
-          ReadException: Si no se pudo leer la respuesta del nodoself.
-        """
-        if not self.aplicacion_activa:
-            raise InactiveAppException
-
-        self._logger.info(
-            "Desactivando aplicacion del nodo {}.".format(self.lan_dir))
-        paq = Paquete(
-            destino=self.lan_dir, funcion=6, datos=b'\x00\x01\xff\xff')
-        rta = self._ser.send_paq(paq)
-        if rta.datos != APP_DEACTIVATE_RESPONSE:
-            raise ActiveAppException
-        else:
-            if blocking:
-                while self.aplicacion_activa:
-                    solicitud, estado = self.check_app_state()
-                    if not estado:
-                        return
-                    elif not solicitud:
-                        raise ActiveAppException
-
-    def write_app_line(self, line):
-        """
-        :param line: Instancia de AppLine
-        :return: None
-        :raise:
-          TypeError: Si line no es una instancia de AppLine
-          ActiveAppException: Si la aplicacion esta activa
-          WriteException: Si no se pudo escribir el paquete.
-          ReadException: Si no se pudo leer la respuesta del nodoself.
-        """
-        # TODO: APP_INIT_CONFIG tiene que ir en el paquete de identificacion
-        if self.aplicacion_activa:
-            raise ActiveAppException
-
-        if line.inicio < self.fnapp:
-            sum_inicio = 0
-            for part in [line.datos[GRABA_MAX_BYTES*(i-1):GRABA_MAX_BYTES*i] for i in range(1, int(math.ceil(float(line.longitud)/GRABA_MAX_BYTES))+1)]:
-                paq = Paquete(
-                    destino=self.lan_dir,
-                    funcion=6,
-                    datos=struct.pack('H', line.inicio + sum_inicio) + part
-                )
-                sum_inicio += int(GRABA_MAX_BYTES/2)
-                self._ser.send_paq(paq)
-        elif line.inicio > APP_INIT_E2:
-            paq = Paquete(
-                destino=self.lan_dir,
-                funcion=4,
-                datos=(struct.pack('b', line.inicio - APP_INIT_CONFIG) + ''.join([line.datos[i] for i in range(len(line.datos)) if not i % 2])))
-            self._ser.send_paq(paq)
-
-    def activate_app(self):
-        """
-        :return: None
-        :raise:
-          ActiveAppException: Si la aplicacion ya esta activa
-          InactiveAppException: Si hubo un error intentando activar la
-          aplicacion
-          WriteException: Si no se pudo escribir el paquete.
-          ReadException: Si no se pudo leer la respuesta del nodo.
-        """
-        if self.aplicacion_activa:
-            raise ActiveAppException
-        self._logger.info(
-            "Reactivando aplicacion del nodo {}.".format(self.lan_dir))
-        paq = Paquete(
-            destino=self.lan_dir, funcion=6, datos=b'\x00\x00\xa5\x05')
-        rta = self._ser.send_paq(paq)
-        if rta.datos != APP_ACTIVATE_RESPONSE:
-            raise InactiveAppException
-        else:
-            self.check_app_state()
-            return self.aplicacion_activa
+The HEX file is parsed once into a single buffer indexed by byte address
+(:class:`HexImage`). The buffer is managed in units of ``GRABA_MAX_BYTES``
+bytes, the minimum aligned write accepted by the nodes, and the units that
+must be written are merged into the largest frames that the node accepts
+(:class:`AppFlasher`).
+
+The progress of each flash is kept in a :class:`FlashJournal`, so a flash
+interrupted by a lost link or a crash continues from the last confirmed unit.
+
+The images loaded with :func:`HexImage.load` are shared by content hash, in
+memory and in a binary sidecar file, so the same file flashed in many nodes is
+parsed only once.
+"""
+import binascii
+import hashlib
+import os
+import struct
+from threading import Lock
+
+from . import decode, retry
+from .cfg import (APP_BLANK_WORD, APP_INIT_CONFIG, APP_INIT_E2, END_LINE,
+                  FLASH_JOURNAL_DIR, FLASH_MAX_FAILURES, GRABA_MAX_BYTES,
+                  HEX_CACHE_SUFFIX, MAX_DATA_LENGTH)
+from .exceptions import (BadLineException, ChecksumException, ReadException,
+                         WriteException)
+from .utils import get_logger
+
+logger = get_logger('apps')
+
+# Areas of the image. The addresses in the HEX file are in bytes, two per
+# word of the program memory.
+PROGRAM_AREA = 'PROGRAM'
+CONFIG_AREA = 'CONFIG'
+E2_AREA = 'E2'
+CONFIG_START = APP_INIT_CONFIG * 2
+E2_START = APP_INIT_E2 * 2
+
+# Images loaded from files, by hash of the content of the file.
+_images = dict()
+_images_lock = Lock()
 
-    def check_app_state(self):
-        lab_gen = bitarray()
-        lab_gen.frombytes(self.read_ram(0, 1).get(0))
-        self.aplicacion_activa = lab_gen[0]
-        self.solicitud_desactivacion = lab_gen[6]
-        return (self.solicitud_desactivacion, self.aplicacion_activa)
 
+def area(address):
+    """
+    :param address: Byte address in the image.
+    :return: The area of the image where ``address`` is.
+    """
+    if address < CONFIG_START:
+        return PROGRAM_AREA
+    elif address < E2_START:
+        return CONFIG_AREA
+    return E2_AREA
 
 
-class AppLine(object):
+class HexImage(object):
+    """
+    The content of an Intel HEX file in one buffer indexed by byte address.
+    The bytes that the file doesn't define keep the value of an erased word
+    (``APP_BLANK_WORD``), and ``mask`` tells wich ones were defined.
+    """
 
-    def __init__(self, line_regex=LINE_REGEX, **kwargs):
-        line = kwargs.get('line', None)
-        paq = kwargs.get('paq', None)
-        inicio = kwargs.get('inicio', None)
-        if line is not None:
-            line = line_regex.search(line)
-            if line is not None:
-                line_parsed = line.groups()
+    CACHE_MAGIC = b'CLPH\x01'
+
+    def __init__(self):
+        self.data = bytearray()
+        self.mask = bytearray()
+        self._units = None
+        self._digest = None
+        self._frames = dict()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as hex_file:
+            return cls.from_bytes(hex_file.read())
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        """
+        Get the image of the file in ``path``, parsing it only if the same
+        content wasn't loaded before. The images are shared in memory and
+        saved in a sidecar file next to the HEX file (or in ``cache_dir``).
+        The images returned should not be modified.
+
+        :param path: Path to the HEX file.
+        :type path: str
+        :param cache_dir: Directory for the sidecar file.
+        :type cache_dir: str
+        :rtype: HexImage
+        """
+        with open(path, 'rb') as hex_file:
+            content = hex_file.read()
+        key = hashlib.sha1(content).digest()
+        with _images_lock:
+            image = _images.get(key)
+            if image is not None:
+                return image
+            if cache_dir is None:
+                sidecar = path + HEX_CACHE_SUFFIX
             else:
-                raise BadLineException
-            if decode.validate_cs(binascii.unhexlify(''.join(line_parsed))):
+                sidecar = os.path.join(cache_dir, os.path.basename(path) + HEX_CACHE_SUFFIX)
+            image = cls.from_sidecar(sidecar, key)
+            if image is None:
+                image = cls.from_bytes(content)
                 try:
-                    self.longitud = struct.unpack(
-                        'b', binascii.unhexlify(line_parsed[0]))[0]
-                    self.inicio = int(struct.unpack(
-                        'H', binascii.unhexlify(
-                            line_parsed[2] + line_parsed[1]))[0]/2)
-                    self.comando = line_parsed[3]
-                    datos = binascii.unhexlify(line_parsed[4])
-                    self.datos = datos[:-1]
-                    self.cs = datos[-1:]
-                except (struct.error, TypeError) as e:
-                    raise BadLineException
-            else:
+                    image.to_sidecar(sidecar, key)
+                except OSError as error:
+                    logger.warning("No se pudo guardar la cache {0}: {1}".format(sidecar, error))
+            _images[key] = image
+            return image
+
+    @classmethod
+    def from_sidecar(cls, path, key):
+        """
+        :param path: Path to the sidecar file.
+        :param key: Hash of the HEX file that the sidecar should have.
+        :type key: bytes
+        :return: The image in the sidecar or None if the file doesn't exist
+            or belongs to another content.
+        """
+        try:
+            with open(path, 'rb') as sidecar:
+                content = sidecar.read()
+        except OSError:
+            return None
+        header = len(cls.CACHE_MAGIC) + len(key)
+        if content[:header] != cls.CACHE_MAGIC + key:
+            return None
+        try:
+            length, runs, units = struct.unpack_from('<3I', content, header)
+            offset = header + 12
+            image = cls()
+            image.data = bytearray(content[offset:offset + length])
+            offset += length
+            image.mask = bytearray(length)
+            bounds = struct.unpack_from('<{}I'.format(runs * 2), content, offset)
+            for first, last in zip(bounds[0::2], bounds[1::2]):
+                image.mask[first:last] = b'\x01' * (last - first)
+            offset += runs * 8
+            image._units = list(struct.unpack_from('<{}I'.format(units), content, offset))
+        except struct.error:
+            return None
+        if len(image.data) != length:
+            return None
+        return image
+
+    def to_sidecar(self, path, key):
+        """
+        Save the image in a sidecar file: the buffer, the ranges of defined
+        bytes and the units to write.
+
+        :param key: Hash of the HEX file of the image.
+        :type key: bytes
+        """
+        runs = self._defined_runs(0, len(self.mask))
+        units = self.units()
+        with open(path, 'wb') as sidecar:
+            sidecar.write(self.CACHE_MAGIC + key)
+            sidecar.write(struct.pack('<3I', len(self.data), len(runs), len(units)))
+            sidecar.write(self.data)
+            sidecar.write(struct.pack('<{}I'.format(len(runs) * 2),
+                                      *[bound for run in runs for bound in run]))
+            sidecar.write(struct.pack('<{}I'.format(len(units)), *units))
+
+    @classmethod
+    def from_bytes(cls, content):
+        """
+        :param content: Content of an Intel HEX file.
+        :type content: bytes
+
+        raises:
+            * BadLineException: If some record is malformed or has a wrong
+                checksum.
+        """
+        image = cls()
+        base = 0
+        for record in content.split():
+            if record[:1] != b':':
+                raise BadLineException
+            try:
+                raw = binascii.unhexlify(record[1:])
+            except (binascii.Error, ValueError):
+                raise BadLineException
+            if len(raw) < 5 or len(raw) != raw[0] + 5 or \
+                    not decode.validate_checksum(raw):
                 raise BadLineException
-        elif (paq is not None) and (inicio is not None):
-            self.longitud = int(paq.longitud/2)
-            self.inicio = inicio
-            self.datos = paq.datos
-            self.comando = '00'
-
-    def get_1b_data(self):
-        dir_inicio = struct.pack('H', self.inicio)
-        return dir_inicio + ''.join(
-            [self.datos[i] for i in range(len(self.datos)) if i % 2])
-
-    def to_write(self):
-        longitud = binascii.hexlify(struct.pack('b', self.longitud)).decode()
-        pre_inicio = binascii.hexlify(struct.pack('H', self.inicio*2))
-        inicio = pre_inicio[2:4].decode() + pre_inicio[0:2].decode()
-        datos = binascii.hexlify(self.datos).decode()
-        pre_line = '{0}{1}{2}{3}'.format(longitud, inicio, self.comando, datos)
-        cs = binascii.hexlify(encode.checksum(
-            binascii.unhexlify(pre_line))).decode()
-        return ':{0}{1}'.format(pre_line, cs).upper()
+            record_type, data = raw[3], raw[4:-1]
+            if record_type == 0:
+                image.write((base + (raw[1] << 8 | raw[2])), data)
+            elif record_type == 1:
+                break
+            elif record_type == 2:
+                base = int.from_bytes(data, 'big') << 4
+            elif record_type == 4:
+                base = int.from_bytes(data, 'big') << 16
+        return image
+
+    def __len__(self):
+        return len(self.data)
+
+    def digest(self):
+        """
+        :return: Hash of the content of the image.
+        :rtype: str
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha1(bytes(self.data) + bytes(self.mask)).hexdigest()
+        return self._digest
+
+    def write(self, address, data):
+        """
+        Put ``data`` in the image from ``address``, growing the buffer if is
+        needed.
+        """
+        end = address + len(data)
+        if end > len(self.data):
+            missing = -(-(end - len(self.data)) // GRABA_MAX_BYTES)
+            self.data.extend(APP_BLANK_WORD * (missing * GRABA_MAX_BYTES // 2))
+            self.mask.extend(bytes(missing * GRABA_MAX_BYTES))
+        self.data[address:end] = data
+        self.mask[address:end] = b'\x01' * len(data)
+        self._units = None
+        self._digest = None
+        self._frames.clear()
+
+    def to_hex(self, record_size=16):
+        """
+        Format the image as an Intel HEX file. The buffer is converted to
+        hexadecimal only once and each record takes its slice of it. Only the
+        bytes defined in the image are written.
+
+        :param record_size: Maximum amount of data bytes in each record.
+        :type record_size: int
+        :rtype: str
+        """
+        text = binascii.hexlify(self.data).decode().upper()
+        lines = list()
+        segment = 0
+        with memoryview(self.data) as view:
+            for address in range(0, len(self.data), record_size):
+                end = min(address + record_size, len(self.data))
+                if self.mask.find(1, address, end) == -1:
+                    continue
+                if address >> 16 != segment:
+                    segment = address >> 16
+                    checksum = -(2 + 4 + (segment >> 8) + (segment & 0xff)) & 0xff
+                    lines.append(':02000004{0:04X}{1:02X}'.format(segment, checksum))
+                if self.mask.find(0, address, end) == -1:
+                    runs = [(address, end)]
+                else:
+                    runs = self._defined_runs(address, end)
+                for first, last in runs:
+                    offset = first & 0xffff
+                    checksum = -((last - first) + (offset >> 8) + (offset & 0xff) +
+                                 sum(view[first:last])) & 0xff
+                    lines.append(':{0:02X}{1:04X}00{2}{3:02X}'.format(
+                        last - first, offset, text[first * 2:last * 2], checksum))
+        lines.append(END_LINE)
+        return '\n'.join(lines) + '\n'
+
+    def _defined_runs(self, start, end):
+        """
+        :return: list of (``first``, ``last``) with the ranges of defined
+            bytes between ``start`` and ``end``.
+        """
+        runs = list()
+        first = self.mask.find(1, start, end)
+        while first != -1:
+            last = self.mask.find(0, first, end)
+            if last == -1:
+                last = end
+            runs.append((first, last))
+            first = self.mask.find(1, last, end)
+        return runs
+
+    def unit(self, index):
+        """
+        :return: The bytes of the unit ``index`` (``GRABA_MAX_BYTES`` bytes).
+        """
+        return bytes(self.data[index * GRABA_MAX_BYTES:(index + 1) * GRABA_MAX_BYTES])
+
+    def units(self):
+        """
+        :return: The indexes of the units with at least one byte defined by
+            the file, leaving out the configuration words that can't be
+            written through the TKLan.
+        """
+        if self._units is None:
+            units = list()
+            for index in range(len(self.mask) // GRABA_MAX_BYTES):
+                start = index * GRABA_MAX_BYTES
+                if self.mask.find(1, start, start + GRABA_MAX_BYTES) != -1 and \
+                        area(start) != CONFIG_AREA:
+                    units.append(index)
+            self._units = units
+        return list(self._units)
+
+    def frame_data(self, frame):
+        """
+        :param frame: tuple (``area``, ``first unit``, ``amount of units``)
+        :return: tuple (``start``, ``data``) with the arguments to write the
+            frame with :func:`Node.write_app` or :func:`Node.write_eeprom`.
+            The result is kept, so the same frame written in other nodes costs
+            nothing.
+        """
+        result = self._frames.get(frame)
+        if result is None:
+            frame_area, first, count = frame
+            address = first * GRABA_MAX_BYTES
+            data = bytes(self.data[address:address + count * GRABA_MAX_BYTES])
+            if frame_area == PROGRAM_AREA:
+                result = (address // 2, data)
+            else:
+                result = ((address - E2_START) // 2, data[0::2])
+            self._frames[frame] = result
+        return result
+
+    def changed_units(self, previous, units=None):
+        """
+        :param previous: Image that is known to be in the node.
+        :type previous: HexImage
+        :param units: Units to compare. By default all of them.
+        :return: The units of this image that differ from ``previous``.
+        """
+        if units is None:
+            units = self.units()
+        return [index for index in units
+                if self.unit(index) != previous.unit(index)]
+
+
+class FlashJournal(object):
+    """
+    Bitmap with the units of an image that are confirmed in a node, saved in
+    a file. Each confirmation updates only the bytes of the bitmap that
+    changed, so the file is always up to date if the flash is interrupted.
+    """
 
+    MAGIC = b'CLPJ\x01'
+
+    def __init__(self, path, size):
+        """
+        :param path: File of the journal. If exists and correspond with
+            ``size`` the confirmed units are loaded from it.
+        :type path: str
+        :param size: Amount of units in the image.
+        :type size: int
+        """
+        self.path = path
+        self.size = size
+        length = -(-size // 8)
+        self.bitmap = bytearray(length)
+        if os.path.exists(path):
+            with open(path, 'rb') as journal_file:
+                content = journal_file.read()
+            if content[:len(self.MAGIC)] == self.MAGIC and \
+                    len(content) == len(self.MAGIC) + length:
+                self.bitmap[:] = content[len(self.MAGIC):]
+        else:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+        self._file = open(path, 'w+b')
+        self._file.write(self.MAGIC + self.bitmap)
+        self._file.flush()
+
+    @classmethod
+    def for_flash(cls, image, lan_dir, port, directory=FLASH_JOURNAL_DIR):
+        """
+        :return: The journal of the flash of ``image`` in the node
+            ``lan_dir`` of the TKLan in ``port``.
+        """
+        key = hashlib.sha1('{0}|{1}|{2}'.format(
+            port, lan_dir, image.digest()).encode()).hexdigest()[:20]
+        return cls(os.path.join(directory, '{}.journal'.format(key)),
+                   len(image.mask) // GRABA_MAX_BYTES)
+
+    def __contains__(self, unit):
+        return bool(self.bitmap[unit >> 3] & (1 << (unit & 7)))
+
+    def __len__(self):
+        return sum(bin(byte).count('1') for byte in self.bitmap)
+
+    def confirm(self, units):
+        """
+        Mark ``units`` as confirmed and save the change.
+        """
+        changed = set()
+        for unit in units:
+            self.bitmap[unit >> 3] |= 1 << (unit & 7)
+            changed.add(unit >> 3)
+        for index in sorted(changed):
+            self._file.seek(len(self.MAGIC) + index)
+            self._file.write(self.bitmap[index:index + 1])
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def remove(self):
+        """
+        Delete the journal. Used once the flash is complete.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class AppFlasher(object):
+    """
+    Write a :class:`HexImage` in the program memory and the EEPROM of a node,
+    sending only the units that differ from what the node already has.
+    """
+
+    def __init__(self, node, image, frame_bytes=None):
+        """
+        :param node: The node to write.
+        :type node: Node
+        :param image: The image to write.
+        :type image: HexImage
+        :param frame_bytes: Maximum amount of program bytes sent in each
+            package. By default is the biggest multiple of ``GRABA_MAX_BYTES``
+            that fits in the buffer of the node and in a package.
+        :type frame_bytes: int
+        """
+        self.node = node
+        self.image = image
+        self.frame_bytes = frame_bytes
+
+    def _max_units(self, unit_area):
+        """
+        :return: How many units fit in a package to the area ``unit_area``.
+        """
+        limit = min(self.node.buffer_size, MAX_DATA_LENGTH)
+        if unit_area == E2_AREA:
+            # Only the low byte of each word goes to the EEPROM.
+            return max((limit - 1) // (GRABA_MAX_BYTES // 2), 1)
+        if self.frame_bytes is not None:
+            limit = min(limit - 2, self.frame_bytes)
+        else:
+            limit -= 2
+        return max(limit // GRABA_MAX_BYTES, 1)
+
+    def frames(self, units, read=False):
+        """
+        Merge consecutive ``units`` of the same area into frames.
+
+        :param units: Sorted indexes of units.
+        :param read: Use the limits of the read packages instead of the
+            write packages.
+        :return: list of tuples (``area``, ``first unit``, ``amount of units``)
+        """
+        frames = list()
+        for index in units:
+            unit_area = area(index * GRABA_MAX_BYTES)
+            max_units = self._max_units(unit_area)
+            if read and unit_area == PROGRAM_AREA:
+                max_units = max(min(self.node.buffer_size, MAX_DATA_LENGTH) // GRABA_MAX_BYTES, 1)
+            if frames:
+                last_area, first, count = frames[-1]
+                if last_area == unit_area and first + count == index and count < max_units:
+                    frames[-1] = (last_area, first, count + 1)
+                    continue
+            frames.append((unit_area, index, 1))
+        return frames
+
+    def read_frame(self, frame):
+        """
+        :return: The content of ``frame`` in the node, in the format of the
+            image.
+        """
+        frame_area, first, count = frame
+        address = first * GRABA_MAX_BYTES
+        if frame_area == PROGRAM_AREA:
+            return self.node.read_app(address // 2, count * GRABA_MAX_BYTES)
+        start = (address - E2_START) // 2
+        memo = self.node.read_eeprom(start, count * GRABA_MAX_BYTES // 2)
+        # Rebuild the words as they are in the image to compare them.
+        words = bytearray(self.image.data[address:address + count * GRABA_MAX_BYTES])
+        words[0::2] = memo.data
+        return bytes(words)
+
+    def write_frame(self, frame):
+        # A lost frame costs reflashing the node, so insist harder.
+        with self.node._ser.retrying(retry.PERSISTENT):
+            return self._write_frame(frame)
+
+    def _write_frame(self, frame):
+        start, data = self.image.frame_data(frame)
+        if frame[0] == PROGRAM_AREA:
+            self.node.write_app(start, data)
+        else:
+            self.node.write_eeprom(start, data)
+
+    def read_back(self, units):
+        """
+        Read ``units`` from the node.
+
+        :return: The units whose content in the node differs from the image.
+        """
+        frames = self.frames(units, read=True)
+        program = [frame for frame in frames if frame[0] == PROGRAM_AREA]
+        # The program is read streaming all the requests.
+        contents = dict(zip(program, self.node.read_app_chunks(
+            [(frame[1] * GRABA_MAX_BYTES // 2, frame[2] * GRABA_MAX_BYTES)
+             for frame in program])))
+        changed = list()
+        for frame in frames:
+            content = contents.get(frame)
+            if content is None:
+                content = self.read_frame(frame)
+            frame_area, first, count = frame
+            for index in range(first, first + count):
+                offset = (index - first) * GRABA_MAX_BYTES
+                if content[offset:offset + GRABA_MAX_BYTES] != self.image.unit(index):
+                    changed.append(index)
+        return changed
+
+    def plan(self, previous=None, read_back=True, units=None):
+        """
+        Find the units that have to be written.
+
+        :param previous: Image that is known to be in the node. If is given
+            the diff is done locally, without reading the node.
+        :type previous: HexImage
+        :param read_back: If there's no ``previous`` image read the program
+            from the node and compare it with the image. If False all the units
+            are written.
+        :type read_back: bool
+        :param units: Units to consider. By default all the units of the
+            image.
+        :return: Sorted indexes of the units to write.
+        """
+        if units is None:
+            units = self.image.units()
+        if previous is not None:
+            return self.image.changed_units(previous, units)
+        if read_back:
+            return self.read_back(units)
+        return units
+
+    def write_frames(self, frames, journal=None):
+        """
+        Write ``frames``, confirming in ``journal`` the units of each frame
+        acknowledged by the node. A frame that fails is left unconfirmed, but
+        if ``FLASH_MAX_FAILURES`` frames fail in a row the link is considered
+        lost and the last error is raised.
+
+        :return: The units that couldn't be confirmed.
+        """
+        unconfirmed = list()
+        failures = 0
+        for frame in frames:
+            frame_area, first, count = frame
+            units = range(first, first + count)
+            try:
+                self.write_frame(frame)
+            except (WriteException, ReadException, ChecksumException) as error:
+                failures += 1
+                logger.warning("Fallo la escritura de {0} bloques desde {1} en el nodo {2}.".format(
+                    count, first, self.node.lan_dir))
+                if failures >= FLASH_MAX_FAILURES:
+                    raise error
+                unconfirmed.extend(units)
+                continue
+            failures = 0
+            if journal is not None:
+                journal.confirm(units)
+        return unconfirmed
+
+    def verify(self, units, journal=None):
+        """
+        Read back ``units`` and write again the ones that don't match the
+        image.
+
+        :return: The units that were written again.
+        """
+        changed = self.read_back(units)
+        if journal is not None:
+            journal.confirm(set(units) - set(changed))
+        for frame in self.frames(changed):
+            self.write_frame(frame)
+            if journal is not None:
+                journal.confirm(range(frame[1], frame[1] + frame[2]))
+        return changed
+
+    def flash(self, previous=None, read_back=True, journal=None, verify=True):
+        """
+        Write the image in the node. The application is deactivated only if
+        there is something to write, and activated at the end if it's
+        inactive and every unit of the image is confirmed.
+
+        ``previous`` and ``read_back`` are the same of :func:`plan`.
+
+        :param journal: Journal of this flash. The units already confirmed in
+            it are skipped, and it's removed once the flash is complete.
+        :type journal: FlashJournal
+        :param verify: Read back the units that couldn't be confirmed while
+            writing and fix them.
+        :type verify: bool
+        :return: dict with the amount of ``units`` in the image, the
+            ``resumed`` units confirmed by the journal, the ``written``
+            units and ``frames`` and the ``unconfirmed`` units.
+        """
+        if self.node.status != 1:
+            self.node.identify()
+        units = self.image.units()
+        pending = units
+        if journal is not None:
+            pending = [unit for unit in units if unit not in journal]
+        unconfirmed = list()
+        try:
+            changed = self.plan(previous=previous, read_back=read_back, units=pending)
+            if journal is not None:
+                journal.confirm(set(pending) - set(changed))
+            frames = self.frames(changed)
+            logger.info("Grabando nodo {0}: {1} de {2} bloques en {3} paquetes.".format(
+                self.node.lan_dir, len(changed), len(units), len(frames)))
+            if frames:
+                requested, active = self.node.check_app_state()
+                if active:
+                    self.node.deactivate_app()
+                unconfirmed = self.write_frames(frames, journal)
+                if unconfirmed and verify:
+                    self.verify(unconfirmed, journal)
+                    unconfirmed = list()
+            if unconfirmed:
+                logger.warning("Nodo {0}: {1} bloques sin confirmar, la aplicacion queda inactiva.".format(
+                    self.node.lan_dir, len(unconfirmed)))
+            else:
+                # Un flash anterior interrumpido pudo dejar la aplicacion
+                # inactiva aunque ya no quede nada por escribir.
+                requested, active = self.node.check_app_state()
+                if not active:
+                    self.node.activate_app()
+            if journal is not None and not unconfirmed:
+                journal.remove()
+        finally:
+            if journal is not None:
+                journal.close()
+        return {'units': len(units),
+                'resumed': len(units) - len(pending),
+                'written': len(changed),
+                'frames': len(frames),
+                'unconfirmed': len(unconfirmed)}
@@ -0,0 +1,157 @@
+"""
+.. module:: autobaud
+    :platform: Unix
+    :synopsis: Detection of the baudrate of a TKLan when the port opens
+
+The old equipments talk at 2400 bps and the new ones, like the TKL693, at
+9600. :func:`calibrate` finds the rate of the bus in two steps:
+
+1. Listen ``CALIBRATION_LISTEN_PERIOD`` seconds at each candidate rate, the
+   fastest first. A rate works if the bytes read chain at least
+   ``CALIBRATION_MIN_FRAMES`` frames with valid checksum that cover
+   ``CALIBRATION_MIN_COVERAGE`` of them. At a wrong rate the bytes are
+   garbage and almost never chain valid frames.
+2. If the bus was silent at every rate there's no master, so the nodes are
+   probed with the function 0 at each rate, the fastest first. The first
+   one that answers gives the rate and the turnaround of the nodes.
+
+The timeout of the port is then set from the time of the longest frame at
+that rate and the turnaround measured.
+"""
+import time
+
+from .cfg import (CALIBRATION_BAUDRATES, CALIBRATION_LISTEN_PERIOD,
+                  CALIBRATION_MIN_COVERAGE, CALIBRATION_MIN_FRAMES,
+                  CALIBRATION_MIN_TIMEOUT, CALIBRATION_PROBE_NODES,
+                  CALIBRATION_PROBE_TIMEOUT, CALIBRATION_TIMEOUT_FACTOR,
+                  MAX_DATA_LENGTH, NODE_TURNAROUND)
+from .containers import Package
+from .decode import validate_checksum
+from .exceptions import ChecksumException, DecodeError, ReadException
+from .utils import get_logger, wire_time
+
+logger = get_logger('autobaud')
+
+MAX_FRAME = MAX_DATA_LENGTH + 3
+
+
+def count_frames(buffer):
+    """
+    Chain the frames of ``buffer`` like :func:`SerialInterface.listen_packages`:
+    after a valid frame the next one starts at its end, if not one byte
+    later.
+
+    :param buffer: Bytes read from the bus.
+    :return: tuple (frames, bytes in the frames).
+    """
+    buffer = bytes(buffer)
+    frames = framed = offset = 0
+    while offset + 3 <= len(buffer):
+        size = (buffer[offset + 1] & 0b00011111) + 3
+        frame = buffer[offset:offset + size]
+        if len(frame) == size and validate_checksum(frame):
+            frames += 1
+            framed += size
+            offset += size
+        else:
+            offset += 1
+    return frames, framed
+
+
+def port_timeout(baudrate, turnaround=None):
+    """
+    :return: Timeout of the port for ``baudrate``: enough for the longest
+        frame and the turnaround of the nodes, with margin.
+    """
+    if turnaround is None:
+        turnaround = NODE_TURNAROUND
+    return max(CALIBRATION_MIN_TIMEOUT,
+               CALIBRATION_TIMEOUT_FACTOR * (wire_time(MAX_FRAME, baudrate) + turnaround))
+
+
+def _listen(ser, period):
+    buffer = bytearray()
+    limit = time.monotonic() + period
+    while time.monotonic() < limit:
+        buffer += ser._read(MAX_FRAME)
+    return buffer
+
+
+def _probe(ser, baudrate, lan_dirs):
+    # Devuelve la demora del primer nodo que responde o None.
+    for lan_dir in lan_dirs:
+        package = Package(destination=lan_dir, function=0)
+        ser._ser.flushInput()
+        started = time.monotonic()
+        try:
+            ser._write(package.bytes_chain)
+            ser.check_echo(package.bytes_chain)
+            answer = ser.listen_package()
+        except (ReadException, ChecksumException, DecodeError, IndexError):
+            continue
+        if answer.sender != lan_dir:
+            continue
+        elapsed = time.monotonic() - started
+        wire = wire_time(len(package.bytes_chain) + len(answer.bytes_chain), baudrate)
+        return max(elapsed - wire, 0.)
+    return None
+
+
+def calibrate(ser, baudrates=CALIBRATION_BAUDRATES, lan_dirs=CALIBRATION_PROBE_NODES,
+              period=CALIBRATION_LISTEN_PERIOD):
+    """
+    Find the baudrate of the bus of ``ser`` and set it, with the timeout
+    for that rate. The port should be open and locked.
+
+    :type ser: :class:`SerialInterface`
+    :param baudrates: Rates to try.
+    :param lan_dirs: Nodes to probe if the bus is silent.
+    :param period: Seconds to listen at each rate.
+    :return: dict with the ``baudrate``, the ``method`` (``'listen'`` or
+        ``'probe'``), the ``frames`` heard, the ``turnaround`` measured
+        (None if listening) and the ``timeout`` set. None if no rate
+        worked; then the port is left as it was.
+    """
+    port = ser._ser
+    original = port.baudrate, port.timeout
+    rates = sorted(baudrates, reverse=True)
+    silent = True
+    port.timeout = min(original[1], period) if original[1] is not None else period
+    for baudrate in rates:
+        port.baudrate = baudrate
+        port.flushInput()
+        buffer = _listen(ser, period)
+        frames, framed = count_frames(buffer)
+        logger.debug("A {0} bps: {1} bytes, {2} paquetes.".format(baudrate, len(buffer), frames))
+        if buffer:
+            silent = False
+        if frames >= CALIBRATION_MIN_FRAMES and framed >= CALIBRATION_MIN_COVERAGE * len(buffer):
+            return _apply(ser, baudrate, 'listen', frames)
+    if silent:
+        # Nadie habla: no hay master y se puede preguntar a los nodos.
+        port.timeout = CALIBRATION_PROBE_TIMEOUT
+        for baudrate in rates:
+            port.baudrate = baudrate
+            turnaround = _probe(ser, baudrate, lan_dirs)
+            if turnaround is not None:
+                return _apply(ser, baudrate, 'probe', 1, turnaround)
+    port.baudrate, port.timeout = original
+    logger.warning("No se pudo detectar la velocidad del bus, se usa {} bps.".format(original[0]))
+    return None
+
+
+def _apply(ser, baudrate, method, frames, turnaround=None):
+    timeout = port_timeout(baudrate, turnaround)
+    ser._ser.baudrate = baudrate
+    ser._ser.timeout = timeout
+    ser._ser.flushInput()
+    ser._baudrate = baudrate
+    ser._timeout = timeout
+    if ser.admission is not None:
+        ser.admission.baudrate = baudrate
+    if ser.meter is not None:
+        ser.meter.baudrate = baudrate
+    logger.info("Bus a {0} bps detectado por {1}, timeout {2:.3f} s.".format(
+        baudrate, method, timeout))
+    return {'baudrate': baudrate, 'method': method, 'frames': frames,
+            'turnaround': turnaround, 'timeout': timeout}
@@ -0,0 +1,565 @@
+"""
+.. module:: broker
+    :platform: Unix
+    :synopsis: Share one :class:`SerialInterface` between several processes
+
+The :class:`Broker` owns the serial port and serves the clients through a
+Unix socket. Every message is a JSON object preceded by its length (4 bytes,
+big endian). The requests have an ``id`` chosen by the client, an ``op`` and
+the parameters of the operation:
+
+* ``send``: ``frame`` (hexadecimal) to send as is. The result is the
+  ``frame`` of the answer.
+* ``read``: ``lan_dir``, ``instance`` (``RAM`` or ``EEPROM``), ``start`` and
+  ``length``. The result has the ``data`` read and the ``timestamp``.
+* ``write``: ``lan_dir``, ``instance``, ``start`` and ``data``. The result is
+  the ``frame`` of the answer.
+* ``subscribe``: like ``read`` plus a ``period`` in seconds, not less than
+  ``min_period``. The result has the number of the ``subscription``, and
+  every reading is pushed to the client as ``{"subscription": n, "data":
+  ..., "timestamp": ...}``. Each client can have up to
+  ``max_subscriptions``.
+* ``unsubscribe``: ``subscription``.
+
+The answer is ``{"id": n, "result": {...}}`` or ``{"id": n, "error": {"type":
+..., "code": ..., "message": ...}}`` and arrives when the operation is done,
+so a client can have many requests pending. The requests also can have a
+``priority``, from 0 to ``BROKER_SUBSCRIPTION_PRIORITY``: the lower are
+sent first. Equal reads pending at the same time are sent to the bus once
+and the answer is given to all of them, and the pending requests are sent
+in batches without releasing the port.
+"""
+import binascii
+import heapq
+import itertools
+import json
+import errno
+import os
+import socket
+import stat
+import struct
+import time
+from threading import Condition, Event, Lock, Thread
+
+from .cfg import (BROKER_BATCH_SIZE, BROKER_MAX_SUBSCRIPTIONS,
+                  BROKER_MIN_PERIOD, BROKER_PRIORITY, BROKER_SOCKET,
+                  BROKER_SOCKET_MODE, BROKER_SUBSCRIPTION_PRIORITY,
+                  MEMO_READ_NAMES, MEMO_WRITE_NAMES)
+from .containers import MemoryContainer, Package
+from .exceptions import BrokerException
+from .utils import get_logger
+
+logger = get_logger('broker')
+
+LENGTH = struct.Struct('>I')
+
+
+def send_message(sock, message):
+    """
+    Send ``message`` (a dict) through ``sock``.
+    """
+    body = json.dumps(message).encode()
+    sock.sendall(LENGTH.pack(len(body)) + body)
+
+
+def _receive(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def receive_message(sock):
+    """
+    :return: The next message of ``sock`` or None if the connection was
+        closed.
+    """
+    header = _receive(sock, LENGTH.size)
+    if header is None:
+        return None
+    body = _receive(sock, LENGTH.unpack(header)[0])
+    if body is None:
+        return None
+    return json.loads(body.decode())
+
+
+def error_message(error):
+    return {'type': error.__class__.__name__,
+            'code': getattr(error, 'code', None),
+            'message': str(error)}
+
+
+class _Job(object):
+    """
+    An operation waiting for the bus, with the functions to call with the
+    answer.
+    """
+
+    def __init__(self, key, package, parse):
+        self.key = key
+        self.package = package
+        self.parse = parse
+        self.waiters = list()
+        self.done = False
+
+
+class _Connection(object):
+    """
+    A client connected to the broker.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._lock = Lock()
+        self.subscriptions = set()
+
+    def send(self, message):
+        with self._lock:
+            try:
+                send_message(self.sock, message)
+            except OSError:
+                pass
+
+    def answer(self, request_id):
+        """
+        :return: Function to give the result of the request ``request_id``.
+        """
+        def waiter(result, error):
+            if error is not None:
+                self.send({'id': request_id, 'error': error_message(error)})
+            else:
+                self.send({'id': request_id, 'result': result})
+        return waiter
+
+
+class Broker(object):
+    """
+    Serve the operations of the clients over a :class:`SerialInterface`.
+    """
+
+    def __init__(self, ser, path=BROKER_SOCKET, batch_size=BROKER_BATCH_SIZE,
+                 mode=BROKER_SOCKET_MODE, min_period=BROKER_MIN_PERIOD,
+                 max_subscriptions=BROKER_MAX_SUBSCRIPTIONS):
+        """
+        :param ser: The interface, started.
+        :type ser: :class:`SerialInterface`
+        :param path: Path of the Unix socket.
+        :type path: str
+        :param batch_size: Amount of requests sent to the bus without
+            releasing the port.
+        :type batch_size: int
+        :param mode: Permissions of the socket.
+        :type mode: int
+        :param min_period: Shortest period of a subscription, in seconds.
+        :type min_period: float
+        :param max_subscriptions: Subscriptions allowed to each client.
+        :type max_subscriptions: int
+        """
+        self.ser = ser
+        self.path = path
+        self.batch_size = batch_size
+        self.mode = mode
+        self.min_period = min_period
+        self.max_subscriptions = max_subscriptions
+        self._queue = list()
+        self._pending = dict()
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._subscriptions = dict()
+        self._subscription_ids = itertools.count(1)
+        self._stop = Event()
+        self._server = None
+        self._threads = list()
+
+    def start(self):
+        """
+        Listen in the socket and start the threads of the bus and the
+        subscriptions. A socket left in ``path`` by a broker that is not
+        running anymore is replaced.
+
+        raises:
+            * BrokerException: If ``path`` exists and is not a socket, or
+                there's a broker listening in it.
+        """
+        self._remove_stale()
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        # Nobody can connect until listen, so the mode is set before.
+        os.chmod(self.path, self.mode)
+        self._server.listen()
+        for target in (self._accept, self._bus, self._schedule):
+            thread = Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Broker escuchando en {}.".format(self.path))
+        return self
+
+    def _remove_stale(self):
+        try:
+            mode = os.lstat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            logger.error("{} existe y no es un socket.".format(self.path))
+            raise BrokerException()
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError as error:
+            if error.errno != errno.ECONNREFUSED:
+                raise
+        else:
+            logger.error("Ya hay un broker escuchando en {}.".format(self.path))
+            raise BrokerException()
+        finally:
+            probe.close()
+        logger.info("Eliminando socket abandonado {}.".format(self.path))
+        os.unlink(self.path)
+
+    def stop(self):
+        logger.info("Parando Broker.")
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def submit(self, key, package, parse, waiter, priority=BROKER_PRIORITY):
+        """
+        Queue an operation. If ``key`` is not None and there's an operation
+        with the same key pending, ``waiter`` is added to it instead.
+
+        :param package: The package to send.
+        :param parse: Function that takes the answer and returns the result.
+        :param waiter: Function called with the result and None, or None and
+            the exception.
+        """
+        with self._condition:
+            job = self._pending.get(key) if key is not None else None
+            if job is None:
+                job = _Job(key, package, parse)
+                if key is not None:
+                    self._pending[key] = job
+            # If it was already pending with a lower priority it moves
+            # forward. The previous entry is discarded when it's taken,
+            # because the job is already done.
+            job.waiters.append(waiter)
+            heapq.heappush(self._queue, (priority, next(self._counter), job))
+            self._condition.notify()
+
+    def _take(self):
+        with self._condition:
+            while not self._queue and not self._stop.is_set():
+                self._condition.wait()
+            jobs = list()
+            while self._queue and len(jobs) < self.batch_size:
+                priority, order, job = heapq.heappop(self._queue)
+                if job.done or job in jobs:
+                    continue
+                jobs.append(job)
+            for job in jobs:
+                job.done = True
+                if job.key is not None:
+                    del self._pending[job.key]
+            return jobs
+
+    def _bus(self):
+        while not self._stop.is_set():
+            jobs = self._take()
+            if not jobs:
+                continue
+            try:
+                answers = self.ser.send_packages([job.package for job in jobs],
+                                                 return_errors=True)
+            except Exception as error:
+                answers = [error] * len(jobs)
+            for job, answer in zip(jobs, answers):
+                result, error = None, None
+                if isinstance(answer, Exception):
+                    error = answer
+                else:
+                    try:
+                        result = job.parse(answer)
+                    except Exception as parse_error:
+                        error = parse_error
+                for waiter in job.waiters:
+                    waiter(result, error)
+
+    def _schedule(self):
+        """
+        Queue the reading of each subscription when its period expires.
+        """
+        while not self._stop.is_set():
+            now = time.monotonic()
+            wait = 1.
+            with self._condition:
+                subscriptions = list(self._subscriptions.items())
+            for number, subscription in subscriptions:
+                if subscription['next'] <= now:
+                    subscription['next'] = now + subscription['period']
+                    try:
+                        self.submit(*subscription['read'], waiter=subscription['waiter'],
+                                    priority=BROKER_SUBSCRIPTION_PRIORITY)
+                    except Exception as error:
+                        # Only this subscription is dropped, the thread
+                        # keeps serving the others.
+                        logger.error("Error en la suscripcion {0}: {1}".format(number, error))
+                        self._drop(subscription['connection'], number)
+                        subscription['waiter'](None, error)
+                        continue
+                wait = min(wait, subscription['next'] - now)
+            self._stop.wait(max(wait, 0))
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                sock, address = self._server.accept()
+            except OSError:
+                return
+            connection = _Connection(sock)
+            Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        logger.info("Nuevo cliente del broker.")
+        try:
+            while not self._stop.is_set():
+                try:
+                    request = receive_message(connection.sock)
+                except (OSError, ValueError):
+                    break
+                if request is None:
+                    break
+                waiter = connection.answer(request.get('id'))
+                try:
+                    self._dispatch(connection, request, waiter)
+                except Exception as error:
+                    waiter(None, error)
+        finally:
+            with self._condition:
+                for subscription in connection.subscriptions:
+                    self._subscriptions.pop(subscription, None)
+            connection.sock.close()
+            logger.info("Cliente del broker desconectado.")
+
+    def _drop(self, connection, number):
+        with self._condition:
+            connection.subscriptions.discard(number)
+            self._subscriptions.pop(number, None)
+
+    def _read(self, request):
+        """
+        :return: tuple (key, package, parse) of the read of ``request``, to
+            give to :func:`submit`.
+
+        raises:
+            * KeyError, ValueError, struct.error or EncodeError: If the
+                parameters of the read are wrong.
+        """
+        lan_dir, instance = int(request['lan_dir']), request['instance']
+        start, length = int(request['start']), int(request['length'])
+        package = Package(destination=lan_dir, function=MEMO_READ_NAMES[instance],
+                          data=struct.pack('2B', start, length))
+
+        def parse(answer):
+            return {'data': binascii.hexlify(answer.data).decode(), 'timestamp': time.time()}
+
+        return ('read', lan_dir, instance, start, length), package, parse
+
+    def _submit_read(self, request, waiter, priority):
+        self.submit(*self._read(request), waiter=waiter, priority=priority)
+
+    def _priority(self, request):
+        priority = int(request.get('priority', BROKER_PRIORITY))
+        if not 0 <= priority <= BROKER_SUBSCRIPTION_PRIORITY:
+            raise ValueError("The priority should be between 0 and {}".format(
+                BROKER_SUBSCRIPTION_PRIORITY))
+        return priority
+
+    def _dispatch(self, connection, request, waiter):
+        operation = request.get('op')
+        priority = self._priority(request)
+        if operation == 'send':
+            package = Package(bytes_chain=binascii.unhexlify(request['frame']))
+            self.submit(None, package, lambda answer: {'frame': answer.hexlified},
+                        waiter, priority)
+        elif operation == 'read':
+            self._submit_read(request, waiter, priority)
+        elif operation == 'write':
+            data = binascii.unhexlify(request['data'])
+            package = Package(destination=int(request['lan_dir']),
+                              function=MEMO_WRITE_NAMES[request['instance']],
+                              data=struct.pack('B', int(request['start'])) + data)
+            self.submit(None, package, lambda answer: {'frame': answer.hexlified},
+                        waiter, priority)
+        elif operation == 'subscribe':
+            period = float(request['period'])
+            if not period >= self.min_period:
+                raise ValueError("The period should be at least {} seconds".format(self.min_period))
+            with self._condition:
+                if len(connection.subscriptions) >= self.max_subscriptions:
+                    raise ValueError("Too many subscriptions (max {})".format(self.max_subscriptions))
+            # A wrong read is rejected now, not when it's scheduled.
+            read = self._read(request)
+            number = next(self._subscription_ids)
+
+            def push(result, error):
+                if error is not None:
+                    connection.send({'subscription': number, 'error': error_message(error)})
+                else:
+                    connection.send(dict(result, subscription=number))
+
+            # Answer before registering it, so the client gets the number
+            # before the first reading.
+            waiter({'subscription': number}, None)
+            with self._condition:
+                self._subscriptions[number] = {
+                    'read': read, 'period': period, 'next': time.monotonic(),
+                    'waiter': push, 'connection': connection}
+                connection.subscriptions.add(number)
+        elif operation == 'unsubscribe':
+            self._drop(connection, int(request['subscription']))
+            waiter({}, None)
+        else:
+            raise BrokerException()
+
+
+class BrokerClient(object):
+    """
+    Client of the :class:`Broker`, with the same operations than
+    :class:`SerialInterface` and :class:`Node`.
+    """
+
+    def __init__(self, path=BROKER_SOCKET, timeout=None):
+        """
+        :param path: Path of the Unix socket of the broker.
+        :param timeout: Seconds to wait each answer. By default forever.
+        """
+        self.timeout = timeout
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._ids = itertools.count(1)
+        self._waiting = dict()
+        self._callbacks = dict()
+        self._lock = Lock()
+        self._send_lock = Lock()
+        self._thread = Thread(target=self._receive, daemon=True)
+        self._thread.start()
+
+    def _receive(self):
+        while True:
+            try:
+                message = receive_message(self._sock)
+            except (OSError, ValueError):
+                message = None
+            if message is None:
+                break
+            if 'subscription' in message and 'id' not in message:
+                callback = self._callbacks.get(message['subscription'])
+                if callback is not None:
+                    callback[0](self._memory(message, callback[1]))
+                continue
+            with self._lock:
+                waiting = self._waiting.pop(message.get('id'), None)
+            if waiting is not None:
+                # The callback of a subscription is registered here, before
+                # reading the first reading sent by the broker.
+                if waiting[2] is not None and 'result' in message:
+                    number = message['result']['subscription']
+                    self._callbacks[number] = (waiting[2], waiting[3])
+                waiting[1] = message
+                waiting[0].set()
+        with self._lock:
+            for waiting in self._waiting.values():
+                waiting[0].set()
+
+    def _memory(self, message, request):
+        if 'error' in message:
+            return BrokerException(message['error'])
+        return MemoryContainer(node=request['lan_dir'], instance=request['instance'],
+                               start=request['start'], timestamp=message['timestamp'],
+                               data=binascii.unhexlify(message['data']))
+
+    def request(self, operation, callback=None, **parameters):
+        """
+        Send a request to the broker and wait the answer.
+
+        :param callback: For ``subscribe``, see :func:`subscribe`.
+        :return: The result.
+
+        raises:
+            * BrokerException: With the error of the broker.
+        """
+        number = next(self._ids)
+        waiting = [Event(), None, callback, parameters]
+        with self._lock:
+            self._waiting[number] = waiting
+        parameters.update({'id': number, 'op': operation})
+        with self._send_lock:
+            send_message(self._sock, parameters)
+        if not waiting[0].wait(self.timeout) or waiting[1] is None:
+            with self._lock:
+                self._waiting.pop(number, None)
+            raise BrokerException()
+        if 'error' in waiting[1]:
+            raise BrokerException(waiting[1]['error'])
+        return waiting[1]['result']
+
+    def send_package(self, package, priority=BROKER_PRIORITY):
+        """
+        Like :func:`SerialInterface.send_package`.
+        """
+        result = self.request('send', frame=package.hexlified, priority=priority)
+        return Package(bytes_chain=binascii.unhexlify(result['frame']))
+
+    def read(self, lan_dir, instance, start, length, priority=BROKER_PRIORITY):
+        """
+        :rtype: :class:`MemoryContainer`
+        """
+        result = self.request('read', lan_dir=lan_dir, instance=instance, start=start,
+                              length=length, priority=priority)
+        return MemoryContainer(node=lan_dir, instance=instance, start=start,
+                               timestamp=result['timestamp'],
+                               data=binascii.unhexlify(result['data']))
+
+    def write(self, lan_dir, instance, start, data, priority=BROKER_PRIORITY):
+        """
+        :return: The answer of the node.
+        :rtype: :class:`Package`
+        """
+        result = self.request('write', lan_dir=lan_dir, instance=instance, start=start,
+                              data=binascii.hexlify(data).decode(), priority=priority)
+        return Package(bytes_chain=binascii.unhexlify(result['frame']))
+
+    def subscribe(self, lan_dir, instance, start, length, period, callback):
+        """
+        Read the memory every ``period`` seconds.
+
+        :param callback: Function called from another thread with each
+            :class:`MemoryContainer` read, or with a :class:`BrokerException`
+            if the reading fails.
+        :return: The number of the subscription.
+        """
+        request = {'lan_dir': lan_dir, 'instance': instance, 'start': start,
+                   'length': length, 'period': period}
+        return self.request('subscribe', callback=callback, **request)['subscription']
+
+    def unsubscribe(self, number):
+        self.request('unsubscribe', subscription=number)
+        self._callbacks.pop(number, None)
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
@@ -0,0 +1,300 @@
+"""
+.. module:: bus_manager
+    :platform: Unix
+    :synopsis: This module only provide the class :class:`BusManager`
+
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from threading import Event, Lock, Thread
+
+from . import retry
+from .apps import AppFlasher, FlashJournal
+from .cfg import (FLASH_JOURNAL_DIR, HEALTH_REPROBE_PERIOD, NODE_STATE_SUFFIX,
+                  PRIORITY_POLLING)
+from .containers import Node
+from .exceptions import ChecksumException, NodeNotExists, ReadException
+from .health import NodeHealth
+from .node_state import NodeState, refresh_order
+from .serial_interface import SerialInterface
+from .utils import get_logger
+
+logger = get_logger('bus_manager')
+
+
+def _low_priority(node, function, *args, shed=True):
+    # La prioridad del control de admision y la politica de reintentos son
+    # por hilo, por eso se fijan en el hilo del bus.
+    with ExitStack() as stack:
+        if node._ser.admission is not None:
+            stack.enter_context(node._ser.admission.priority(PRIORITY_POLLING, shed))
+        stack.enter_context(node._ser.retrying(retry.POLLING))
+        return function(node, *args)
+
+
+def _probe(node):
+    try:
+        node.identify()
+    except (NodeNotExists, ReadException, ChecksumException):
+        return False
+    return True
+
+
+def _refresh(node, state):
+    # Identifica el nodo y vuelve a leer la memoria conocida, de a buffers.
+    node.identify()
+    for instance in ('RAM', 'EEPROM'):
+        for start, length in state.known_ranges(node.lan_dir, instance):
+            for offset in range(start, start + length, node.buffer_size):
+                node._read_memo(offset, min(node.buffer_size, start + length - offset), instance)
+    return node
+
+
+class BusManager(object):
+    """
+    This class handle several TKLan, each one through its own
+    :class:`SerialInterface`.
+
+    Every bus has a worker thread that executes, one after the other, the
+    operations over the nodes of that bus. The operations over different
+    buses run at the same time, so the total throughput grows with the amount
+    of ports. The nodes are addressed globally with tuples (``bus``,
+    ``lan_dir``).
+    """
+
+    def __init__(self, interfaces, state_dir=None, health=True):
+        """
+        :param interfaces: The interfaces of each bus, by bus name. If is a
+            list the position is the name of the bus.
+        :type interfaces: dict | list of :class:`SerialInterface`
+        :param state_dir: Directory where keep a :class:`NodeState` of each
+            bus, to restore the nodes after a restart with :func:`warm_start`.
+        :type state_dir: str
+        :param health: If True follow the :class:`NodeHealth` of each node,
+            so the nodes in quarantine fail at once and are probed in the
+            background (see :func:`reprobe`).
+        :type health: bool
+        """
+        if not isinstance(interfaces, dict):
+            interfaces = dict(enumerate(interfaces))
+        self.interfaces = interfaces
+        self._workers = dict(
+            (bus, ThreadPoolExecutor(max_workers=1,
+                                     thread_name_prefix='bus-{}'.format(bus)))
+            for bus in interfaces)
+        self._nodes = dict()
+        self._nodes_lock = Lock()
+        self.health = health
+        self._stop = Event()
+        self._probes = dict()
+        self._reprobe_thread = Thread(target=self._reprobe, name='reprobe', daemon=True)
+        self.states = dict()
+        if state_dir is not None:
+            self.states = dict(
+                (bus, NodeState(os.path.join(state_dir, '{0}{1}'.format(bus, NODE_STATE_SUFFIX))))
+                for bus in interfaces)
+
+    @classmethod
+    def from_ports(cls, ports, **kwargs):
+        """
+        :param ports: Paths to the serial ports, by bus name or in a list.
+        :param kwargs: Extra arguments for each :class:`SerialInterface`.
+        """
+        if not isinstance(ports, dict):
+            ports = dict(enumerate(ports))
+        return cls(dict((bus, SerialInterface(serial_port=port, **kwargs))
+                        for bus, port in ports.items()))
+
+    def start(self):
+        """
+        Start the connection thread of every interface.
+        """
+        for interface in self.interfaces.values():
+            interface.start()
+        if self.health:
+            self._reprobe_thread.start()
+        return self
+
+    def stop(self):
+        """
+        Wait the pending operations and stop every interface.
+        """
+        logger.info("Parando BusManager.")
+        self._stop.set()
+        for worker in self._workers.values():
+            worker.shutdown(wait=True)
+        for interface in self.interfaces.values():
+            interface.stop()
+        for state in self.states.values():
+            state.close()
+
+    def node(self, address):
+        """
+        :param address: tuple (``bus``, ``lan_dir``)
+        :return: The :class:`Node` of ``address``. Is always the same instance,
+            so the information of the identification is kept.
+        """
+        with self._nodes_lock:
+            node = self._nodes.get(address)
+            if node is None:
+                bus, lan_dir = address
+                node = Node(lan_dir, ser=self.interfaces[bus])
+                node.state = self.states.get(bus)
+                self._nodes[address] = node
+            if self.health and node.health is None:
+                node.health = NodeHealth()
+        return node
+
+    def reprobe(self):
+        """
+        Identify, with low priority, the nodes in quarantine or absent whose
+        next probe is due. The admission control doesn't shed the probes,
+        they wait their turn after the other polls.
+
+        :return: dict with the :class:`concurrent.futures.Future` of each
+            probe, by address. The result is True if the node answered.
+        """
+        futures = dict()
+        with self._nodes_lock:
+            nodes = list(self._nodes.items())
+        for address, node in nodes:
+            pending = self._probes.get(address)
+            if node.health is None or not node.health.probe_due() or \
+                    (pending is not None and not pending.done()):
+                continue
+            futures[address] = self._probes[address] = \
+                self.submit(address, _low_priority, _probe, shed=False)
+        return futures
+
+    def _reprobe(self):
+        while not self._stop.wait(HEALTH_REPROBE_PERIOD):
+            self.reprobe()
+
+    def warm_start(self):
+        """
+        Restore the nodes saved in the states of the buses and refresh them
+        in the background: identify them again and read the memory that was
+        known, starting with the nodes seen longer ago. Meanwhile the saved
+        memory is available with :func:`NodeState.memory`.
+
+        :return: dict with the :class:`concurrent.futures.Future` of the
+            refresh of each node, by address.
+        """
+        restored = dict()
+        for bus, state in self.states.items():
+            for lan_dir, node in state.nodes(ser=self.interfaces[bus]).items():
+                with self._nodes_lock:
+                    self._nodes.setdefault((bus, lan_dir), node)
+                restored[(bus, lan_dir)] = self.node((bus, lan_dir))
+        logger.info("Restaurados {} nodos del estado guardado.".format(len(restored)))
+        return dict((address, self.submit(address, _refresh, self.states[address[0]]))
+                    for address in refresh_order(restored))
+
+    def submit(self, address, function, *args, **kwargs):
+        """
+        Execute ``function(node, *args, **kwargs)`` in the worker of the bus
+        of the node in ``address``.
+
+        :return: :class:`concurrent.futures.Future` with the result.
+        """
+        return self._workers[address[0]].submit(
+            function, self.node(address), *args, **kwargs)
+
+    def map(self, function, addresses, *args, **kwargs):
+        """
+        Execute ``function(node, *args, **kwargs)`` for the node of each
+        address. The nodes of each bus are processed in order and the buses
+        in parallel.
+
+        :return: tuple of two dicts by address: the results of the nodes that
+            succeed and the exceptions of the ones that fail.
+        """
+        futures = dict((address, self.submit(address, function, *args, **kwargs))
+                       for address in addresses)
+        results = dict()
+        errors = dict()
+        for address, future in futures.items():
+            try:
+                results[address] = future.result()
+            except Exception as error:
+                logger.warning("Error en el nodo {0}: {1}".format(address, error))
+                errors[address] = error
+        return results, errors
+
+    def read_ram(self, addresses, start, length):
+        """
+        Read the same range of the RAM of every node in ``addresses``.
+        See :func:`map` for the result.
+        """
+        return self.map(lambda node: node.read_ram(start, length), addresses)
+
+    def read_eeprom(self, addresses, start, length):
+        """
+        Read the same range of the EEPROM of every node in ``addresses``.
+        See :func:`map` for the result.
+        """
+        return self.map(lambda node: node.read_eeprom(start, length), addresses)
+
+    def poll(self, polls):
+        """
+        :param polls: tuples (``address``, ``instance``, ``start``,
+            ``length``) with the memory to read.
+        :return: dict with the :class:`MemoryContainer` read by each poll and
+            dict with the exceptions of the polls that fail. If the interface
+            of the bus has an admission controller the polls have the lowest
+            priority and can fail with :class:`OverloadException`.
+        """
+        futures = dict((poll, self.submit(poll[0], _low_priority, Node._read_memo,
+                                          poll[2], poll[3], poll[1]))
+                       for poll in polls)
+        results = dict()
+        errors = dict()
+        for poll, future in futures.items():
+            try:
+                results[poll] = future.result()
+            except Exception as error:
+                errors[poll] = error
+        return results, errors
+
+    def scan(self, buses=None, lan_dirs=range(1, 16)):
+        """
+        Identify the nodes in ``lan_dirs`` of each bus.
+
+        :param buses: Buses to scan. By default all of them.
+        :return: dict with the :class:`Node` found by address.
+        """
+        if buses is None:
+            buses = list(self.interfaces)
+
+        def identify(node):
+            try:
+                node.identify()
+            except (NodeNotExists, ReadException, ChecksumException):
+                return None
+            return node
+
+        results, errors = self.map(
+            identify, [(bus, lan_dir) for bus in buses for lan_dir in lan_dirs])
+        return dict((address, node) for address, node in results.items()
+                    if node is not None)
+
+    def flash(self, addresses, image, journal_dir=FLASH_JOURNAL_DIR, **kwargs):
+        """
+        Write ``image`` in the nodes of ``addresses`` with :class:`AppFlasher`.
+
+        :param journal_dir: Directory for the :class:`FlashJournal` of each
+            node. If is None the flash is not journaled.
+        :type journal_dir: str
+        :param kwargs: Extra arguments for :func:`AppFlasher.flash`.
+        :return: The reports of :func:`AppFlasher.flash` and the errors, like
+            :func:`map`.
+        """
+        def flash_node(node):
+            journal = None
+            if journal_dir is not None:
+                journal = FlashJournal.for_flash(
+                    image, node.lan_dir, node._ser._serial_port, journal_dir)
+            return AppFlasher(node, image).flash(journal=journal, **kwargs)
+
+        return self.map(flash_node, addresses)
@@ -0,0 +1,154 @@
+"""
+.. module:: bus_reader
+    :platform: Unix
+    :synopsis: Single reader of the bus shared by the listeners
+
+:class:`BusReader` runs :func:`SerialInterface.listen_packages` in its own
+thread and delivers every package observed to the :class:`Subscription` of
+each listener. The port is locked only while each package is read, so while
+the listeners handle the packages, or when we win the token, the other
+threads use :func:`SerialInterface.send_package` without waiting for them::
+
+    reader = BusReader(ser)
+    subscription = reader.subscribe()
+    reader.start()
+    for package in subscription:
+        ...
+
+When we are master nobody else talks in the bus and the reader waits until
+we give the token.
+"""
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+
+from .cfg import BUS_READER_IDLE_PERIOD, BUS_READER_QUEUE_SIZE
+from .deadline import Deadline
+from .exceptions import (ChecksumException, NoSlaveException, ReadException,
+                         WriteException)
+from .utils import get_logger
+
+logger = get_logger('bus_reader')
+
+
+class Subscription(object):
+    """
+    Packages observed by the :class:`BusReader` for one listener. If the
+    listener is slower than the bus the oldest packages are discarded and
+    counted in :attr:`dropped`.
+    """
+
+    def __init__(self, reader, maxsize=BUS_READER_QUEUE_SIZE):
+        self._reader = reader
+        self._packages = deque(maxlen=maxsize)
+        self._condition = Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def _put(self, package):
+        with self._condition:
+            if len(self._packages) == self._packages.maxlen:
+                self.dropped += 1
+            self._packages.append(package)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        :param timeout: Seconds to wait a package, None is forever.
+        :return: The next :class:`Package`, or None if ``timeout`` expired or
+            the subscription was closed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._packages or self.closed, timeout)
+            if self._packages:
+                return self._packages.popleft()
+            return None
+
+    def __iter__(self):
+        while True:
+            package = self.get()
+            if package is None:
+                return
+            yield package
+
+    def close(self):
+        """
+        Stop receiving packages. The iterations over the subscription end.
+        """
+        self._reader._unsubscribe(self)
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class BusReader(object):
+    """
+    The only thread that reads the bus passively, for every listener.
+    """
+
+    def __init__(self, ser):
+        """
+        :param ser: The interface to read.
+        :type ser: :class:`SerialInterface`
+        """
+        self.ser = ser
+        self._subscriptions = list()
+        self._lock = Lock()
+        self._stop = Event()
+        self._deadline = Deadline()
+        self._thread = Thread(target=self._run, name='bus-reader', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop reading and close the subscriptions.
+        """
+        logger.info("Parando BusReader.")
+        self._stop.set()
+        self._deadline.cancel()
+        if self._thread.is_alive():
+            self._thread.join()
+        for subscription in list(self._subscriptions):
+            subscription.close()
+
+    def subscribe(self, maxsize=BUS_READER_QUEUE_SIZE):
+        """
+        :param maxsize: Packages kept while the listener doesn't read them.
+        :rtype: :class:`Subscription`
+        """
+        subscription = Subscription(self, maxsize)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def _publish(self, package):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription._put(package)
+
+    def _run(self):
+        logger.info("Iniciando BusReader.")
+        while not self._stop.is_set():
+            if self.ser.im_master:
+                # Nadie mas habla en el bus hasta que entreguemos el token.
+                self._stop.wait(BUS_READER_IDLE_PERIOD)
+                continue
+            try:
+                for package in self.ser.listen_packages(deadline=self._deadline):
+                    self._publish(package)
+            except NoSlaveException:
+                logger.info("Somos master, se pausa la lectura del bus.")
+            except (ReadException, WriteException, ChecksumException) as error:
+                logger.error("Error leyendo el bus: %s", error)
+                self._stop.wait(BUS_READER_IDLE_PERIOD)
+            else:
+                # La interfaz se detuvo.
+                self._stop.wait(BUS_READER_IDLE_PERIOD)
@@ -0,0 +1,287 @@
+"""
+Record the bytes of the serial port in a capture file and replay them later.
+
+A capture file is a header followed by records appended one after the
+other. Each record has the monotonic time when the bytes were read or
+written, the direction and the length, followed by the bytes::
+
+    header:  'CLPCAP' | version (1 byte) | padding (1 byte)
+    record:  time (float64) | direction (uint8) | length (uint16) | bytes
+
+Every time a capture is opened for writing a ``SESSION`` record is appended
+with the wall clock time that corresponds to the monotonic time 0, so the
+records can be converted to dates even if the monotonic clock was reset
+between sessions.
+"""
+import mmap
+import os
+import struct
+import time
+from collections import deque
+from threading import Lock
+
+from .exceptions import CaptureException
+from .utils import get_logger
+
+logger = get_logger('capture')
+
+HEADER = struct.Struct('<6sBx')
+RECORD = struct.Struct('<dBH')
+MAGIC = b'CLPCAP'
+VERSION = 1
+
+RX = 0
+TX = 1
+SESSION = 2
+
+
+class CaptureWriter(object):
+    """
+    Append records to a capture file. Can be used from several threads.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The capture file. If exists the records are appended.
+        :type path: str
+
+        raises:
+            * CaptureException: If the file exists and is not a capture.
+        """
+        self.path = path
+        self._lock = Lock()
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as capture_file:
+                magic, version = HEADER.unpack(capture_file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise CaptureException()
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+        epoch = time.time() - time.monotonic()
+        self._write(SESSION, struct.pack('<d', epoch))
+        logger.info("Grabando captura en {}.".format(path))
+
+    def _write(self, direction, data):
+        with self._lock:
+            self._file.write(RECORD.pack(time.monotonic(), direction, len(data)))
+            self._file.write(data)
+
+    def record(self, direction, data):
+        """
+        :param direction: ``RX`` for the bytes read or ``TX`` for the bytes
+            written.
+        :param data: The bytes.
+        :type data: bytes
+        """
+        if data:
+            self._write(direction, data)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class CaptureReader(object):
+    """
+    Read the records of a capture file, mapped in memory.
+    """
+
+    def __init__(self, path):
+        """
+        raises:
+            * CaptureException: If the file is not a capture.
+        """
+        self.path = path
+        with open(path, 'rb') as capture_file:
+            if os.fstat(capture_file.fileno()).st_size < HEADER.size:
+                raise CaptureException()
+            self._map = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise CaptureException()
+        self.buffer = memoryview(self._map)
+
+    def __len__(self):
+        return len(self._map)
+
+    def records(self, offset=HEADER.size, end=None, raw=False):
+        """
+        Iterate over the records from the one in ``offset``. A record cut at
+        the end of the file (the capture was interrupted) is ignored.
+
+        :param offset: Position of the first record in the file.
+        :param end: Stop before the record in this position.
+        :param raw: Yield also the ``SESSION`` records and the monotonic time
+            of each record instead of the time since the epoch.
+        :return: generator of tuples (``offset``, ``timestamp``,
+            ``direction``, ``data``). ``timestamp`` is in seconds since the
+            epoch and ``data`` is a ``memoryview`` of the file.
+        """
+        size = len(self._map) if end is None else min(end, len(self._map))
+        epoch = 0.
+        while offset + RECORD.size <= size:
+            monotonic, direction, length = RECORD.unpack_from(self._map, offset)
+            start = offset + RECORD.size
+            if start + length > len(self._map):
+                break
+            if raw:
+                yield offset, monotonic, direction, self.buffer[start:start + length]
+            elif direction == SESSION:
+                epoch = struct.unpack_from('<d', self._map, start)[0]
+            else:
+                yield offset, epoch + monotonic, direction, self.buffer[start:start + length]
+            offset = start + length
+
+    def _valid_chain(self, offset, checks):
+        last = None
+        for i in range(checks):
+            if offset == len(self._map):
+                return True
+            if offset + RECORD.size > len(self._map):
+                return False
+            monotonic, direction, length = RECORD.unpack_from(self._map, offset)
+            if direction > SESSION or (direction == SESSION and length != 8) or \
+                    not 0 <= monotonic < 1e10 or offset + RECORD.size + length > len(self._map):
+                return False
+            if direction != SESSION and last is not None and monotonic < last:
+                return False
+            last = None if direction == SESSION else monotonic
+            offset += RECORD.size + length
+        return True
+
+    def find_record(self, offset, checks=8):
+        """
+        Find the first record that starts at ``offset`` or after it. Used to
+        split a capture in chunks without reading it from the beginning: a
+        position is taken as the start of a record if it's followed by
+        ``checks`` consistent records.
+
+        :return: The position of the record or the size of the file if
+            there's no more records.
+        """
+        offset = max(offset, HEADER.size)
+        while offset < len(self._map):
+            if self._valid_chain(offset, checks):
+                return offset
+            offset += 1
+        return len(self._map)
+
+    def chunks(self, count):
+        """
+        :return: list of the positions where each of ``count`` chunks of
+            similar size start, followed by the size of the file.
+        """
+        size = len(self._map) - HEADER.size
+        bounds = [HEADER.size]
+        for i in range(1, count):
+            bound = self.find_record(HEADER.size + size * i // count)
+            if bound > bounds[-1]:
+                bounds.append(bound)
+        if bounds[-1] != len(self._map):
+            bounds.append(len(self._map))
+        return bounds
+
+    def close(self):
+        self.buffer.release()
+        self._map.close()
+
+
+class ReplaySerial(object):
+    """
+    Replacement of ``serial.Serial`` that plays a capture. The bytes read in
+    the capture are returned by :func:`read` and the bytes written in the
+    capture are consumed by :func:`write`, so it can be used as the port of a
+    :class:`SerialInterface` to run :func:`listen_packages` or
+    :func:`send_package` against a recorded session.
+    """
+
+    def __init__(self, path, speed=None, timeout=0):
+        """
+        :param path: The capture file.
+        :param speed: Factor of the original speed. 1 reproduce the capture
+            with the original timing and None as fast as possible.
+        :type speed: float
+        :param timeout: Unused, for compatibility with ``serial.Serial``.
+        """
+        self.reader = CaptureReader(path)
+        self.speed = speed
+        self.timeout = timeout
+        self.baudrate = None
+        self.port = path
+        self.mismatches = 0
+        self._records = self.reader.records()
+        self._skipped = {RX: deque(), TX: deque()}
+        self._pending = b''
+        self._pending_tx = b''
+        self._first = None
+        self._start = None
+        self._open = True
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        self._open = False
+
+    def isOpen(self):
+        return self._open
+
+    def flushInput(self):
+        pass
+
+    def _wait(self, timestamp):
+        if self.speed is None:
+            return
+        if self._first is None:
+            self._first = timestamp
+            self._start = time.monotonic()
+        delay = self._start + (timestamp - self._first) / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _next(self, direction):
+        """
+        :return: The bytes of the next record in ``direction``, or b'' at the
+            end of the capture. The records in the other direction found in
+            the way are kept for later.
+        """
+        if self._skipped[direction]:
+            return self._skipped[direction].popleft()
+        for offset, timestamp, record_direction, data in self._records:
+            self._wait(timestamp)
+            if record_direction == direction:
+                return bytes(data)
+            self._skipped[record_direction].append(bytes(data))
+        return b''
+
+    def read(self, n=1):
+        data = self._pending
+        while len(data) < n:
+            record = self._next(RX)
+            if not record:
+                break
+            data += record
+        self._pending = data[n:]
+        return data[:n]
+
+    def write(self, data):
+        data = bytes(data)
+        expected = self._pending_tx
+        while len(expected) < len(data):
+            record = self._next(TX)
+            if not record:
+                break
+            expected += record
+        self._pending_tx = expected[len(data):]
+        if expected[:len(data)] != data:
+            self.mismatches += 1
+            logger.warning("La escritura no coincide con la captura.")
+        return len(data)
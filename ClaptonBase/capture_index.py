@@ -0,0 +1,264 @@
+"""
+Index of the frames of a capture file (see :mod:`capture`) for random access.
+
+The index is built once with the process pool of :class:`CaptureAnalyzer`
+and saved next to the capture. It has an array for each field of the frames
+and, for each node, the frames it sent and received sorted by time, so a
+query by time or node is a binary search over the mapped index followed by
+reading only the records of the frames found::
+
+    header:  'CLPIDX' | version | monotonic | frames | capture size | capture mtime
+    arrays:  timestamps, records, skips, sizes, senders, destinations,
+             functions, and for senders and destinations: order, timestamps
+             in that order and first frame of each node
+
+Requires ``numpy`` (``pip install ClaptonBase[analysis]``).
+"""
+import os
+import struct
+
+import numpy as np
+
+from .analyzer import CaptureAnalyzer, frame_times, read_chunk
+from .capture import RX, CaptureReader
+from .cfg import ANALYZER_CHUNK_SIZE, CAPTURE_INDEX_SUFFIX
+from .containers import Package
+from .exceptions import CaptureException
+from .scanner import scan
+from .utils import get_logger
+
+logger = get_logger('capture_index')
+
+HEADER = struct.Struct('<6sB?QQd')
+MAGIC = b'CLPIDX'
+VERSION = 1
+
+# Arrays por paquete, en el orden en que se guardan.
+FRAME_FIELDS = (('timestamps', np.float64), ('records', np.uint64),
+                ('skips', np.uint16), ('sizes', np.uint8), ('senders', np.uint8),
+                ('destinations', np.uint8), ('functions', np.uint8))
+NODE_FIELDS = ('senders', 'destinations')
+
+
+def index_chunk(path, start, end):
+    """
+    Find the frames of the records of the capture ``path`` between ``start``
+    and ``end``. Executed in the processes of the pool.
+
+    :return: dict with an array for each field of :data:`FRAME_FIELDS`, with
+        the monotonic time instead of the timestamp, and the sessions as
+        (amount of frames before, epoch).
+    """
+    reader = CaptureReader(path)
+    try:
+        stream, size, positions, times, records, sessions = read_chunk(reader, start, end)
+    finally:
+        reader.close()
+    frames = scan(stream, size)
+    record = np.searchsorted(positions, frames.offsets, 'right') - 1
+    return {
+        'timestamps': frame_times(frames, positions, times),
+        'records': np.asarray(records, dtype=np.uint64)[record],
+        'skips': frames.offsets - np.asarray(positions, dtype=np.intp)[record],
+        'sizes': frames.sizes,
+        'senders': frames.senders,
+        'destinations': frames.destinations,
+        'functions': frames.functions,
+        'sessions': [(int(np.searchsorted(frames.offsets, position)), epoch)
+                     for position, epoch in sessions],
+    }
+
+
+def _layout(count):
+    """
+    :return: list of (``name``, ``dtype``, ``offset``, ``length``) of each
+        array of an index of ``count`` frames, aligned to 8 bytes.
+    """
+    arrays = [(name, dtype, count) for name, dtype in FRAME_FIELDS]
+    for field in NODE_FIELDS:
+        arrays += [(field + '_order', np.uint64, count),
+                   (field + '_timestamps', np.float64, count),
+                   (field + '_bounds', np.uint64, 17)]
+    layout = list()
+    offset = HEADER.size + (-HEADER.size % 8)
+    for name, dtype, length in arrays:
+        layout.append((name, dtype, offset, length))
+        offset += length * np.dtype(dtype).itemsize
+        offset += -offset % 8
+    return layout
+
+
+class CaptureIndex(object):
+    """
+    Index of the frames of a capture file.
+    """
+
+    def __init__(self, capture_path, index_path=None):
+        """
+        Open an index already built. See :func:`open` to build it if needed.
+
+        :param capture_path: The capture file.
+        :param index_path: The index file. By default the name of the capture
+            with :data:`CAPTURE_INDEX_SUFFIX`.
+
+        raises:
+            * CaptureException: If the index is not valid or is older than
+              the capture.
+        """
+        self.capture_path = capture_path
+        self.index_path = index_path or capture_path + CAPTURE_INDEX_SUFFIX
+        with open(self.index_path, 'rb') as index_file:
+            header = index_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise CaptureException()
+        magic, version, self.monotonic, count, capture_size, capture_mtime = \
+            HEADER.unpack(header)
+        capture = os.stat(capture_path)
+        if magic != MAGIC or version != VERSION or \
+                (capture_size, capture_mtime) != (capture.st_size, capture.st_mtime):
+            raise CaptureException()
+        self._count = count
+        self._map = np.memmap(self.index_path, dtype=np.uint8, mode='r')
+        for name, dtype, offset, length in _layout(count):
+            size = length * np.dtype(dtype).itemsize
+            setattr(self, name, self._map[offset:offset + size].view(dtype))
+        self._reader = None
+
+    @classmethod
+    def build(cls, capture_path, index_path=None, workers=None,
+              chunk_size=ANALYZER_CHUNK_SIZE):
+        """
+        Build the index of ``capture_path`` in parallel and open it.
+
+        :param workers: See :class:`CaptureAnalyzer`.
+        :param chunk_size: See :class:`CaptureAnalyzer`.
+        :rtype: :class:`CaptureIndex`
+        """
+        index_path = index_path or capture_path + CAPTURE_INDEX_SUFFIX
+        capture = os.stat(capture_path)
+        analyzer = CaptureAnalyzer(capture_path, workers=workers, chunk_size=chunk_size)
+        results = analyzer._map(index_chunk, [(capture_path, start, end)
+                                              for start, end in analyzer.chunks()])
+        arrays = dict((name, np.concatenate([result[name] for result in results]).astype(dtype))
+                      for name, dtype in FRAME_FIELDS)
+        # Los tiempos de cada bloque se pasan a fechas con la sesion vigente.
+        epochs = list()
+        epoch = 0.
+        for result in results:
+            chunk_epochs = np.full(len(result['sizes']), epoch)
+            for index, session_epoch in result['sessions']:
+                chunk_epochs[index:] = session_epoch
+                epoch = session_epoch
+            epochs.append(chunk_epochs)
+        arrays['timestamps'] += np.concatenate(epochs)
+        count = len(arrays['sizes'])
+        monotonic = bool(np.all(np.diff(arrays['timestamps']) >= 0))
+        for field in NODE_FIELDS:
+            order = np.argsort(arrays[field], kind='stable')
+            arrays[field + '_order'] = order.astype(np.uint64)
+            arrays[field + '_timestamps'] = arrays['timestamps'][order]
+            bounds = np.zeros(17, dtype=np.uint64)
+            bounds[1:] = np.cumsum(np.bincount(arrays[field], minlength=16))
+            arrays[field + '_bounds'] = bounds
+        temporary = index_path + '.tmp'
+        with open(temporary, 'wb') as index_file:
+            index_file.write(HEADER.pack(MAGIC, VERSION, monotonic, count,
+                                         capture.st_size, capture.st_mtime))
+            for name, dtype, offset, length in _layout(count):
+                index_file.write(b'\x00' * (offset - index_file.tell()))
+                index_file.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        os.replace(temporary, index_path)
+        logger.info("Indexados {0} paquetes de la captura {1}.".format(count, capture_path))
+        return cls(capture_path, index_path)
+
+    @classmethod
+    def open(cls, capture_path, index_path=None, **kwargs):
+        """
+        Open the index of ``capture_path``, building it if doesn't exist or
+        the capture changed.
+
+        :param kwargs: Extra arguments for :func:`build`.
+        :rtype: :class:`CaptureIndex`
+        """
+        try:
+            return cls(capture_path, index_path)
+        except (OSError, CaptureException):
+            return cls.build(capture_path, index_path, **kwargs)
+
+    def __len__(self):
+        return self._count
+
+    def _window(self, timestamps, start, end, base=0):
+        first = base if start is None else base + int(np.searchsorted(timestamps, start, 'left'))
+        last = base + len(timestamps) if end is None else \
+            base + int(np.searchsorted(timestamps, end, 'right'))
+        return first, last
+
+    def select(self, start=None, end=None, node=None):
+        """
+        :param start: First timestamp (included), in seconds since the epoch.
+        :param end: Last timestamp (included).
+        :param node: Only the frames sent or received by this ``lan_dir``.
+        :return: array with the numbers of the frames found, in order.
+        """
+        if node is None:
+            if not self.monotonic:
+                return self._filter(np.arange(self._count), start, end)
+            return np.arange(*self._window(self.timestamps, start, end))
+        found = list()
+        for field in NODE_FIELDS:
+            order = getattr(self, field + '_order')
+            bounds = getattr(self, field + '_bounds')
+            first, last = int(bounds[node]), int(bounds[node + 1])
+            if not self.monotonic:
+                found.append(self._filter(order[first:last].astype(np.intp), start, end))
+                continue
+            timestamps = getattr(self, field + '_timestamps')[first:last]
+            first, last = self._window(timestamps, start, end, first)
+            found.append(order[first:last].astype(np.intp))
+        return np.union1d(*found)
+
+    def _filter(self, frames, start, end):
+        timestamps = self.timestamps[frames]
+        mask = np.ones(len(frames), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps <= end
+        return frames[mask]
+
+    def frame(self, number):
+        """
+        :return: tuple (``timestamp``, :class:`Package`) of the frame
+            ``number``, read from the capture.
+        """
+        if self._reader is None:
+            self._reader = CaptureReader(self.capture_path)
+        skip = int(self.skips[number])
+        size = int(self.sizes[number])
+        chain = bytearray()
+        for offset, monotonic, direction, data in self._reader.records(
+                int(self.records[number]), raw=True):
+            if direction == RX:
+                chain += data
+                if len(chain) >= skip + size:
+                    break
+        return float(self.timestamps[number]), Package(bytes_chain=bytes(chain[skip:skip + size]))
+
+    def frames(self, start=None, end=None, node=None):
+        """
+        Iterate over the frames selected like :func:`select`.
+
+        :return: generator of tuples (``timestamp``, :class:`Package`).
+        """
+        for number in self.select(start, end, node).tolist():
+            yield self.frame(number)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        # El archivo se libera cuando no queda ninguna referencia a los arrays.
+        for name, dtype, offset, length in _layout(self._count):
+            setattr(self, name, None)
+        self._map = None
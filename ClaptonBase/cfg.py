@@ -1,3 +1,4 @@
+import os
 import re
 
 # Grabacion de aplicacion
@@ -5,10 +6,88 @@ GRABA_MAX_BYTES = 8
 APP_LINE_SIZE = 8
 APP_INIT_CONFIG = 8192
 APP_INIT_E2 = 8448
+# Palabra de memoria de programa borrada (0x3FFF en little endian). Se usa
+# para completar los bytes que el archivo HEX no define.
+APP_BLANK_WORD = b'\xff\x3f'
+APP_READ_FUNCTION = 5
+APP_WRITE_FUNCTION = 6
+APP_ACTIVATE_DATA = b'\x00\x00\xa5\x05'
+APP_DEACTIVATE_DATA = b'\x00\x01\xff\xff'
+# Cada cuanto se consulta si la aplicacion se detuvo al desactivarla y
+# tiempo maximo de espera, en segundos.
+APP_DEACTIVATE_POLL_PERIOD = .1
+APP_DEACTIVATE_TIMEOUT = 5.
+# Codigos de error de la funcion 6 (ver notas sobre grabacion de programa)
+APP_WRITE_ERRORS = (b'\x03', b'\x04', b'\x05', b'\x06')
+# Directorio donde se guarda el progreso de cada grabacion para poder
+# retomarla, y cantidad de paquetes seguidos fallidos antes de abandonar.
+FLASH_JOURNAL_DIR = os.path.expanduser('~/.clapton/journal')
+FLASH_MAX_FAILURES = 3
+# Extension del archivo con la imagen ya procesada de cada archivo HEX.
+HEX_CACHE_SUFFIX = '.clpcache'
+
+# Analisis de capturas
+# Tamanio aproximado en bytes de cada bloque que se procesa en paralelo.
+ANALYZER_CHUNK_SIZE = 64 * 1024 * 1024
+# Limites superiores (en segundos) del histograma de tiempo entre paquetes.
+ANALYZER_GAP_BINS = (.001, .005, .01, .05, .1, .5, 1., 5.)
+# Extension del indice de paquetes de cada captura.
+CAPTURE_INDEX_SUFFIX = '.clpidx'
 
 # Puerto serie
 DEFAULT_BAUDRATE = 2400
 DEFAULT_SERIAL_TIMEOUT = .25
+# Bits en la linea por cada byte (8N1: inicio, 8 de datos y parada).
+BITS_PER_BYTE = 10
+# Deteccion de la velocidad del bus (ver autobaud.py): velocidades a probar,
+# segundos de escucha en cada una, paquetes validos y fraccion de los bytes
+# leidos que tienen que cubrir, nodos a consultar si el bus esta en
+# silencio y timeout de esas consultas, y el timeout resultante como
+# multiplo del tiempo del paquete mas largo mas la demora del nodo.
+CALIBRATION_BAUDRATES = (2400, 9600)
+CALIBRATION_LISTEN_PERIOD = .5
+CALIBRATION_MIN_FRAMES = 3
+CALIBRATION_MIN_COVERAGE = .9
+CALIBRATION_PROBE_NODES = range(1, 16)
+CALIBRATION_PROBE_TIMEOUT = .2
+CALIBRATION_TIMEOUT_FACTOR = 2.
+CALIBRATION_MIN_TIMEOUT = .05
+# Tamanio inicial del buffer de lectura de los transportes (ver transports.py),
+# tiempo maximo para escribir y para conectar con un servidor de terminales.
+TRANSPORT_BUFFER_SIZE = 64
+TRANSPORT_WRITE_TIMEOUT = 1.
+TCP_CONNECT_TIMEOUT = 5
+
+# Broker
+# Socket donde escucha el broker y sus permisos, cantidad de pedidos que se
+# envian sin liberar el puerto y prioridades (menor es mas urgente).
+BROKER_SOCKET = '/tmp/clapton-broker.sock'
+BROKER_SOCKET_MODE = 0o660
+BROKER_BATCH_SIZE = 16
+BROKER_PRIORITY = 5
+BROKER_SUBSCRIPTION_PRIORITY = 9
+# Periodo minimo de una suscripcion y suscripciones por cliente.
+BROKER_MIN_PERIOD = .05
+BROKER_MAX_SUBSCRIPTIONS = 32
+
+# Control de admision (ver admission.py)
+# Clases de prioridad de los pedidos al bus.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_POLLING = 2
+# Cantidad maxima de pedidos esperando en cada clase y tiempo maximo de
+# espera en segundos (None es sin limite). Los pedidos de polling que
+# superan la espera se descartan.
+ADMISSION_QUEUE_LIMITS = (8, 32, 16)
+ADMISSION_MAX_WAIT = (None, None, 1.)
+# Tiempo estimado que tarda un nodo en empezar a responder y tamanio
+# estimado de la respuesta a la funcion 0.
+NODE_TURNAROUND = .005
+IDENTIFY_ANSWER_SIZE = 11
+# Ocupacion maxima del bus por tareas periodicas para que un plan sea
+# factible (ver planner.py) y ventana en segundos de la medicion del trafico.
+PLANNER_MAX_OCCUPANCY = .8
+METER_WINDOW = 60.
 
 # PERIODOS
 # STATUS_PERIOD define el intervalo de tiempo en el que se reporta el estado
@@ -16,7 +95,27 @@ DEFAULT_SERIAL_TIMEOUT = .25
 
 WAIT_MASTER_PERIOD = 2
 MASTER_EVENT_TIMEOUT = 20
+# Tiempo maximo en segundos que se retiene el token en modo esclavo para
+# enviar los paquetes encolados antes de devolverlo.
+TOKEN_BURST_BUDGET = 1.
 SEND_PACKAGE_TRIES = 3
+# Cada cuanto se revisa si una operacion con tiempo limite fue cancelada
+# mientras espera el puerto.
+DEADLINE_POLL_PERIOD = .05
+# Paquetes que guarda el BusReader para cada suscriptor y cada cuanto
+# revisa si dejamos de ser master.
+BUS_READER_QUEUE_SIZE = 256
+BUS_READER_IDLE_PERIOD = .1
+# Politicas de reintento (ver retry.py): espera maxima entre intentos, espera
+# al azar maxima luego de una colision, reintentos y tiempo limite de las
+# lecturas periodicas, y reintentos y espera inicial de la escritura de
+# programas.
+RETRY_MAX_DELAY = 1.
+COLLISION_DELAY = .02
+POLLING_RETRIES = 1
+POLLING_DEADLINE = .5
+PERSISTENT_RETRIES = 10
+PERSISTENT_DELAY = .05
 # LOGS
 LOG_FILE = None
 LOG_LEVEL = 'DEBUG'
@@ -26,6 +125,9 @@ DEFAULT_BUFFER = 3
 DEFAULT_EEPROM = 20
 DEFAULT_RAM_READ = 20
 DEFAULT_RAM_WRITE = 20
+# Tamanio de la memoria de programa en palabras. La configuracion empieza
+# justo despues.
+DEFAULT_APP_SIZE = APP_INIT_CONFIG
 DEFAULT_REQUIRED_NODE = True
 DEFAULT_REQUIRED_EEPROM = True
 DEFAULT_REQUIRED_RAM = True
@@ -34,6 +136,42 @@ DEFAULT_CONN_PORT = 5555
 MSG_CON_PREFIX = 'con'
 MSG_NODE_PREFIX = 'node'
 MSG_MASTER_PREFIX = 'master'
+MSG_MEMORY_PREFIX = 'memo'
+# Version del formato binario de los mensajes del Publisher.
+PUBLISHER_VERSION = 1
+# Version del formato binario de to_bytes/from_buffer de los contenedores.
+SERIALIZATION_VERSION = 1
+
+# Imagen de memoria compartida (ver shared_image.py)
+# Bytes de cada instancia de memoria por nodo y bytes de cada region con su
+# propio numero de secuencia.
+SHARED_IMAGE_MEMORY_SIZE = 256
+SHARED_IMAGE_REGION_SIZE = 32
+# Intentos de leer una copia consistente mientras el escritor escribe.
+SHARED_IMAGE_READ_TRIES = 10000
+
+# Estados de los nodos (ver Node.status y health.py)
+NODE_NEVER_SEEN = 0
+NODE_OK = 1
+NODE_QUARANTINE = 2
+NODE_ABSENT = 3
+NODE_SUSPECT = 4
+# Salud de los nodos: transacciones para calcular la tasa de fallas, tasa
+# desde la que el nodo es sospechoso, fallas seguidas para la cuarentena,
+# pruebas fallidas para considerarlo ausente, espera inicial y maxima entre
+# pruebas y periodo con que el BusManager busca pruebas pendientes.
+HEALTH_WINDOW = 10
+HEALTH_SUSPECT_RATE = .3
+HEALTH_QUARANTINE_FAILURES = 3
+HEALTH_ABSENT_PROBES = 5
+HEALTH_BACKOFF = (1., 60.)
+HEALTH_REPROBE_PERIOD = 1.
+
+# Estado persistente de los nodos (ver node_state.py)
+# Bytes guardados de cada instancia de memoria por nodo y extension de los
+# archivos de estado de cada bus.
+NODE_STATE_MEMORY_SIZE = 256
+NODE_STATE_SUFFIX = '.state'
 COMMAND_SEPARATOR = '\n'
 CON_STATUS_PERIOD = 1
 
@@ -43,6 +181,7 @@ APP_DEACTIVATE_RESPONSE = b'\x00'
 # PAQUETES
 LINE_REGEX = re.compile(
     r':([0-9A-F]{2})([0-9A-F]{2})([0-9A-F]{2})([0-9A-F]{2})([0-9A-F]+)$')
+MAX_DATA_LENGTH = 31
 TOKEN_OFFER_RTA_SIZE = 5
 TOKEN_ACCEPTANCE_RTA_SIZE = 5
 # INFORMACION DE FUNCIONES
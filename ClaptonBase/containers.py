@@ -1,19 +1,55 @@
 import binascii
+import math
 import struct
 import sys
 import time
+import warnings
+from threading import Event, Lock
 
 from . import decode, encode
-from .cfg import (APP_LINE_SIZE, COMMAND_SEPARATOR, DEFAULT_BUFFER,
-                  DEFAULT_EEPROM, DEFAULT_RAM_READ, DEFAULT_RAM_WRITE,
-                  MEMO_READ_NAMES, MEMO_WRITE_NAMES, READ_FUNCTIONS,
-                  WRITE_FUNCTIONS)
-from .exceptions import (ChecksumException, InvalidPackage,
-                         NodeNotExists, WriteException)
+from .cfg import (APP_ACTIVATE_DATA, APP_ACTIVATE_RESPONSE,
+                  APP_DEACTIVATE_DATA, APP_DEACTIVATE_POLL_PERIOD,
+                  APP_DEACTIVATE_RESPONSE, APP_DEACTIVATE_TIMEOUT, APP_LINE_SIZE,
+                  APP_READ_FUNCTION, APP_WRITE_ERRORS, APP_WRITE_FUNCTION,
+                  COMMAND_SEPARATOR, DEFAULT_APP_SIZE, DEFAULT_BUFFER,
+                  DEFAULT_EEPROM,
+                  DEFAULT_RAM_READ, DEFAULT_RAM_WRITE, GRABA_MAX_BYTES,
+                  MAX_DATA_LENGTH, MEMO_READ_NAMES, MEMO_WRITE_NAMES, NODE_OK,
+                  READ_FUNCTIONS, SERIALIZATION_VERSION, WRITE_FUNCTIONS)
+from .exceptions import (ActiveAppException, AppWriteException,
+                         ChecksumException, CollisionException, DecodeError,
+                         InactiveAppException,
+                         InvalidPackage, NodeNotExists, QuarantineException,
+                         ReadException, WriteException)
 from .utils import get_logger
 
 logger = get_logger('containers')
 
+# Formato binario de to_bytes/from_buffer. Todos empiezan con la version.
+PACKAGE_HEADER = struct.Struct('<B')
+MEMORY_HEADER = struct.Struct('<BBBHdH')
+NODE_DESCRIPTOR = struct.Struct('<BBB?HHHHId')
+BATCH_HEADER = struct.Struct('<BBI')
+INSTANCE_CODES = {'RAM': 0, 'EEPROM': 1}
+INSTANCE_NAMES = dict((code, name) for name, code in INSTANCE_CODES.items())
+
+
+def _unpack_header(header, view, offset):
+    """
+    :return: The fields of ``header`` in ``view`` at ``offset``, without the
+        version.
+
+    raises:
+        * DecodeError: If ``view`` is too short or has another version.
+    """
+    try:
+        fields = header.unpack_from(view, offset)
+    except struct.error:
+        raise DecodeError()
+    if fields[0] != SERIALIZATION_VERSION:
+        raise DecodeError()
+    return fields[1:]
+
 class Package(object):
     """
     This class represent a TKLan package.
@@ -115,6 +151,55 @@ class Package(object):
                 'Las funciones de escritura de aplicacion siempre tienen que '
                 'tener longitud de datos mayor a 1.')
 
+    @property
+    def encoded_size(self):
+        """
+        Length of the result of :func:`to_bytes`.
+        """
+        return PACKAGE_HEADER.size + len(self.bytes_chain)
+
+    def pack_into(self, buffer, offset=0):
+        """
+        Write the binary encoding of the package in ``buffer`` at ``offset``.
+
+        :return: The offset after the package.
+        """
+        PACKAGE_HEADER.pack_into(buffer, offset, SERIALIZATION_VERSION)
+        offset += PACKAGE_HEADER.size
+        buffer[offset:offset + len(self.bytes_chain)] = self.bytes_chain
+        return offset + len(self.bytes_chain)
+
+    def to_bytes(self):
+        """
+        :return: The version of the encoding followed by ``bytes_chain``.
+        """
+        buffer = bytearray(self.encoded_size)
+        self.pack_into(buffer)
+        return bytes(buffer)
+
+    @classmethod
+    def from_buffer(cls, buffer, offset=0):
+        """
+        Read a package encoded with :func:`to_bytes`. Only the frame is
+        copied, because the decoders work over ``bytes``.
+
+        :param buffer: bytes, bytearray or memoryview.
+        :param offset: Where the package starts in ``buffer``.
+
+        raises:
+            * DecodeError: If ``buffer`` has not a package at ``offset``.
+            * ChecksumException: If the frame is not valid.
+        """
+        view = memoryview(buffer)
+        _unpack_header(PACKAGE_HEADER, view, offset)
+        start = offset + PACKAGE_HEADER.size
+        if len(view) < start + 3:
+            raise DecodeError()
+        end = start + (view[start + 1] & 0b00011111) + 3
+        if len(view) < end:
+            raise DecodeError()
+        return cls(bytes_chain=bytes(view[start:end]))
+
 
 class MemoryContainer(object):
     """
@@ -137,7 +222,7 @@ class MemoryContainer(object):
         :type timestamp: float
         :param data: Bytes reader from the memory ``instance`` of the ``node``
             at ``timestamp`` time.
-        :type data: bytes
+        :type data: bytes | memoryview
 
         raises:
             * AttributeError when ``node`` don't acomplish the requirements
@@ -149,7 +234,7 @@ class MemoryContainer(object):
             raise AttributeError
         if instance not in MEMO_READ_NAMES.keys():
             raise AttributeError
-        if not isinstance(data, bytes):
+        if not isinstance(data, (bytes, memoryview)):
             raise AttributeError
 
         self.timestamp = timestamp
@@ -171,6 +256,57 @@ class MemoryContainer(object):
             self.timestamp,
             binascii.hexlify(self.data).decode())
 
+    @property
+    def encoded_size(self):
+        """
+        Length of the result of :func:`to_bytes`.
+        """
+        return MEMORY_HEADER.size + self.length
+
+    def pack_into(self, buffer, offset=0):
+        """
+        Write the binary encoding of the container in ``buffer`` at
+        ``offset``: version, node, instance, start, timestamp (NaN if None),
+        length and the data.
+
+        :return: The offset after the container.
+        """
+        MEMORY_HEADER.pack_into(
+            buffer, offset, SERIALIZATION_VERSION, self.node, INSTANCE_CODES[self.instance],
+            self.start, math.nan if self.timestamp is None else self.timestamp, self.length)
+        offset += MEMORY_HEADER.size
+        buffer[offset:offset + self.length] = self.data
+        return offset + self.length
+
+    def to_bytes(self):
+        """
+        Binary alternative to :func:`as_msg`, see :func:`pack_into`.
+        """
+        buffer = bytearray(self.encoded_size)
+        self.pack_into(buffer)
+        return bytes(buffer)
+
+    @classmethod
+    def from_buffer(cls, buffer, offset=0):
+        """
+        Read a container encoded with :func:`to_bytes`. The ``data`` of the
+        container is a memoryview of ``buffer``, without copying it.
+
+        :param buffer: bytes, bytearray or memoryview.
+        :param offset: Where the container starts in ``buffer``.
+
+        raises:
+            * DecodeError: If ``buffer`` has not a container at ``offset``.
+        """
+        view = memoryview(buffer)
+        node, instance, start, timestamp, length = _unpack_header(MEMORY_HEADER, view, offset)
+        offset += MEMORY_HEADER.size
+        if len(view) < offset + length or instance not in INSTANCE_NAMES:
+            raise DecodeError()
+        return cls(node, INSTANCE_NAMES[instance], start,
+                   timestamp=None if math.isnan(timestamp) else timestamp,
+                   data=view[offset:offset + length])
+
     def get(self, index, default_value=None):
         """
         returns the bytes corresonding to the given ``index`` or ``default_value``
@@ -181,9 +317,66 @@ class MemoryContainer(object):
         return self.data[index-self.start:index-self.start+1]
 
 
+class _ReadFlight(object):
+    """
+    A memory read of a node that is in progress. The threads that need a
+    range covered by it wait for its result instead of reading again.
+    """
+
+    def __init__(self, instance, start, length):
+        self.instance = instance
+        self.start = start
+        self.length = length
+        self.memory = None
+        self.error = None
+        self._done = Event()
+
+    def covers(self, instance, start, length):
+        return instance == self.instance and self.start <= start and \
+            start + length <= self.start + self.length
+
+    def finish(self, memory=None, error=None):
+        self.memory = memory
+        self.error = error
+        self._done.set()
+
+    def wait(self, start, length, deadline=None):
+        """
+        :param deadline: Time limit of the caller, that can expire before the
+            read ends.
+        :type deadline: :class:`Deadline`
+        :return: :class:`MemoryContainer` with the part of the result from
+            ``start``.
+
+        raises:
+            * The exception of the read.
+            * DeadlineException or CancelledException: If ``deadline``
+                expires or is cancelled first.
+        """
+        if deadline is None:
+            self._done.wait()
+        else:
+            while not self._done.wait(deadline.slice()):
+                deadline.check()
+        if self.error is not None:
+            raise self.error
+        offset = start - self.start
+        return MemoryContainer(node=self.memory.node,
+                               instance=self.instance,
+                               start=start,
+                               timestamp=self.memory.timestamp,
+                               data=self.memory.data[offset:offset + length])
+
+
 class Node(object):
     """
     Representation of a Node in the TKLan network.
+
+    The reads of the memory of a node are coalesced: if a thread asks for a
+    range already covered by a read in progress of the same instance of
+    :class:`Node`, it waits that read and gets its part of the result
+    instead of sending another package to the bus. So the threads that poll
+    the same node should share its instance.
     """
 
 
@@ -226,6 +419,21 @@ class Node(object):
         self.eeprom_size = DEFAULT_EEPROM
         self.ram_read_size = DEFAULT_RAM_READ
         self.ram_write_size = DEFAULT_RAM_WRITE
+        # Tamanio de la memoria de programa en palabras.
+        self.app_size = DEFAULT_APP_SIZE
+
+        # Estado de la aplicacion. None hasta que se lea LAB_GEN.
+        self.app_active = None
+        self.deactivation_requested = None
+
+        # Lecturas de memoria en curso (ver _ReadFlight).
+        self._flights = list()
+        self._flights_lock = Lock()
+
+        # NodeState donde se guarda el nodo y su memoria, si hay.
+        self.state = None
+        # NodeHealth que sigue las transacciones del nodo, si hay.
+        self.health = None
 
     @property
     def status(self):
@@ -239,6 +447,9 @@ class Node(object):
             so he has to wait until the master ask something to the
             node in qquarantine and he response.
             * 3: Don't exist.
+            * 4: Suspect. Some of the last transactions failed.
+
+        The states 2 to 4 are set by :attr:`health`, see :mod:`health`.
         """
         return self._status
 
@@ -257,10 +468,57 @@ class Node(object):
         self._status = value
         if value == 1:
             self.last_seen = time.time()
+        if self.state is not None:
+            self.state.save_node(self)
+
+    def _send(self, send, packages):
+        """
+        Execute ``send(packages)`` following the :attr:`health` of the node.
+        Only the errors of the node count as failures: a collision, or an
+        error before reaching the bus, releases the probe and nothing else.
+
+        raises:
+            * QuarantineException: If the node is in quarantine, without
+              sending anything.
+            * The exceptions of ``send``.
+        """
+        health = self.health
+        if health is None:
+            return send(packages)
+        if not health.allow():
+            raise QuarantineException()
+        try:
+            answer = send(packages)
+        except (WriteException, ReadException, ChecksumException) as error:
+            if isinstance(error, CollisionException) or \
+                    isinstance(error.__cause__, CollisionException):
+                # Hablo otro nodo, no dice nada del nodo destino.
+                health.release()
+            else:
+                self._health_changed(health.failure())
+            raise
+        except BaseException:
+            health.release()
+            raise
+        self._health_changed(health.success())
+        return answer
+
+    def _send_package(self, package):
+        return self._send(self._ser.send_package, package)
+
+    def _send_packages(self, packages):
+        return self._send(self._ser.send_packages, packages)
+
+    def _health_changed(self, state):
+        if state != self._status:
+            logger.info("Nodo {0} pasa al estado {1}.".format(self.lan_dir, state))
+            self.status = state
+        elif state == NODE_OK:
+            self.last_seen = time.time()
 
     def _get_package_zero(self):
         ask_package_zero = Package(destination=self.lan_dir, function=0)
-        package_zero = self._ser.send_package(ask_package_zero)
+        package_zero = self._send_package(ask_package_zero)
         return package_zero
 
     def _get_buffer_size(self, package_zero=b''):
@@ -324,7 +582,9 @@ class Node(object):
             self.status = 1
         except WriteException as e:
             logger.error("El nodo {} no existe.".format(self.lan_dir))
-            self.status = 3
+            # Con health el estado depende de las fallas acumuladas.
+            if self.health is None:
+                self.status = 3
             raise NodeNotExists
 
     def read_ram(self, start, length):
@@ -411,6 +671,197 @@ class Node(object):
             raise AttributeError("The length of the data to write is out of range (max buffer %s)", self.buffer_size)
         return self._write_memo(start, data, instance='EEPROM')
 
+    def check_app_state(self):
+        """
+        Read the ``LAB_GEN`` flags in the address 0 of the RAM. The bit 7 is
+        set while the application is active and the bit 6 while there's a
+        deactivation request pending.
+
+        :return: tuple (``deactivation_requested``, ``app_active``)
+        """
+        lab_gen = self.read_ram(0, 1).data[0]
+        self.app_active = bool(lab_gen & 0b10000000)
+        self.deactivation_requested = bool(lab_gen & 0b01000000)
+        return self.deactivation_requested, self.app_active
+
+    def deactivate_app(self, blocking=True, timeout=APP_DEACTIVATE_TIMEOUT):
+        """
+        Ask the node to stop the application so the program memory can be
+        written.
+
+        :param blocking: If True wait until ``LAB_GEN`` reports the
+            application as inactive, checking it every
+            ``APP_DEACTIVATE_POLL_PERIOD`` seconds.
+        :type blocking: bool
+        :param timeout: Seconds to wait the application to stop.
+        :type timeout: float
+
+        raises:
+            * ActiveAppException: If the node rejects the request, the
+                request disappears before the application stops or it
+                doesn't stop in ``timeout``.
+        """
+        logger.info("Desactivando aplicacion del nodo {}.".format(self.lan_dir))
+        rta = self._send_package(Package(destination=self.lan_dir,
+                                             function=APP_WRITE_FUNCTION,
+                                             data=APP_DEACTIVATE_DATA))
+        if rta.data != APP_DEACTIVATE_RESPONSE:
+            raise ActiveAppException
+        if blocking:
+            limit = time.monotonic() + timeout
+            while True:
+                requested, active = self.check_app_state()
+                if not active:
+                    return
+                elif not requested:
+                    raise ActiveAppException
+                if time.monotonic() >= limit:
+                    logger.error("La aplicacion del nodo {0} sigue activa luego de {1} s.".format(
+                        self.lan_dir, timeout))
+                    raise ActiveAppException
+                time.sleep(APP_DEACTIVATE_POLL_PERIOD)
+
+    def activate_app(self):
+        """
+        Ask the node to start the application again.
+
+        :return: The application state after the request.
+        :rtype: bool
+
+        raises:
+            * InactiveAppException: If the node rejects the request, wich
+                means that the word 0 of the program is not ``0x05a5``.
+        """
+        logger.info("Reactivando aplicacion del nodo {}.".format(self.lan_dir))
+        rta = self._send_package(Package(destination=self.lan_dir,
+                                             function=APP_WRITE_FUNCTION,
+                                             data=APP_ACTIVATE_DATA))
+        if rta.data != APP_ACTIVATE_RESPONSE:
+            raise InactiveAppException
+        self.check_app_state()
+        return self.app_active
+
+    def read_app(self, start, length):
+        """
+        Read the program memory of the node.
+
+        :param start: Word address of the first word to read
+        :type start: int
+        :param length: Amount of bytes to read (two per word)
+        :type length: int
+        :return: The bytes read, in the same order that they have in the
+            HEX file (low byte first).
+        :rtype: bytes
+
+        Raises AttributeError if ``length`` is bigger than the buffer of the
+        node or than the data that fits in a package.
+        """
+        if length < 1 or length > min(self.buffer_size, MAX_DATA_LENGTH):
+            raise AttributeError("The length to read is out of range (max buffer %s)", self.buffer_size)
+        try:
+            read_package = Package(destination=self.lan_dir,
+                                   function=APP_READ_FUNCTION,
+                                   data=struct.pack('<HB', start, length))
+        except struct.error:
+            raise AttributeError
+        return self._send_package(read_package).data
+
+    def read_app_chunks(self, chunks):
+        """
+        Read several pieces of the program memory sending the requests back
+        to back (see :func:`SerialInterface.send_packages`).
+
+        :param chunks: tuples (``start``, ``length``) like the parameters of
+            :func:`read_app`.
+        :return: list with the bytes read for each chunk.
+        """
+        packages = list()
+        for start, length in chunks:
+            if length < 1 or length > min(self.buffer_size, MAX_DATA_LENGTH):
+                raise AttributeError("The length to read is out of range (max buffer %s)", self.buffer_size)
+            try:
+                packages.append(Package(destination=self.lan_dir,
+                                        function=APP_READ_FUNCTION,
+                                        data=struct.pack('<HB', start, length)))
+            except struct.error:
+                raise AttributeError
+        return [answer.data for answer in self._send_packages(packages)]
+
+    def read_app_image(self, start=0, end=None, progress=None, batch=32):
+        """
+        Read the program memory from the word ``start`` to the word ``end``.
+
+        :param end: Last word (not included). By default ``app_size``.
+        :type end: int
+        :param progress: Function called after each batch of packages with
+            the amount of bytes read and the total.
+        :type progress: callable
+        :param batch: Amount of packages sent without releasing the port.
+        :type batch: int
+        :return: The program, low byte of each word first.
+        :rtype: bytes
+        """
+        if end is None:
+            end = self.app_size
+        # Las lecturas tienen que ser de palabras completas.
+        step = min(self.buffer_size, MAX_DATA_LENGTH) // 2
+        chunks = [(word, min(step, end - word) * 2)
+                  for word in range(start, end, step)]
+        total = (end - start) * 2
+        image = bytearray()
+        init = time.time()
+        for index in range(0, len(chunks), batch):
+            for data in self.read_app_chunks(chunks[index:index + batch]):
+                image.extend(data)
+            if progress is not None:
+                progress(len(image), total)
+        elapsed = time.time() - init
+        logger.info("Leidos {0} bytes de programa del nodo {1} en {2:.1f} s ({3:.0f} B/s).".format(
+            len(image), self.lan_dir, elapsed, len(image) / elapsed if elapsed else 0))
+        return bytes(image)
+
+    def write_app(self, start, data):
+        """
+        Write the program memory of the node. The application should be
+        inactive (see :func:`deactivate_app`).
+
+        :param start: Word address of the first word to write. Should be
+            multiple of 4.
+        :type start: int
+        :param data: Bytes to write, low byte of each word first.
+        :type data: bytes
+
+        raises:
+            * ActiveAppException: If the application is active, known
+                before sending or because the node refused the write.
+            * AttributeError: If ``start`` is not aligned or ``data`` doesn't
+                fit in a package.
+            * AppWriteException: If the node answer with an error code.
+        """
+        if self.app_active:
+            raise ActiveAppException
+        if start % (GRABA_MAX_BYTES // 2) or len(data) % 2:
+            raise AttributeError("The program should be written by aligned words")
+        if len(data) > min(self.buffer_size, MAX_DATA_LENGTH) - 2:
+            raise AttributeError("The length of the data to write is out of range (max buffer %s)", self.buffer_size)
+        try:
+            write_package = Package(destination=self.lan_dir,
+                                    function=APP_WRITE_FUNCTION,
+                                    data=struct.pack('<H', start) + data)
+        except struct.error:
+            raise AttributeError
+        rta = self._send_package(write_package)
+        if rta.data[:1] == b'\x00':
+            logger.error("El nodo {0} tiene la aplicacion activa, no se escribe en {1}".format(
+                self.lan_dir, start))
+            self.app_active = True
+            raise ActiveAppException
+        if rta.data[:1] in APP_WRITE_ERRORS:
+            logger.error("El nodo {0} rechazo la escritura en {1}: {2}".format(
+                self.lan_dir, start, binascii.hexlify(rta.data)))
+            raise AppWriteException
+        return rta
+
     def _make_streaming_packages(self, indexes, instance):
         """Really don't know what is this for"""
         # TODO: What is this function for?
@@ -451,12 +902,36 @@ class Node(object):
         except struct.error as e:
             raise AttributeError
 
-        rta = self._ser.send_package(read_package)
-        return MemoryContainer(node=rta.sender,
-                            instance=instance,
-                            start=start,
-                            timestamp=time.time(),
-                            data=rta.data)
+        with self._flights_lock:
+            for flight in self._flights:
+                if flight.covers(instance, start, length):
+                    break
+            else:
+                flight = None
+                own_flight = _ReadFlight(instance, start, length)
+                self._flights.append(own_flight)
+        if flight is not None:
+            logger.debug("Esperando lectura en curso del nodo {}.".format(self.lan_dir))
+            return flight.wait(start, length, self._ser._deadline())
+
+        try:
+            rta = self._send_package(read_package)
+            memory = MemoryContainer(node=rta.sender,
+                                     instance=instance,
+                                     start=start,
+                                     timestamp=time.time(),
+                                     data=rta.data)
+        except Exception as error:
+            own_flight.finish(error=error)
+            raise
+        else:
+            own_flight.finish(memory=memory)
+            if self.state is not None:
+                self.state.save_memory(memory)
+            return memory
+        finally:
+            with self._flights_lock:
+                self._flights.remove(own_flight)
 
     def _write_memo(self, start, data, instance):
         """
@@ -483,10 +958,67 @@ class Node(object):
                                      data=struct.pack('B', start) + data)
         except struct.error:
             raise AttributeError
-        answer_package = self._ser.send_package(writed_package)
+        answer_package = self._send_package(writed_package)
+        if self.state is not None:
+            self.state.save_memory(MemoryContainer(self.lan_dir, instance, start,
+                                                   timestamp=time.time(), data=data))
         return writed_package, answer_package
 
-    def __dict__(self):
+    @property
+    def encoded_size(self):
+        """
+        Length of the result of :func:`to_bytes`.
+        """
+        return NODE_DESCRIPTOR.size
+
+    def pack_into(self, buffer, offset=0):
+        """
+        Write the descriptor of the node (the fields of :func:`as_dict`,
+        with ``last_seen`` instead of the current time) in ``buffer`` at
+        ``offset``.
+
+        :return: The offset after the descriptor.
+        """
+        NODE_DESCRIPTOR.pack_into(
+            buffer, offset, SERIALIZATION_VERSION, self.lan_dir, self.status, self.is_master,
+            self.buffer_size, self.ram_read_size, self.ram_write_size, self.eeprom_size,
+            self.app_size, math.nan if self.last_seen is None else self.last_seen)
+        return offset + NODE_DESCRIPTOR.size
+
+    def to_bytes(self):
+        """
+        The descriptor of the node, see :func:`pack_into`.
+        """
+        buffer = bytearray(self.encoded_size)
+        self.pack_into(buffer)
+        return bytes(buffer)
+
+    @classmethod
+    def from_buffer(cls, buffer, offset=0, ser=None):
+        """
+        Make a node from a descriptor encoded with :func:`to_bytes`, with the
+        sizes already identified.
+
+        :param buffer: bytes, bytearray or memoryview.
+        :param offset: Where the descriptor starts in ``buffer``.
+        :param ser: The interface of the new node.
+
+        raises:
+            * DecodeError: If ``buffer`` has not a descriptor at ``offset``.
+        """
+        lan_dir, status, is_master, buffer_size, ram_read, ram_write, eeprom, app_size, \
+            last_seen = _unpack_header(NODE_DESCRIPTOR, memoryview(buffer), offset)
+        node = cls(lan_dir, ser, is_master=is_master)
+        node._status = status
+        node.last_seen = None if math.isnan(last_seen) else last_seen
+        node.buffer_size = buffer_size
+        node.ram_read_size = ram_read
+        node.ram_write_size = ram_write
+        node.eeprom_size = eeprom
+        node.app_size = app_size
+        return node
+
+    def as_dict(self):
         return {
             'lan_dir': self.lan_dir,
             'status': self.status,
@@ -497,3 +1029,67 @@ class Node(object):
             'is_master': self.is_master,
             'time': time.time(),
         }
+
+    def __dict__(self):
+        """
+        Deprecated name of :func:`as_dict`, kept for the existing callers.
+        """
+        warnings.warn("Node.__dict__() is deprecated, use Node.as_dict()",
+                      DeprecationWarning, stacklevel=2)
+        return self.as_dict()
+
+
+# Tipos que se pueden codificar en un lote.
+BATCH_KINDS = {1: Package, 2: MemoryContainer, 3: Node}
+
+
+def pack_batch(items):
+    """
+    Encode a sequence of objects of the same class in one buffer, allocated
+    once: version, kind, amount and the objects one after the other.
+
+    :param items: Packages, memory containers or nodes.
+    :type items: list of :class:`Package` | :class:`MemoryContainer` | :class:`Node`
+    :rtype: bytearray
+    """
+    items = list(items)
+    kind = 0
+    if items:
+        kinds = dict((cls, code) for code, cls in BATCH_KINDS.items())
+        kind = kinds[type(items[0])]
+        if any(type(item) is not type(items[0]) for item in items):
+            raise TypeError('Un lote tiene que tener objetos de una sola clase.')
+    buffer = bytearray(BATCH_HEADER.size + sum(item.encoded_size for item in items))
+    BATCH_HEADER.pack_into(buffer, 0, SERIALIZATION_VERSION, kind, len(items))
+    offset = BATCH_HEADER.size
+    for item in items:
+        offset = item.pack_into(buffer, offset)
+    return buffer
+
+
+def unpack_batch(buffer, **kwargs):
+    """
+    Decode a batch made with :func:`pack_batch`. The memory containers keep
+    a view of ``buffer``.
+
+    :param kwargs: Extra arguments for ``from_buffer``, like ``ser`` for the
+        nodes.
+    :return: list with the objects.
+
+    raises:
+        * DecodeError: If ``buffer`` is not a valid batch.
+    """
+    view = memoryview(buffer)
+    kind, count = _unpack_header(BATCH_HEADER, view, 0)
+    if not count:
+        return list()
+    if kind not in BATCH_KINDS:
+        raise DecodeError()
+    cls = BATCH_KINDS[kind]
+    items = list()
+    offset = BATCH_HEADER.size
+    for _ in range(count):
+        item = cls.from_buffer(view, offset, **kwargs)
+        offset += item.encoded_size
+        items.append(item)
+    return items
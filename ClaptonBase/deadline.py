@@ -0,0 +1,119 @@
+"""
+.. module:: deadline
+    :platform: Unix
+    :synopsis: Time limit and cancellation of the operations over the bus
+
+A :class:`Deadline` is the handle of one or more operations of a
+:class:`SerialInterface`: it expires after ``timeout`` seconds and can be
+cancelled from another thread with :func:`Deadline.cancel`. The operations
+check it while they wait the port or the :class:`AdmissionController`,
+between retries and while they read, and raise :class:`DeadlineException` or
+:class:`CancelledException`::
+
+    deadline = Deadline(.5)
+    ser.send_package(package, deadline=deadline)
+
+    # The operations of Node take the one of the thread.
+    with ser.within(2.) as deadline:
+        node.read_ram(0, 64)
+"""
+import time
+from threading import Event
+
+from .cfg import DEADLINE_POLL_PERIOD
+from .exceptions import CancelledException, DeadlineException
+
+
+class Deadline(object):
+    """
+    Time limit of an operation, that can also be cancelled.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        :param timeout: Seconds from now. None is without limit, only
+            cancellable.
+        :type timeout: int | float
+        """
+        self.expires = None if timeout is None else time.monotonic() + timeout
+        self._cancelled = Event()
+
+    @classmethod
+    def coerce(cls, deadline):
+        """
+        :param deadline: A :class:`Deadline`, seconds or None.
+        :return: The :class:`Deadline`, or None if ``deadline`` is None.
+        """
+        if deadline is None or isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline)
+
+    def cancel(self):
+        """
+        Cancel the operations that use this deadline. The ones that are
+        waiting stop after ``DEADLINE_POLL_PERIOD`` at most.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        """
+        :return: Seconds until the deadline, 0 if expired and None if there's
+            no limit.
+        """
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0.)
+
+    @property
+    def expired(self):
+        return self.cancelled or self.remaining() == 0.
+
+    def check(self):
+        """
+        raises:
+            * CancelledException: If it was cancelled.
+            * DeadlineException: If the time expired.
+        """
+        if self.cancelled:
+            raise CancelledException()
+        if self.remaining() == 0.:
+            raise DeadlineException()
+
+    def slice(self, timeout=None):
+        """
+        :param timeout: Seconds that the caller wants to wait, None is forever.
+        :return: Seconds to wait before checking the deadline again.
+        """
+        wait = DEADLINE_POLL_PERIOD
+        for limit in (timeout, self.remaining()):
+            if limit is not None:
+                wait = min(wait, limit)
+        return wait
+
+    def acquire(self, lock):
+        """
+        Acquire ``lock`` before the deadline.
+
+        raises: The exceptions of :func:`check`.
+        """
+        while True:
+            self.check()
+            if lock.acquire(timeout=self.slice()):
+                return
+
+    def sleep(self, seconds):
+        """
+        Wait ``seconds``, or less if the deadline is cancelled.
+
+        raises: The exceptions of :func:`check`, if the wait goes beyond the
+            deadline, without waiting.
+        """
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise DeadlineException()
+        self._cancelled.wait(seconds)
+        self.check()
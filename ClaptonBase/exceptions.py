@@ -7,6 +7,25 @@ class ReadException(Exception):
         super(ReadException, self).__init__(ReadException.error_msg)
 
 
+class CollisionException(ReadException):
+
+    code = 404
+    error_msg = 'El eco no coincide con el paquete enviado. Posible ' \
+        'colision en la TKLan.'
+
+    def __init__(self):
+        super(ReadException, self).__init__(CollisionException.error_msg)
+
+
+class OverloadException(Exception):
+
+    code = 405
+    error_msg = 'La TKLan esta saturada. El pedido fue descartado.'
+
+    def __init__(self):
+        super(OverloadException, self).__init__(OverloadException.error_msg)
+
+
 class WriteException(Exception):
 
     code = 401
@@ -16,6 +35,33 @@ class WriteException(Exception):
         super(WriteException, self).__init__(WriteException.error_msg)
 
 
+class QuarantineException(WriteException):
+
+    code = 406
+    error_msg = 'El nodo esta en cuarentena. No se envio el paquete.'
+
+    def __init__(self):
+        super(WriteException, self).__init__(QuarantineException.error_msg)
+
+
+class DeadlineException(Exception):
+
+    code = 407
+    error_msg = 'Vencio el tiempo limite de la operacion.'
+
+    def __init__(self):
+        super(DeadlineException, self).__init__(DeadlineException.error_msg)
+
+
+class CancelledException(DeadlineException):
+
+    code = 408
+    error_msg = 'La operacion fue cancelada.'
+
+    def __init__(self):
+        super(DeadlineException, self).__init__(CancelledException.error_msg)
+
+
 class ChecksumException(Exception):
 
     code = 402
@@ -65,6 +111,15 @@ class BadLineException(Exception):
         super(BadLineException, self).__init__(BadLineException.error_msg)
 
 
+class AppWriteException(Exception):
+
+    code = 503
+    error_msg = 'El nodo rechazo la escritura de la aplicacion.'
+
+    def __init__(self):
+        super(AppWriteException, self).__init__(AppWriteException.error_msg)
+
+
 class NoMasterException(Exception):
 
     code = 300
@@ -90,7 +145,7 @@ class TokenException(Exception):
     error_msg = 'Error en respuesta u oferta de token.'
 
     def __init__(self):
-        super(TokenExeption, self).__init__(TokenExeption.error_msg)
+        super(TokenException, self).__init__(TokenException.error_msg)
 
 
 class InvalidPackage(Exception):
@@ -124,3 +179,30 @@ class SerialConfigError(Exception):
 
     def __init__(self):
         super(SerialConfigError, self).__init__(SerialConfigError.error_msg)
+
+
+class CaptureException(Exception):
+
+    code = 800
+    error_msg = 'El archivo no es una captura valida.'
+
+    def __init__(self):
+        super(CaptureException, self).__init__(CaptureException.error_msg)
+
+
+class BrokerException(Exception):
+
+    code = 900
+    error_msg = 'Error en la operacion del broker.'
+
+    def __init__(self, error=None):
+        """
+        :param error: The error sent by the broker, with ``type``, ``code``
+            and ``message``.
+        :type error: dict
+        """
+        self.error = error
+        message = BrokerException.error_msg
+        if error is not None:
+            message = '{0} {1}: {2}'.format(message, error.get('type'), error.get('message'))
+        super(BrokerException, self).__init__(message)
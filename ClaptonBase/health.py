@@ -0,0 +1,143 @@
+"""
+.. module:: health
+    :platform: Unix
+    :synopsis: Health of the nodes from the result of their transactions
+
+A node that stops answering costs ``SEND_PACKAGE_TRIES`` timeouts on each
+request. :class:`NodeHealth` follows the transactions of a node and moves it
+between the states of :attr:`Node.status`:
+
+* ``NODE_OK``: the node answers.
+* ``NODE_SUSPECT``: more than ``HEALTH_SUSPECT_RATE`` of the last
+  ``HEALTH_WINDOW`` transactions failed. The requests are still sent.
+* ``NODE_QUARANTINE``: ``HEALTH_QUARANTINE_FAILURES`` failures in a row. The
+  requests fail at once with :class:`QuarantineException`, without using the
+  bus, except one probe when the backoff expires. The backoff doubles after
+  each failed probe, up to ``HEALTH_BACKOFF[1]``.
+* ``NODE_ABSENT``: ``HEALTH_ABSENT_PROBES`` probes failed. Is still probed,
+  at the maximum backoff.
+
+Any transaction that succeeds puts the node back in ``NODE_OK``.
+"""
+import time
+from collections import deque
+from threading import Lock
+
+from .cfg import (HEALTH_ABSENT_PROBES, HEALTH_BACKOFF,
+                  HEALTH_QUARANTINE_FAILURES, HEALTH_SUSPECT_RATE,
+                  HEALTH_WINDOW, NODE_ABSENT, NODE_OK, NODE_QUARANTINE,
+                  NODE_SUSPECT)
+from .utils import get_logger
+
+logger = get_logger('health')
+
+
+class NodeHealth(object):
+    """
+    Health of one node. The :class:`Node` calls :func:`allow` before each
+    transaction and :func:`success`, :func:`failure` or :func:`release`
+    after it.
+    """
+
+    def __init__(self, window=HEALTH_WINDOW, suspect_rate=HEALTH_SUSPECT_RATE,
+                 quarantine_failures=HEALTH_QUARANTINE_FAILURES,
+                 absent_probes=HEALTH_ABSENT_PROBES, backoff=HEALTH_BACKOFF):
+        """
+        :param window: Amount of transactions to compute the failure rate.
+        :param suspect_rate: Failure rate from which the node is suspect.
+        :param quarantine_failures: Failures in a row to quarantine the node.
+        :param absent_probes: Probes failed to consider the node absent.
+        :param backoff: Tuple with the first and the maximum wait in seconds
+            between probes.
+        """
+        self.suspect_rate = suspect_rate
+        self.quarantine_failures = quarantine_failures
+        self.absent_probes = absent_probes
+        self.backoff = backoff
+        self.state = NODE_OK
+        self._results = deque(maxlen=window)
+        self._failures = 0
+        self._probes = 0
+        self._delay = backoff[0]
+        self.next_probe = None
+        self._probing = False
+        self._lock = Lock()
+
+    @property
+    def failure_rate(self):
+        if not self._results:
+            return 0.
+        return self._results.count(False) / float(len(self._results))
+
+    @property
+    def blocked(self):
+        """
+        True if the node is in quarantine or absent.
+        """
+        return self.state in (NODE_QUARANTINE, NODE_ABSENT)
+
+    def probe_due(self, now=None):
+        """
+        :return: True if the node is blocked and its next probe is due.
+        """
+        now = time.monotonic() if now is None else now
+        return self.blocked and not self._probing and now >= self.next_probe
+
+    def allow(self):
+        """
+        :return: True if a transaction with the node can be done now. If the
+            node is blocked only the probe is allowed.
+        """
+        with self._lock:
+            if not self.blocked:
+                return True
+            if self.probe_due():
+                self._probing = True
+                return True
+            return False
+
+    def success(self):
+        """
+        :return: The new state.
+        """
+        with self._lock:
+            self._results.append(True)
+            self._failures = 0
+            self._probes = 0
+            self._probing = False
+            self._delay = self.backoff[0]
+            self.next_probe = None
+            self.state = NODE_OK
+            return self.state
+
+    def release(self):
+        """
+        The transaction ended without telling if the node answers, like a
+        collision or a request that never reached the bus. The state doesn't
+        change, but if it was the probe it can be done again.
+        """
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        """
+        :return: The new state.
+        """
+        with self._lock:
+            self._results.append(False)
+            self._failures += 1
+            if self.blocked:
+                # Fallo una prueba: se duplica la espera hasta la siguiente.
+                self._probing = False
+                self._probes += 1
+                self._delay = min(self._delay * 2, self.backoff[1])
+                if self._probes >= self.absent_probes:
+                    self.state = NODE_ABSENT
+                    self._delay = self.backoff[1]
+            elif self._failures >= self.quarantine_failures:
+                self.state = NODE_QUARANTINE
+            elif self.failure_rate > self.suspect_rate:
+                self.state = NODE_SUSPECT
+            if self.blocked:
+                self.next_probe = time.monotonic() + self._delay
+            return self.state
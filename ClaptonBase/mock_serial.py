@@ -1,8 +1,14 @@
 import serial
+import socket
 import struct
 import binascii
+from threading import Thread
+from .cfg import (APP_ACTIVATE_DATA, APP_ACTIVATE_RESPONSE, APP_BLANK_WORD,
+                  APP_DEACTIVATE_DATA, APP_DEACTIVATE_RESPONSE,
+                  APP_INIT_CONFIG, DEFAULT_BAUDRATE, DEFAULT_SERIAL_TIMEOUT)
+from .containers import Package
 from .exceptions import WriteException, ReadException, ChecksumException, \
-    NoMasterException, SerialConfigError
+    NoMasterException, SerialConfigError, DecodeError
 
 
 class MockSerial(object):
@@ -41,3 +47,214 @@ class MockSerial(object):
         if self.raise_serial_error:
             self.raise_serial_error -= 1
             raise serial.portNotOpenError
+
+
+class VirtualNode(object):
+    """
+    Node of a simulated TKLan. Answers the packages like a real node does,
+    keeping its RAM, EEPROM and program memory in ``bytearray``.
+    """
+
+    def __init__(self, lan_dir, buffer_size=64, ram_size=256, eeprom_size=256,
+                 app_active=True):
+        self.lan_dir = lan_dir
+        self.buffer_size = buffer_size
+        self.ram = bytearray(ram_size)
+        self.eeprom = bytearray(eeprom_size)
+        self.app = bytearray(APP_BLANK_WORD * APP_INIT_CONFIG)
+        # La reactivacion solo es posible con 0x05a5 en la direccion 0.
+        self.app[0:2] = b'\xa5\x05'
+        self.app_active = app_active
+        self.received = list()
+
+    @property
+    def app_active(self):
+        return bool(self.ram[0] & 0b10000000)
+
+    @app_active.setter
+    def app_active(self, value):
+        if value:
+            self.ram[0] |= 0b10000000
+        else:
+            self.ram[0] &= 0b01111111
+
+    def package_zero(self):
+        return bytes([0, 0, len(self.eeprom) // 64, 0, 0,
+                      self.buffer_size // 64, len(self.ram) // 64,
+                      len(self.ram) // 64])
+
+    def answer(self, package):
+        """
+        :param package: Package sent to this node.
+        :return: The answer of the node or None if there's no answer.
+        """
+        self.received.append(package)
+        data = b''
+        if package.function == 0:
+            data = self.package_zero()
+        elif package.function in (1, 3):
+            memory = self.ram if package.function == 1 else self.eeprom
+            start, length = struct.unpack('2B', package.data)
+            data = bytes(memory[start:start + length])
+        elif package.function in (2, 4):
+            memory = self.ram if package.function == 2 else self.eeprom
+            start = package.data[0]
+            memory[start:start + len(package.data) - 1] = package.data[1:]
+        elif package.function == 5:
+            start, length = struct.unpack('<HB', package.data)
+            data = bytes(self.app[start * 2:start * 2 + length])
+        elif package.function == 6:
+            data = self._write_app(package.data)
+        return Package(sender=self.lan_dir,
+                       destination=package.sender,
+                       function=package.function,
+                       data=data,
+                       validate=False)
+
+    def _write_app(self, data):
+        if data == APP_ACTIVATE_DATA:
+            if self.app[0:2] != b'\xa5\x05':
+                return b'\x01'
+            self.app_active = True
+            return APP_ACTIVATE_RESPONSE
+        if data == APP_DEACTIVATE_DATA:
+            self.app_active = False
+            return APP_DEACTIVATE_RESPONSE
+        start = struct.unpack('<H', data[:2])[0]
+        if self.app_active:
+            return b'\x00'
+        if start % 4:
+            return b'\x06'
+        if len(data) == 2:
+            return b'\x05'
+        if start * 2 + len(data) - 2 > len(self.app):
+            return b'\x03'
+        self.app[start * 2:start * 2 + len(data) - 2] = data[2:]
+        return b''
+
+
+class SimulatedPort(object):
+    """
+    Replacement of ``serial.Serial`` wired to a set of :class:`VirtualNode`.
+    Every frame written is echoed, like the TKLan line does, and followed by
+    the answer of the destination node.
+    """
+
+    def __init__(self, nodes=(), baudrate=DEFAULT_BAUDRATE,
+                 timeout=DEFAULT_SERIAL_TIMEOUT, port='simulated', echo=True,
+                 line_baudrate=None):
+        """
+        :param echo: If False the frames written are not echoed, like the
+            adapters that suppress the local echo.
+        :param line_baudrate: Speed of the simulated bus. If the port uses
+            another one the bytes read are corrupted and the nodes don't
+            understand what is written. None is always the one of the port.
+        """
+        self.nodes = dict((node.lan_dir, node) for node in nodes)
+        self.echo = echo
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.port = port
+        self.line_baudrate = line_baudrate
+        self.rx = bytearray()
+        self.written = list()
+        self._open = True
+        # Si es False lo escrito se pierde, como con el cable desconectado.
+        self.connected = True
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        self._open = False
+
+    def isOpen(self):
+        return self._open
+
+    def flushInput(self):
+        del self.rx[:]
+
+    @property
+    def mismatch(self):
+        return self.line_baudrate is not None and self.baudrate != self.line_baudrate
+
+    def read(self, n=1):
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        if self.mismatch:
+            # A otra velocidad se leen bytes sin sentido.
+            data = bytes(byte ^ 0xa5 for byte in data)
+        return data
+
+    def write(self, data):
+        data = bytes(data)
+        self.written.append(data)
+        if not self.connected:
+            return len(data)
+        if self.echo:
+            self.rx.extend(data)
+        if self.mismatch:
+            return len(data)
+        try:
+            package = Package(bytes_chain=data)
+        except (ChecksumException, DecodeError):
+            return len(data)
+        node = self.nodes.get(package.destination)
+        if node is not None:
+            self.rx.extend(node.answer(package).bytes_chain)
+        return len(data)
+
+
+class TcpSimulator(object):
+    """
+    TCP server that plays a :class:`SimulatedPort` for one client at a time,
+    like a terminal server in raw mode with the TKLan behind. Useful to test
+    :class:`transports.TcpTransport` locally.
+    """
+
+    def __init__(self, nodes=(), host='127.0.0.1', port=0):
+        """
+        :param port: TCP port. By default any free port, see ``address``.
+        """
+        self.simulated = SimulatedPort(nodes)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(1)
+        self.address = self._server.getsockname()
+        self._thread = Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return 'tcp://{0}:{1}'.format(*self.address)
+
+    def _serve(self):
+        while True:
+            try:
+                connection, address = self._server.accept()
+            except OSError:
+                return
+            with connection:
+                pending = b''
+                while True:
+                    try:
+                        data = connection.recv(256)
+                    except OSError:
+                        break
+                    if not data:
+                        break
+                    pending += data
+                    # SimulatedPort espera un paquete completo en cada escritura.
+                    while len(pending) >= 2 and len(pending) >= (pending[1] & 0b00011111) + 3:
+                        size = (pending[1] & 0b00011111) + 3
+                        self.simulated.write(pending[:size])
+                        pending = pending[size:]
+                    connection.sendall(self.simulated.read(len(self.simulated.rx)))
+
+    def close(self):
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
@@ -0,0 +1,172 @@
+"""
+.. module:: node_state
+    :platform: Unix
+    :synopsis: State of the nodes of a TKLan persisted in a mapped file
+
+:class:`NodeState` keeps, for the 16 nodes of a bus, the descriptor of the
+node (see :func:`Node.to_bytes`) and the last bytes known of its RAM and
+EEPROM in a file mapped in memory. The nodes with a ``state`` write in it
+when they are identified, change of status or read or write memory, so
+after a restart the nodes and their memory are available at once, although
+stale, while they are refreshed (see :func:`BusManager.warm_start`)::
+
+    header:  'CLPSTA' | version | nodes | memory size
+    for each node:
+             descriptor
+             for RAM and EEPROM: timestamp | known bytes mask | data
+"""
+import math
+import mmap
+import os
+import struct
+
+from .cfg import NODE_STATE_MEMORY_SIZE
+from .containers import INSTANCE_CODES, NODE_DESCRIPTOR, MemoryContainer, Node
+from .exceptions import DecodeError
+from .utils import get_logger
+
+logger = get_logger('node_state')
+
+HEADER = struct.Struct('<6sBBH')
+MAGIC = b'CLPSTA'
+VERSION = 1
+NODES = 16
+TIMESTAMP = struct.Struct('<d')
+
+
+def _align(size):
+    return size + (-size % 8)
+
+
+class NodeState(object):
+    """
+    Nodes and memory of a TKLan in a file, updated in place.
+    """
+
+    def __init__(self, path, memory_size=NODE_STATE_MEMORY_SIZE):
+        """
+        Open the state in ``path``, or make it if doesn't exist or was made
+        with another format.
+
+        :param path: The state file.
+        :param memory_size: Bytes of each memory instance of each node.
+        """
+        self.path = path
+        self.memory_size = memory_size
+        self._instance_size = TIMESTAMP.size + _align(2 * memory_size)
+        self._node_size = _align(NODE_DESCRIPTOR.size) + len(INSTANCE_CODES) * self._instance_size
+        size = _align(HEADER.size) + NODES * self._node_size
+        header = HEADER.pack(MAGIC, VERSION, NODES, memory_size)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            current = os.pread(fd, HEADER.size, 0)
+            if current != header or os.fstat(fd).st_size != size:
+                if current:
+                    logger.warning("Estado {} con otro formato, se descarta.".format(path))
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _node_offset(self, lan_dir):
+        if not 0 <= lan_dir < NODES:
+            raise AttributeError("The node lan_dir should  be between 0 and 15")
+        return _align(HEADER.size) + lan_dir * self._node_size
+
+    def _instance_offset(self, lan_dir, instance):
+        return self._node_offset(lan_dir) + _align(NODE_DESCRIPTOR.size) + \
+            INSTANCE_CODES[instance] * self._instance_size
+
+    def save_node(self, node):
+        """
+        Write the descriptor of ``node``.
+
+        :type node: :class:`Node`
+        """
+        node.pack_into(self._map, self._node_offset(node.lan_dir))
+
+    def save_memory(self, container):
+        """
+        Write the data of ``container`` and its timestamp. The bytes out of
+        ``memory_size`` are ignored.
+
+        :type container: :class:`MemoryContainer`
+        """
+        offset = self._instance_offset(container.node, container.instance)
+        start = container.start
+        end = min(start + container.length, self.memory_size)
+        if end <= start:
+            return
+        data = offset + TIMESTAMP.size + self.memory_size
+        self._map[data + start:data + end] = container.data[:end - start]
+        mask = offset + TIMESTAMP.size
+        self._map[mask + start:mask + end] = b'\x01' * (end - start)
+        TIMESTAMP.pack_into(self._map, offset, math.nan if container.timestamp is None
+                            else container.timestamp)
+
+    def nodes(self, ser=None):
+        """
+        :param ser: The interface of the nodes.
+        :return: dict with the :class:`Node` saved, by ``lan_dir``, with this
+            state.
+        """
+        nodes = dict()
+        for lan_dir in range(NODES):
+            try:
+                node = Node.from_buffer(self._map, self._node_offset(lan_dir), ser=ser)
+            except DecodeError:
+                continue
+            node.state = self
+            nodes[lan_dir] = node
+        return nodes
+
+    def known_ranges(self, lan_dir, instance):
+        """
+        :return: list of (``start``, ``length``) of the bytes known of the
+            memory ``instance`` of the node ``lan_dir``.
+        """
+        offset = self._instance_offset(lan_dir, instance) + TIMESTAMP.size
+        mask = self._map[offset:offset + self.memory_size]
+        ranges = list()
+        start = mask.find(b'\x01')
+        while start >= 0:
+            end = mask.find(b'\x00', start)
+            if end < 0:
+                end = len(mask)
+            ranges.append((start, end - start))
+            start = mask.find(b'\x01', end)
+        return ranges
+
+    def memory(self, lan_dir, instance):
+        """
+        :return: list of :class:`MemoryContainer` with the bytes known of the
+            memory ``instance`` of the node ``lan_dir``, with the timestamp of
+            the last write.
+        """
+        offset = self._instance_offset(lan_dir, instance)
+        timestamp = TIMESTAMP.unpack_from(self._map, offset)[0]
+        data = offset + TIMESTAMP.size + self.memory_size
+        return [MemoryContainer(lan_dir, instance, start,
+                                timestamp=None if math.isnan(timestamp) else timestamp,
+                                data=self._map[data + start:data + start + length])
+                for start, length in self.known_ranges(lan_dir, instance)]
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        if not self._map.closed:
+            self._map.flush()
+            self._map.close()
+
+
+def refresh_order(nodes):
+    """
+    :param nodes: dict with the nodes to refresh, by address.
+    :return: The addresses of ``nodes`` sorted by ``last_seen`` of the node,
+        first the ones never seen.
+    """
+    return sorted(nodes, key=lambda address: -math.inf if nodes[address].last_seen is None
+                  else nodes[address].last_seen)
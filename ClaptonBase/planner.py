@@ -0,0 +1,343 @@
+"""
+.. module:: planner
+    :platform: Unix
+    :synopsis: Capacity of a TKLan for a plan of polls, writes and scans
+
+The TKLan carries one transaction at a time, with bytes of
+``BITS_PER_BYTE`` bits at the baudrate of the bus (2400 or 9600 bps). Each
+transaction takes the request (its echo arrives at the same time), the
+answer of the node and the time the node takes to answer.
+
+:class:`BusPlanner` computes, before running them, what a set of polls,
+writes and scans asks of the bus::
+
+    planner = BusPlanner(baudrate=2400)
+    planner.add_poll(1, 'RAM', 0, 64, period=1.)
+    planner.add_write(2, 'RAM', 10, 4, period=5.)
+    planner.add_scan(period=60.)
+    report = planner.report()
+    report['occupancy'], report['feasible']
+    planner.latency(Package(destination=3, function=0), PRIORITY_INTERACTIVE)
+
+Each operation is split in the packages that :class:`Node` sends, of at most
+``MAX_DATA_LENGTH`` bytes. A scan assumes the worst case, that the nodes not
+in ``present`` don't answer and cost every retry until the timeout. The
+items are sent as polls (see :class:`AdmissionController`), so the requests
+of higher priority only wait the transaction in progress.
+
+:class:`TrafficMeter` measures at runtime the bytes in the bus and the time
+spent in transactions by a :class:`SerialInterface`, to compare them with
+the plan.
+"""
+import math
+import time
+from collections import deque
+from threading import Lock
+
+from .admission import transaction_bytes, transaction_time
+from .cfg import (DEFAULT_BAUDRATE, DEFAULT_SERIAL_TIMEOUT, MAX_DATA_LENGTH,
+                  MEMO_READ_NAMES, MEMO_WRITE_NAMES, METER_WINDOW,
+                  NODE_TURNAROUND, PLANNER_MAX_OCCUPANCY, PRIORITY_INTERACTIVE,
+                  PRIORITY_POLLING)
+from .containers import Package
+from .exceptions import ReadException, WriteException
+from .retry import DEFAULT as DEFAULT_RETRY
+from .utils import get_logger, wire_time
+
+logger = get_logger('planner')
+
+
+class PlanItem(object):
+    """
+    An operation of the plan: the packages that it sends and how often.
+    """
+
+    def __init__(self, name, packages, period=None, absent=()):
+        """
+        :param name: Description of the operation.
+        :param packages: The packages of one execution, the nodes answer.
+        :param period: Seconds between executions. None is as often as the
+            bus allows, sharing what's left by the periodic items.
+        :param absent: The packages of one execution that nobody answers.
+        """
+        self.name = name
+        self.packages = list(packages)
+        self.absent = list(absent)
+        self.period = period
+
+
+class BusPlanner(object):
+    """
+    Expected occupancy, refresh rates and latency of a plan in one bus.
+    """
+
+    def __init__(self, baudrate=DEFAULT_BAUDRATE, turnaround=NODE_TURNAROUND,
+                 timeout=DEFAULT_SERIAL_TIMEOUT, retry=DEFAULT_RETRY,
+                 max_occupancy=PLANNER_MAX_OCCUPANCY):
+        """
+        :param baudrate: Speed of the bus.
+        :param turnaround: Seconds that a node takes to answer.
+        :param timeout: Timeout of the port, what costs a node that doesn't
+            answer.
+        :param retry: The retry policy of the interface.
+        :type retry: :class:`retry.RetryPolicy`
+        :param max_occupancy: Maximum occupancy of the periodic items for the
+            plan to be feasible. Leave some room for the interactive requests
+            and the retries.
+        """
+        self.baudrate = baudrate
+        self.turnaround = turnaround
+        self.timeout = timeout
+        self.retry = retry
+        self.max_occupancy = max_occupancy
+        self.items = list()
+
+    def add(self, item):
+        self.items.append(item)
+        return item
+
+    def add_poll(self, lan_dir, instance, start, length, period=None):
+        """
+        Read ``length`` bytes of the memory ``instance`` of the node.
+        """
+        function = MEMO_READ_NAMES[instance]
+        packages = [Package(destination=lan_dir, function=function,
+                            data=bytes((offset, min(MAX_DATA_LENGTH, start + length - offset))))
+                    for offset in range(start, start + length, MAX_DATA_LENGTH)]
+        return self.add(PlanItem('poll {0} {1}[{2}:{3}]'.format(
+            lan_dir, instance, start, start + length), packages, period))
+
+    def add_polls(self, polls, period=None):
+        """
+        :param polls: tuples (``address``, ``instance``, ``start``,
+            ``length``) like the ones of :func:`BusManager.poll`. The
+            ``address`` can be the ``lan_dir`` or a tuple (``bus``,
+            ``lan_dir``).
+        """
+        return [self.add_poll(address[1] if isinstance(address, tuple) else address,
+                              instance, start, length, period)
+                for address, instance, start, length in polls]
+
+    def add_write(self, lan_dir, instance, start, length, period=None):
+        """
+        Write ``length`` bytes in the memory ``instance`` of the node.
+        """
+        function = MEMO_WRITE_NAMES[instance]
+        # Un byte de datos es la direccion de inicio.
+        chunk = MAX_DATA_LENGTH - 1
+        packages = [Package(destination=lan_dir, function=function,
+                            data=bytes((offset,)) + bytes(min(chunk, start + length - offset)))
+                    for offset in range(start, start + length, chunk)]
+        return self.add(PlanItem('write {0} {1}[{2}:{3}]'.format(
+            lan_dir, instance, start, start + length), packages, period))
+
+    def add_scan(self, lan_dirs=range(1, 16), present=None, period=None):
+        """
+        Identify the nodes ``lan_dirs``.
+
+        :param present: The ``lan_dir`` of the nodes that answer. By default
+            none, the worst case.
+        """
+        present = set(present or ())
+        packages = [Package(destination=lan_dir, function=0) for lan_dir in lan_dirs]
+        return self.add(PlanItem('scan', [package for package in packages
+                                          if package.destination in present], period,
+                                 absent=[package for package in packages
+                                         if package.destination not in present]))
+
+    def cost(self, package):
+        """
+        :return: Seconds that the bus is busy with the transaction of
+            ``package``.
+        """
+        return transaction_time(package, self.baudrate, self.turnaround)
+
+    def absent_attempts(self, package):
+        """
+        :return: tuple (attempts, seconds) that ``package`` takes if nobody
+            answers: every attempt waits the timeout, plus the waits between
+            them, as the retry policy says.
+        """
+        # Lo que levanta SerialInterface cuando el nodo no responde.
+        error = WriteException()
+        error.__cause__ = ReadException()
+        fields = self.retry.rule(error)[1]
+        attempt = wire_time(len(package.bytes_chain), self.baudrate) + self.timeout
+        attempts, total = 1, attempt
+        for retry in range(fields['retries']):
+            delay = min(fields['delay'] * fields['factor'] ** retry, fields['max_delay'])
+            if self.retry.deadline is not None and total + delay > self.retry.deadline:
+                break
+            attempts += 1
+            total += delay + attempt
+        return attempts, total
+
+    def absent_cost(self, package):
+        """
+        :return: Seconds that the bus is busy with ``package`` if nobody
+            answers.
+        """
+        return self.absent_attempts(package)[1]
+
+    def item_cost(self, item):
+        return sum(self.cost(package) for package in item.packages) + \
+            sum(self.absent_cost(package) for package in item.absent)
+
+    def item_bytes(self, item):
+        return sum(transaction_bytes(package) for package in item.packages) + \
+            sum(self.absent_attempts(package)[0] * len(package.bytes_chain)
+                for package in item.absent)
+
+    def blocking(self):
+        """
+        :return: Seconds of the longest transaction of the plan, what a
+            request waits at most if it goes first.
+        """
+        transactions = [self.cost(package) for item in self.items for package in item.packages] + \
+            [self.absent_cost(package) for item in self.items for package in item.absent]
+        return max(transactions, default=0.)
+
+    def occupancy(self):
+        """
+        :return: Fraction of the time of the bus used by the items with
+            period.
+        """
+        return sum(self.item_cost(item) / item.period for item in self.items if item.period)
+
+    def latency(self, package, priority=PRIORITY_INTERACTIVE):
+        """
+        Worst time since ``package`` is queued until it's answered, while
+        the bus runs the plan.
+
+        Above :data:`PRIORITY_POLLING` the request only waits the
+        transaction in progress. A poll waits one execution of every item,
+        and forever if the bus can't carry the plan.
+
+        :param package: The request.
+        :type package: :class:`Package`
+        :param priority: Priority class of the request.
+        :type priority: int
+        :return: Seconds.
+        """
+        if priority < PRIORITY_POLLING:
+            queueing = self.blocking()
+        elif self.occupancy() > 1:
+            queueing = math.inf
+        else:
+            queueing = sum(self.item_cost(item) for item in self.items)
+        return queueing + self.cost(package)
+
+    def report(self):
+        """
+        :return: dict with:
+
+            * ``cycle``: seconds of one execution of every item.
+            * ``bytes``: bytes in the bus in one cycle.
+            * ``occupancy``: fraction of the time of the bus used by the items
+              with period. More than 1 is impossible.
+            * ``feasible``: If ``occupancy`` is not more than ``max_occupancy``.
+            * ``rate``: executions per second of the items without period,
+              with the time left by the others.
+            * ``blocking``: the longest transaction, what a request waits at
+              most if it goes first (see :class:`AdmissionController`).
+            * ``items``: list of dicts with the ``name``, ``cost``, ``period``,
+              achievable ``rate`` and worst ``age`` of the data of each item.
+        """
+        costs = [self.item_cost(item) for item in self.items]
+        cycle = sum(costs)
+        occupancy = self.occupancy()
+        best_effort = sum(cost for item, cost in zip(self.items, costs) if not item.period)
+        free = max(1. - occupancy, 0.)
+        if not best_effort:
+            rate = math.inf
+        else:
+            rate = free / best_effort
+        blocking = self.blocking()
+        # Si el bus no da abasto las tareas periodicas se atrasan por igual.
+        stretch = max(occupancy, 1.)
+        items = list()
+        for item, cost in zip(self.items, costs):
+            if item.period:
+                interval = item.period * stretch
+            else:
+                interval = 1. / rate if rate else math.inf
+            items.append({'name': item.name, 'cost': cost, 'period': item.period,
+                          'rate': 1. / interval, 'age': interval + cycle})
+        report = {'baudrate': self.baudrate,
+                  'cycle': cycle,
+                  'bytes': sum(self.item_bytes(item) for item in self.items),
+                  'occupancy': occupancy,
+                  'feasible': occupancy <= self.max_occupancy,
+                  'rate': rate,
+                  'blocking': blocking,
+                  'items': items}
+        if not report['feasible']:
+            logger.warning("Plan de {0} tareas ocupa {1:.0%} del bus.".format(
+                len(self.items), occupancy))
+        return report
+
+
+class TrafficMeter(object):
+    """
+    Bytes in the bus and time spent in transactions in the last ``window``
+    seconds. Give it to :class:`SerialInterface` as ``meter``.
+    """
+
+    def __init__(self, baudrate=DEFAULT_BAUDRATE, window=METER_WINDOW):
+        self.baudrate = baudrate
+        self.window = window
+        self.started = time.monotonic()
+        self._bytes = deque()
+        self._busy = deque()
+        self._lock = Lock()
+        self.total_bytes = 0
+        self.transactions = 0
+
+    def _prune(self, events, now):
+        limit = now - self.window
+        while events and events[0][0] < limit:
+            events.popleft()
+
+    def record(self, length, now=None):
+        """
+        Count ``length`` bytes seen in the bus.
+        """
+        if not length:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._bytes.append((now, length))
+            self.total_bytes += length
+            self._prune(self._bytes, now)
+
+    def busy(self, seconds, now=None):
+        """
+        Count a transaction that took ``seconds``.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._busy.append((now, seconds))
+            self.transactions += 1
+            self._prune(self._busy, now)
+
+    def report(self, now=None):
+        """
+        :return: dict with the ``bytes`` and ``transactions`` of the window,
+            the ``utilization`` of the line (time of the bytes at the
+            baudrate) and the ``busy`` fraction (time in transactions,
+            including the turnaround and the timeouts), both over the
+            ``window`` or the time since the meter started if it's shorter.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._prune(self._bytes, now)
+            self._prune(self._busy, now)
+            length = sum(event[1] for event in self._bytes)
+            busy = sum(event[1] for event in self._busy)
+            transactions = len(self._busy)
+        elapsed = min(self.window, now - self.started) or 1e-9
+        return {'bytes': length,
+                'transactions': transactions,
+                'utilization': wire_time(length, self.baudrate) / elapsed,
+                'busy': busy / elapsed,
+                'window': elapsed}
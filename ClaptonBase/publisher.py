@@ -0,0 +1,259 @@
+"""
+.. module:: publisher
+    :platform: Unix
+    :synopsis: Publication of the state of the TKLan over ZMQ PUB
+
+:class:`Publisher` sends multipart messages (``topic``, ``payload``) with
+binary payloads, instead of the hexlified text of
+:func:`MemoryContainer.as_msg`:
+
+* ``MSG_MEMORY_PREFIX``: several memory updates in one message. Only the
+  ranges that changed since the last publication are sent::
+
+      header:  version | amount of updates | timestamp        '<BHd'
+      update:  node << 4 | instance | start | length | dt     '<BHBf'
+               data (length bytes)
+
+  ``dt`` is the timestamp of the update minus the one of the header.
+
+* ``MSG_NODE_PREFIX``: the status of several nodes, header ``'<BHd'`` and
+  ``'<BBd'`` (``lan_dir``, ``status``, ``last_seen``) for each node.
+* ``MSG_MASTER_PREFIX``: ``'<B?d'`` version, ``im_master`` and timestamp.
+* ``MSG_CON_PREFIX``: ``'<B?d'`` version, port open and timestamp.
+
+Use :func:`decode_memory`, :func:`decode_nodes` and :func:`decode_status`
+to read them. The socket can be bound to ``tcp://``, ``ipc://`` or
+``inproc://`` addresses. Requires ``pyzmq``
+(``pip install ClaptonBase[gateway]``) unless a socket is given.
+"""
+import math
+import struct
+import time
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+from .cfg import (DEFAULT_CONN_PORT, MSG_CON_PREFIX, MSG_MASTER_PREFIX,
+                  MSG_MEMORY_PREFIX, MSG_NODE_PREFIX, PUBLISHER_VERSION)
+from .containers import INSTANCE_CODES, INSTANCE_NAMES, MemoryContainer
+from .utils import get_logger
+
+logger = get_logger('publisher')
+
+HEADER = struct.Struct('<BHd')
+UPDATE = struct.Struct('<BHBf')
+NODE_STATUS = struct.Struct('<BBd')
+STATUS = struct.Struct('<B?d')
+# Un update tiene un encabezado de UPDATE.size bytes, por eso dos rangos
+# separados por menos bytes iguales se envian juntos.
+MERGE_GAP = UPDATE.size
+MAX_UPDATE_LENGTH = 255
+
+
+def changed_ranges(image, known, start, data, gap=MERGE_GAP):
+    """
+    :param image: Last bytes published of the memory.
+    :type image: bytearray
+    :param known: 1 for the bytes of ``image`` that were published.
+    :type known: bytearray
+    :param start: Address of the first byte of ``data``.
+    :param data: Bytes read.
+    :param gap: Runs of equal bytes shorter than this are sent anyway, to
+        avoid the header of a new update.
+    :return: list of (``first``, ``last``) offsets in ``data`` that changed,
+        ``last`` excluded.
+    """
+    ranges = list()
+    first = last = None
+    for offset, byte in enumerate(data):
+        address = start + offset
+        if address < len(image) and known[address] and image[address] == byte:
+            continue
+        if first is not None and offset - last <= gap and offset - first < MAX_UPDATE_LENGTH:
+            last = offset + 1
+            continue
+        if first is not None:
+            ranges.append((first, last))
+        first, last = offset, offset + 1
+    if first is not None:
+        ranges.append((first, last))
+    return ranges
+
+
+def decode_memory(payload):
+    """
+    :param payload: Payload of a ``MSG_MEMORY_PREFIX`` message.
+    :return: list of :class:`MemoryContainer` with the ranges updated.
+    """
+    version, count, timestamp = HEADER.unpack_from(payload)
+    offset = HEADER.size
+    containers = list()
+    for _ in range(count):
+        key, start, length, delta = UPDATE.unpack_from(payload, offset)
+        offset += UPDATE.size
+        containers.append(MemoryContainer(key >> 4, INSTANCE_NAMES[key & 0x0f], start,
+                                          timestamp=timestamp + delta,
+                                          data=bytes(payload[offset:offset + length])))
+        offset += length
+    return containers
+
+
+def decode_nodes(payload):
+    """
+    :param payload: Payload of a ``MSG_NODE_PREFIX`` message.
+    :return: list of tuples (``lan_dir``, ``status``, ``last_seen``).
+        ``last_seen`` is None if the node was never seen.
+    """
+    version, count, timestamp = HEADER.unpack_from(payload)
+    nodes = list()
+    for index in range(count):
+        lan_dir, status, last_seen = NODE_STATUS.unpack_from(
+            payload, HEADER.size + index * NODE_STATUS.size)
+        nodes.append((lan_dir, status, None if math.isnan(last_seen) else last_seen))
+    return nodes
+
+
+def decode_status(payload):
+    """
+    :param payload: Payload of a ``MSG_MASTER_PREFIX`` or ``MSG_CON_PREFIX``
+        message.
+    :return: tuple (``value``, ``timestamp``).
+    """
+    version, value, timestamp = STATUS.unpack(payload)
+    return value, timestamp
+
+
+class Publisher(object):
+    """
+    Publish the memory of the nodes, their status and the status of the
+    interface in a ZMQ PUB socket.
+
+    The subscribers that connect later only receive the ranges that change
+    after that. Call :func:`reset` periodically, or when a subscriber asks,
+    to send the whole memory again.
+    """
+
+    def __init__(self, address=None, socket=None, context=None):
+        """
+        :param address: Where to bind the socket. The default is
+            ``tcp://*:DEFAULT_CONN_PORT``.
+        :type address: str
+        :param socket: A socket already bound, with ``send_multipart``.
+        :param context: The ``zmq.Context``. The default is the global one.
+        """
+        if socket is None:
+            if zmq is None:
+                raise ImportError('El Publisher necesita pyzmq.')
+            context = context or zmq.Context.instance()
+            socket = context.socket(zmq.PUB)
+            address = address or 'tcp://*:{}'.format(DEFAULT_CONN_PORT)
+            socket.bind(address)
+            logger.info("Publicando en {}.".format(address))
+        self.socket = socket
+        self.address = address
+        # Ultimos bytes publicados por (nodo, instancia) y cuales se conocen.
+        self._images = dict()
+
+    def _send(self, topic, payload):
+        self.socket.send_multipart([topic.encode(), payload])
+
+    def reset(self, node=None):
+        """
+        Forget what was published, of ``node`` or of every node, so the next
+        memory read is published complete.
+        """
+        if node is None:
+            self._images.clear()
+            return
+        for key in [key for key in self._images if key[0] == node]:
+            del self._images[key]
+
+    def _updates(self, container):
+        image, known = self._images.setdefault(
+            (container.node, container.instance), (bytearray(), bytearray()))
+        end = container.start + container.length
+        if len(image) < end:
+            image.extend(bytes(end - len(image)))
+            known.extend(bytes(end - len(known)))
+        ranges = changed_ranges(image, known, container.start, container.data)
+        image[container.start:end] = container.data
+        known[container.start:end] = b'\x01' * container.length
+        return [(container.start + first, container.data[first:last])
+                for first, last in ranges]
+
+    def publish_memory(self, containers):
+        """
+        Publish the bytes of ``containers`` that changed, in one message.
+
+        :param containers: The memory read.
+        :type containers: iterable of :class:`MemoryContainer`
+        :return: The amount of bytes of the payload, 0 if nothing changed and
+            nothing was sent.
+        """
+        containers = list(containers)
+        if not containers:
+            return 0
+        now = time.time()
+        timestamps = [now if container.timestamp is None else container.timestamp
+                      for container in containers]
+        base = min(timestamps)
+        updates = list()
+        for container, timestamp in zip(containers, timestamps):
+            key = container.node << 4 | INSTANCE_CODES[container.instance]
+            delta = timestamp - base
+            updates += [(key, start, data, delta) for start, data in self._updates(container)]
+        if not updates:
+            return 0
+        # Un solo buffer para todo el mensaje.
+        payload = bytearray(HEADER.size + sum(UPDATE.size + len(update[2]) for update in updates))
+        HEADER.pack_into(payload, 0, PUBLISHER_VERSION, len(updates), base)
+        offset = HEADER.size
+        for key, start, data, delta in updates:
+            UPDATE.pack_into(payload, offset, key, start, len(data), delta)
+            offset += UPDATE.size
+            payload[offset:offset + len(data)] = data
+            offset += len(data)
+        self._send(MSG_MEMORY_PREFIX, payload)
+        return len(payload)
+
+    def publish_poll(self, results):
+        """
+        Publish the result of :func:`BusManager.poll`.
+
+        :param results: dict with the :class:`MemoryContainer` by poll.
+        """
+        return self.publish_memory(results.values())
+
+    def publish_nodes(self, nodes):
+        """
+        Publish the status of ``nodes`` in one message.
+
+        :type nodes: iterable of :class:`Node`
+        """
+        nodes = list(nodes)
+        payload = HEADER.pack(PUBLISHER_VERSION, len(nodes), time.time()) + b''.join(
+            NODE_STATUS.pack(node.lan_dir, node.status,
+                             float('nan') if node.last_seen is None else node.last_seen)
+            for node in nodes)
+        self._send(MSG_NODE_PREFIX, payload)
+
+    def publish_master(self, ser):
+        """
+        Publish if ``ser`` is master.
+
+        :type ser: :class:`SerialInterface`
+        """
+        self._send(MSG_MASTER_PREFIX, STATUS.pack(PUBLISHER_VERSION, ser.im_master, time.time()))
+
+    def publish_connection(self, ser):
+        """
+        Publish if the port of ``ser`` is open.
+
+        :type ser: :class:`SerialInterface`
+        """
+        self._send(MSG_CON_PREFIX, STATUS.pack(PUBLISHER_VERSION, ser.isOpen(), time.time()))
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,133 @@
+"""
+.. module:: retry
+    :platform: Unix
+    :synopsis: Retry policies of the transactions of :class:`SerialInterface`
+
+A :class:`RetryPolicy` decides, after each failed attempt to send a package,
+if it's tried again and how long to wait before. Each kind of failure can
+have its own rule, looked up by the class of the exception and of its cause
+(``__cause__``), so the answer that didn't arrive (a :class:`WriteException`
+caused by a :class:`ReadException`) and the answer with a bad checksum (caused
+by a :class:`ChecksumException`) can be handled differently:
+
+* :class:`CollisionException`: another node was talking. Wait a random time
+  so the nodes don't collide again.
+* :class:`ReadException`: nothing was heard, the echo or the answer.
+* :class:`ChecksumException`: the answer arrived corrupted. Retry at once.
+
+The policy of a call is the one given to ``send_package``, or the one of the
+thread (see :func:`SerialInterface.retrying`), or the one of the interface.
+"""
+import random
+import time
+
+from .cfg import (COLLISION_DELAY, PERSISTENT_DELAY, PERSISTENT_RETRIES,
+                  POLLING_DEADLINE, POLLING_RETRIES, RETRY_MAX_DELAY,
+                  SEND_PACKAGE_TRIES)
+from .exceptions import ChecksumException, CollisionException
+
+RULE_FIELDS = ('retries', 'delay', 'max_delay', 'factor', 'jitter')
+
+
+class RetryPolicy(object):
+    """
+    Amount of retries and wait between them, by kind of failure.
+    """
+
+    def __init__(self, retries=SEND_PACKAGE_TRIES, delay=0., max_delay=RETRY_MAX_DELAY,
+                 factor=2., jitter=0., deadline=None, rules=None):
+        """
+        :param retries: Attempts after the first one.
+        :param delay: Wait in seconds before the first retry.
+        :param max_delay: Maximum wait between attempts.
+        :param factor: The wait is multiplied by this after each retry.
+        :param jitter: Fraction of the wait that is random: the wait is
+            between ``delay * (1 - jitter)`` and ``delay``.
+        :param deadline: Seconds since the first attempt after which there's
+            no more retries. None is without limit.
+        :param rules: dict with the fields to change (see
+            :data:`RULE_FIELDS`) by exception class.
+        :type rules: dict
+        """
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.deadline = deadline
+        self.rules = dict(rules or {})
+
+    def replace(self, **kwargs):
+        """
+        :param kwargs: Arguments of :class:`RetryPolicy` to change. The
+            ``rules`` given are added to the current ones.
+        :return: A new policy, for the overrides of one call.
+        """
+        arguments = dict((field, getattr(self, field)) for field in RULE_FIELDS)
+        arguments['deadline'] = self.deadline
+        arguments['rules'] = dict(self.rules)
+        arguments['rules'].update(kwargs.pop('rules', {}))
+        arguments.update(kwargs)
+        return RetryPolicy(**arguments)
+
+    def rule(self, error):
+        """
+        :return: tuple (``key``, ``fields``) with the class that chose the
+            rule for ``error`` (None for the default one) and a dict with its
+            :data:`RULE_FIELDS`.
+        """
+        fields = dict((field, getattr(self, field)) for field in RULE_FIELDS)
+        for candidate in (error.__cause__, error):
+            if candidate is None:
+                continue
+            for cls in type(candidate).__mro__:
+                if cls in self.rules:
+                    fields.update(self.rules[cls])
+                    return cls, fields
+        return None, fields
+
+    def start(self):
+        """
+        :return: :class:`Attempts` for a new call.
+        """
+        return Attempts(self)
+
+
+class Attempts(object):
+    """
+    The failed attempts of one call, counted by rule.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.started = time.monotonic()
+        self.counts = dict()
+
+    def backoff(self, error):
+        """
+        Count the failure ``error``.
+
+        :return: Seconds to wait before trying again or None if there's no
+            more retries.
+        """
+        key, fields = self.policy.rule(error)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count > fields['retries']:
+            return None
+        delay = min(fields['delay'] * fields['factor'] ** (count - 1), fields['max_delay'])
+        delay *= 1 - fields['jitter'] * random.random()
+        deadline = self.policy.deadline
+        if deadline is not None and time.monotonic() - self.started + delay > deadline:
+            return None
+        return delay
+
+
+# Politica por defecto: SEND_PACKAGE_TRIES reintentos sin espera, salvo las
+# colisiones, que esperan un tiempo al azar.
+DEFAULT = RetryPolicy(rules={CollisionException: {'delay': COLLISION_DELAY, 'jitter': 1.}})
+# Lecturas periodicas: si fallan, la siguiente lectura llega pronto.
+POLLING = DEFAULT.replace(retries=POLLING_RETRIES, deadline=POLLING_DEADLINE)
+# Escritura de programas: reintentar con espera creciente.
+PERSISTENT = DEFAULT.replace(retries=PERSISTENT_RETRIES, delay=PERSISTENT_DELAY,
+                             rules={ChecksumException: {'delay': 0.}})
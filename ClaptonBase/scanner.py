@@ -0,0 +1,103 @@
+"""
+Find the TKLan frames in a buffer of bytes read from the bus with NumPy.
+
+The checksum of every position of the buffer is validated at once with the
+prefix sums of the bytes: a frame that starts in ``i`` with ``size`` bytes is
+valid when the sums until ``i`` and until ``i + size`` are equal modulo 256.
+Then the frames are chained like :func:`listen_packages` does: after a frame
+the next one is the first valid position after its end. Only this last step
+is a loop in Python, and it runs once per frame instead of once per byte.
+
+Requires ``numpy`` (``pip install ClaptonBase[analysis]``).
+"""
+import numpy as np
+
+
+def valid_offsets(buffer, limit=None):
+    """
+    :param buffer: Bytes read from the bus.
+    :type buffer: bytes | bytearray | memoryview
+    :param limit: Only the positions before this one are validated.
+    :return: tuple of arrays with every position where the length declared
+        in the header and the checksum are valid, and the size of each frame.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    size = len(data)
+    if limit is None or limit > size:
+        limit = size
+    count = max(min(limit, size - 2), 0)
+    # La suma acumulada en uint8 ya es modulo 256.
+    prefix = np.zeros(size + 1, dtype=np.uint8)
+    np.cumsum(data, dtype=np.uint8, out=prefix[1:])
+    positions = np.arange(count)
+    sizes = (data[1:count + 1] & 0b00011111).astype(np.intp) + 3
+    ends = positions + sizes
+    fits = np.flatnonzero(ends <= size)
+    offsets = fits[prefix[ends[fits]] == prefix[fits]]
+    return offsets, sizes[offsets]
+
+
+class Frames(object):
+    """
+    Frames found by :func:`scan`. Every attribute is an array with one item
+    per frame, except ``lead``, ``errors`` and ``stop``.
+
+    :param offsets: Position of each frame in the buffer.
+    :param sizes: Size of each frame, header and checksum included.
+    :param senders: ``lan_dir`` of the sender.
+    :param destinations: ``lan_dir`` of the destination.
+    :param functions: Function of the frame.
+    :param lengths: Length of the data.
+    :param lead: Bytes skipped before the first frame.
+    :param errors: Bytes skipped after the first frame.
+    :param stop: Position where the scan stopped.
+    """
+
+    def __init__(self, buffer, offsets, sizes, stop):
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        self.offsets = offsets
+        self.sizes = sizes
+        self.senders = data[offsets] >> 4
+        self.destinations = data[offsets] & 0b00001111
+        self.functions = data[offsets + 1] >> 5
+        self.lengths = sizes - 3
+        self.stop = stop
+        if len(offsets):
+            self.lead = int(offsets[0])
+            self.errors = int(stop - self.lead - sizes.sum())
+        else:
+            self.lead = stop
+            self.errors = 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def scan(buffer, limit=None):
+    """
+    Find the frames in ``buffer``, skipping the bytes that don't start a
+    frame with a valid checksum.
+
+    :param buffer: Bytes read from the bus.
+    :type buffer: bytes | bytearray | memoryview
+    :param limit: Only the frames that start before this position are
+        returned. By default all of them. The frames can end after it.
+    :return: :class:`Frames`
+    """
+    size = len(buffer)
+    if limit is None or limit > size:
+        limit = size
+    candidates, sizes = valid_offsets(buffer, limit)
+    # Indice del primer candidato despues del final de cada candidato.
+    following = np.searchsorted(candidates, candidates + sizes).tolist()
+    chain = list()
+    index = 0
+    while index < len(following):
+        chain.append(index)
+        index = following[index]
+    offsets = candidates[chain]
+    sizes = sizes[chain]
+    stop = max(min(limit, size - 2), 0)
+    if len(offsets):
+        stop = max(stop, int(offsets[-1] + sizes[-1]))
+    return Frames(buffer, offsets, sizes, stop)
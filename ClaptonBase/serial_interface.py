@@ -5,14 +5,23 @@
 
 """
 import time
-from threading import Lock, Thread
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from threading import Lock, Thread, local
 
 import serial
 
 from . import decode
 from . import cfg
+from .capture import RX, TX, CaptureWriter
+from . import autobaud
 from .containers import Package
-from .exceptions import (ChecksumException, DecodeError, NoMasterException,
+from .deadline import Deadline
+from .retry import DEFAULT as DEFAULT_RETRY
+from .transports import transport_for
+from .exceptions import (ChecksumException, CollisionException,
+                         DeadlineException, DecodeError, NoMasterException,
                          NoSlaveException, ReadException, SerialConfigError,
                          WriteException, TokenException)
 from .utils import GiveMasterEvent, MasterEvent, get_logger
@@ -35,12 +44,21 @@ class SerialInterface(object):
 
     * :func:`acept_token`: to accept a token offer from a node.
     * :func:`check_master`: to check if there's any master on the network or not. If not this means that you are master!
+    * :func:`queue_package`: to send a package in the next token turn when you are slave
+      and ``token_burst`` is set.
     """
 
     def __init__(self,
                  serial_port='/dev/ttyAMA0',
                  baudrate=cfg.DEFAULT_BAUDRATE,
-                 timeout=cfg.DEFAULT_SERIAL_TIMEOUT):
+                 timeout=cfg.DEFAULT_SERIAL_TIMEOUT,
+                 transport=None,
+                 local_echo=True,
+                 admission=None,
+                 token_burst=False,
+                 retry_policy=DEFAULT_RETRY,
+                 meter=None,
+                 autobaud=False):
         """
         This class initialize with the information about
         where connect (``serial_port``), at what speed (``baudrate``)
@@ -48,7 +66,8 @@ class SerialInterface(object):
         to your answer (``timeout``).
 
         :param serial_port:The path to the serial port in the sistem. The
-            default value correspond to the Raspbian distribution for Raspberry Pi: ``/dev/ttyAMA0``
+            default value correspond to the Raspbian distribution for Raspberry Pi: ``/dev/ttyAMA0``.
+            Also can be an URL to choose the transport, see :func:`transports.transport_for`.
         :type serial_port: str
         :param baudrate: The baudrate int bits per second. The default is 2400,
             the value used for most Teknotrol equpiments.
@@ -61,6 +80,32 @@ class SerialInterface(object):
         :param log_file: The file where the logs will be saved. The default
             value is None, that means that the logs will be shown in the stdout.
         :type log_file: str
+        :param transport: The port to use instead of the one made from
+            ``serial_port``.
+        :type transport: :class:`transports.Transport`
+        :param local_echo: If the port receives the bytes that it writes, like
+            the TKLan line does. Some adapters suppress the echo.
+        :type local_echo: bool
+        :param admission: Controller to admit the packages of
+            :func:`send_package` by priority when the bus is overloaded.
+            Without it the packages are sent in the order they get the port.
+        :type admission: :class:`admission.AdmissionController`
+        :param token_burst: If True, when you are slave the token offers are
+            accepted only if there are packages queued with
+            :func:`queue_package`. They are sent in one burst of up to
+            ``TOKEN_BURST_BUDGET`` seconds and the token is given back to the
+            master right after.
+        :type token_burst: bool
+        :param retry_policy: How to retry the packages that fail, when the
+            call or the thread don't give another one (see :func:`retrying`).
+        :type retry_policy: :class:`retry.RetryPolicy`
+        :param meter: Where to count the traffic of the bus.
+        :type meter: :class:`planner.TrafficMeter`
+        :param autobaud: If True, detect the baudrate of the bus when the
+            port opens, between ``CALIBRATION_BAUDRATES``, and set the
+            ``timeout`` for it (see :func:`calibrate`). ``baudrate`` is used
+            if it can't be detected.
+        :type autobaud: bool
 
         .. note::
             The default baudrate correspond with the equipments developed before
@@ -74,12 +119,23 @@ class SerialInterface(object):
         self._serial_port = serial_port
         self._baudrate = baudrate
         self._timeout = timeout
-        self._ser = serial.Serial()
-        self._ser.baudrate = self._baudrate
-        self._ser.timeout = self._timeout
-        self._ser.port = self._serial_port
+        if transport is None:
+            transport = transport_for(self._serial_port, self._baudrate, self._timeout)
+        self._ser = transport
+        self.local_echo = local_echo
+        self.admission = admission
+        self.token_burst = token_burst
+        self.retry_policy = retry_policy
+        self.meter = meter
+        self.autobaud = autobaud
+        self.calibration = None
+        self._local = local()
+        # Tiempo limite de la operacion que tiene el puerto, para las lecturas.
+        self._io_deadline = None
+        self._slave_queue = deque()
 
         self._stop = False
+        self.capture = None
 
         self._connection_thread = Thread(target=self._connection)
 
@@ -106,10 +162,69 @@ class SerialInterface(object):
         if self._connection_thread.is_alive():
             self._connection_thread.terminate()
         self._ser.close()
+        self.stop_capture()
 
     def isOpen(self):
         return self._ser.isOpen()
 
+    def start_capture(self, path):
+        """
+        Record every byte read or written in the port in the capture file
+        ``path`` (see :mod:`capture`).
+
+        :param path: The capture file. If exists the records are appended.
+        :type path: str
+        """
+        capture = CaptureWriter(path)
+        self.stop_capture()
+        self.capture = capture
+        return capture
+
+    def stop_capture(self):
+        """
+        Stop the recording started by :func:`start_capture`.
+        """
+        capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.close()
+
+    def _read(self, n=1):
+        deadline = self._io_deadline
+        if deadline is None:
+            data = self._ser.read(n)
+        else:
+            data = self._read_before(deadline, n)
+        meter = self.meter
+        if meter is not None:
+            meter.record(len(data))
+        capture = self.capture
+        if capture is not None:
+            capture.record(RX, data)
+        return data
+
+    def _read_before(self, deadline, n):
+        # Acorta el timeout del puerto si el tiempo limite vence antes.
+        deadline.check()
+        remaining = deadline.remaining()
+        timeout = getattr(self._ser, 'timeout', None)
+        if remaining is None or timeout is None or remaining >= timeout:
+            return self._ser.read(n)
+        self._ser.timeout = remaining
+        try:
+            return self._ser.read(n)
+        finally:
+            self._ser.timeout = timeout
+
+    def _write(self, data):
+        meter = self.meter
+        if meter is not None and not self.local_echo:
+            # Con eco local lo escrito se cuenta al leer el eco.
+            meter.record(len(data))
+        capture = self.capture
+        if capture is not None:
+            capture.record(TX, data)
+        return self._ser.write(data)
+
     def _do_connect(self):
         """
         Try to open the serial port and run :func:`check_master` to know wich
@@ -117,6 +232,8 @@ class SerialInterface(object):
         """
         try:
             self._ser.open()
+            if self.autobaud:
+                self.calibrate()
             self.check_master()
         except (serial.SerialException, OSError) as e:
             logger.error(
@@ -124,6 +241,23 @@ class SerialInterface(object):
             raise SerialConfigError()
         return self.isOpen()
 
+    def calibrate(self, baudrates=cfg.CALIBRATION_BAUDRATES,
+                  lan_dirs=cfg.CALIBRATION_PROBE_NODES,
+                  period=cfg.CALIBRATION_LISTEN_PERIOD):
+        """
+        Detect the baudrate of the bus, listening the traffic at each rate
+        or, if the bus is silent, probing the nodes ``lan_dirs``, and use the
+        fastest that works with a timeout for it (see :mod:`autobaud`).
+
+        :param baudrates: The rates to try.
+        :param period: Seconds to listen at each rate.
+        :return: dict with the result, also in :attr:`calibration`, or None
+            if no rate worked.
+        """
+        with self._locked():
+            self.calibration = autobaud.calibrate(self, baudrates, lan_dirs, period)
+        return self.calibration
+
     def _connection(self):
         """
         This is the function that execute the `_connection_thread`. If the
@@ -143,20 +277,97 @@ class SerialInterface(object):
         Try to listen an entire package from the up comming bytes in the serial port.
         If the checkum is not write raises ReadException
         """
-        head_bytes = self._ser.read(2)
+        head_bytes = self._read(2)
         if len(head_bytes) < 2:
             raise ReadException()
         function, length = decode.function_length(head_bytes[1:2])
-        tail_bytes = self._ser.read(length+1)
+        tail_bytes = self._read(length+1)
         readed_package = Package(bytes_chain=head_bytes+tail_bytes)
         return readed_package
 
+    def check_echo(self, bytes_chain):
+        """
+        Read the echo of ``bytes_chain`` and compare it byte by byte with what
+        was written, without decoding it as a :class:`Package`. Does nothing
+        if the port has no ``local_echo``.
+
+        raises:
+            * ReadException: If the echo is incomplete.
+            * CollisionException: If the echo is different, which means that
+              another node was talking at the same time.
+        """
+        if not self.local_echo:
+            return
+        echo = self._read(len(bytes_chain))
+        if len(echo) < len(bytes_chain):
+            raise ReadException()
+        if echo != bytes_chain:
+            raise CollisionException()
+
     def get_package_from_length(self, length):
-        bytes_chain = self._ser.read(length)
+        bytes_chain = self._read(length)
         package = Package(bytes_chain=bytes_chain)
         return package
 
-    def send_package(self, package):
+    @contextmanager
+    def retrying(self, policy):
+        """
+        Use ``policy`` for the packages sent by the current thread that don't
+        give one, like the ones of :class:`Node`.
+
+        :type policy: :class:`retry.RetryPolicy`
+        """
+        previous = getattr(self._local, 'retry_policy', None)
+        self._local.retry_policy = policy
+        try:
+            yield self
+        finally:
+            self._local.retry_policy = previous
+
+    def _retry_policy(self, retry=None):
+        return retry or getattr(self._local, 'retry_policy', None) or self.retry_policy
+
+    @contextmanager
+    def within(self, deadline):
+        """
+        Use ``deadline`` for the operations of the current thread that don't
+        give one, like the ones of :class:`Node`.
+
+        :param deadline: A :class:`Deadline` or seconds.
+        :return: The :class:`Deadline`, to cancel the operations from
+            another thread.
+        """
+        deadline = Deadline.coerce(deadline)
+        previous = getattr(self._local, 'deadline', None)
+        self._local.deadline = deadline
+        try:
+            yield deadline
+        finally:
+            self._local.deadline = previous
+
+    def _deadline(self, deadline=None):
+        if deadline is None:
+            return getattr(self._local, 'deadline', None)
+        return Deadline.coerce(deadline)
+
+    @contextmanager
+    def _locked(self, deadline=None):
+        """
+        Lock the port, waiting until ``deadline`` at most, and limit the
+        reads to it.
+        """
+        if deadline is None:
+            self.using_ser.acquire()
+        else:
+            deadline.acquire(self.using_ser)
+        self._io_deadline = deadline
+        try:
+            yield
+        finally:
+            self._io_deadline = None
+            self.using_ser.release()
+
+    def send_package(self, package, priority=None, retry=None, deadline=None):
         """
         In case that you where master (``im_master = True``) you are allowed to
         send packages to another nodes with this function.
@@ -167,6 +378,13 @@ class SerialInterface(object):
 
         :param package: The package that you want to send throght the serial port
         :type package: :func:`Paquete`
+        :param priority: Priority class for the :attr:`admission` controller.
+        :type priority: int
+        :param retry: Retry policy of this call.
+        :type retry: :class:`retry.RetryPolicy`
+        :param deadline: Time limit of the call, for the wait of the port and
+            the retries. By default the one of :func:`within`.
+        :type deadline: :class:`Deadline` | int | float
         :rtype: :func:`Paquete` with the response from the node
 
         raises:
@@ -174,30 +392,113 @@ class SerialInterface(object):
                 are not master.
             * ReadException: In case that there's no echo response.
             * WriteException: In case that the node don't answer.
+            * OverloadException: In case that the :attr:`admission` controller
+                rejects the package.
+            * DeadlineException: In case that ``deadline`` expires.
+            * CancelledException: In case that ``deadline`` is cancelled.
+        """
+        if not self.im_master:
+            raise NoMasterException()
+        logger.debug("Esperando disponibilidad de puerto serie.")
+        retry = self._retry_policy(retry)
+        deadline = self._deadline(deadline)
+        if self.admission is None:
+            with self._locked(deadline):
+                return self._transaction(package, retry, deadline)
+        with self.admission.admit(package, priority, deadline):
+            with self._locked(deadline):
+                return self._transaction(package, retry, deadline)
+
+    def send_packages(self, packages, return_errors=False, priority=None, retry=None,
+                      deadline=None):
+        """
+        Send ``packages`` one after the other, locking the serial port only
+        once for all of them. Useful to stream many requests to the nodes
+        without giving the port to other threads between them. The
+        :attr:`admission` controller admits all of them at once.
+
+        :param packages: The packages to send.
+        :type packages: iterable of :class:`Package`
+        :param return_errors: If True the exception of a package that fails
+            is returned in its place and the next packages are sent anyway.
+        :type return_errors: bool
+        :param priority: Priority class for the :attr:`admission` controller.
+        :type priority: int
+        :param retry: Retry policy of each package.
+        :type retry: :class:`retry.RetryPolicy`
+        :param deadline: Time limit of all the packages.
+        :type deadline: :class:`Deadline` | int | float
+        :return: list with the answers, in the same order than ``packages``.
+
+        raises: The same exceptions than :func:`send_package`.
         """
         if not self.im_master:
             raise NoMasterException()
         logger.debug("Esperando disponibilidad de puerto serie.")
-        tries = 0
-        with self.using_ser:
-            while 1:
+        retry = self._retry_policy(retry)
+        deadline = self._deadline(deadline)
+        packages = list(packages)
+        if self.admission is None:
+            return self._batch(packages, return_errors, retry, deadline)
+        with self.admission.admit(packages, priority, deadline):
+            return self._batch(packages, return_errors, retry, deadline)
+
+    def _batch(self, packages, return_errors, retry, deadline):
+        with self._locked(deadline):
+            if not return_errors:
+                return [self._transaction(package, retry, deadline) for package in packages]
+            answers = list()
+            for package in packages:
                 try:
-                    self._ser.flushInput()
-                    self._ser.write(package.bytes_chain)
-                    echo_package = self.listen_package()
-                    try:
-                        response_package = self.listen_package()
-                        return response_package
-                    except (ReadException, ChecksumException) as error:
-                            raise WriteException()
+                    answers.append(self._transaction(package, retry, deadline))
                 except (WriteException, ReadException, ChecksumException) as error:
-                    if tries < cfg.SEND_PACKAGE_TRIES:
-                        tries += 1
-                        logger.error(error)
-                    else:
-                        raise error
+                    answers.append(error)
+            return answers
 
-    def listen_packages(self):
+    def _transaction(self, package, retry=None, deadline=None):
+        """
+        Write ``package`` and read the echo and the answer, retrying as
+        ``retry`` says until ``deadline``. The port should be locked.
+
+        A missing or corrupted answer raises :class:`WriteException` with the
+        original exception as the cause, so the policy can tell them apart.
+        """
+        attempts = (retry or self.retry_policy).start()
+        meter = self.meter
+        if meter is None:
+            return self._attempts(package, attempts, deadline)
+        started = time.monotonic()
+        try:
+            return self._attempts(package, attempts, deadline)
+        finally:
+            meter.busy(time.monotonic() - started)
+
+    def _attempts(self, package, attempts, deadline):
+        while 1:
+            if deadline is not None:
+                deadline.check()
+            try:
+                self._ser.flushInput()
+                self._write(package.bytes_chain)
+                self.check_echo(package.bytes_chain)
+                try:
+                    response_package = self.listen_package()
+                    return response_package
+                except (ReadException, ChecksumException) as error:
+                    raise WriteException() from error
+            except (WriteException, ReadException, ChecksumException) as error:
+                delay = attempts.backoff(error)
+                remaining = None if deadline is None else deadline.remaining()
+                if delay is None or (remaining is not None and delay >= remaining):
+                    logger.error("Paquete %s descartado: %s", package.hexlified, error)
+                    raise error
+                logger.warning("Reintentando paquete %s: %s", package.hexlified, error)
+                if deadline is not None:
+                    deadline.sleep(delay)
+                elif delay:
+                    time.sleep(delay)
+
+    def listen_packages(self, deadline=None):
         """
         If you are not master this means that you anly can listen to the packages in
         the network.
@@ -205,6 +506,14 @@ class SerialInterface(object):
         Also check if ``want_master`` flag is set to know if should answer to the token
         offer when appear.
 
+        The port is locked only while each package is read, not between
+        them, so other threads can send (once we are master) while the
+        caller handles the package. With ``deadline`` the generator ends when
+        it expires or is cancelled.
+
+        :param deadline: Time limit to wait the port and to listen.
+        :type deadline: :class:`Deadline` | int | float
+
         return:
             Python generator
 
@@ -214,36 +523,87 @@ class SerialInterface(object):
             * NoSlaveException: In case that the serial port don't return nothing.
                 Which means that nobody is talking, so you are master now.
         """
-        logger.debug("Esperando disponibilidad de puerto serie.")
-        with self.using_ser:
-            bytes_chain = b''
-            while not self._stop:
-                try:
-                    bytes_chain += self._ser.read(3)
-                    function, data_length = decode.function_length(bytes_chain[1:2])
-                    package_length = data_length + 3
-                    if len(bytes_chain) < package_length:
-                        bytes_chain += self._ser.read(package_length-len(bytes_chain))
-                    package = Package(bytes_chain=bytes_chain[:package_length])
-                    bytes_chain = bytes_chain[package_length:]
-
-                    if self.want_master.isSet() and package.function == 7 and not len(bytes_chain):
-                        self.accept_token(package.sender)
-                        self.check_master(ser_locked=True)
-                        if self.im_master:
-                            self.want_master.clear()
-                    yield package
-                except (ChecksumException, DecodeError) as e:
-                    logger.info("Paquete perdido.")
-                    bytes_chain = bytes_chain[1:]
-                    continue
-                except IndexError:
-                    logger.warning(
-                        'Funcion read_ser no recibe nada.')
-                    self.check_master(ser_locked=True)
-                    if self.im_master and not self.want_master.isSet():
-                        self.want_master.clear()
-                        raise NoSlaveException()
+        deadline = self._deadline(deadline)
+        while not self._stop and not (deadline is not None and deadline.expired):
+            logger.debug("Esperando disponibilidad de puerto serie.")
+            try:
+                with self._locked(deadline):
+                    # Lo leido con el puerto liberado es de otras transacciones,
+                    # nada se guarda de una lectura a la siguiente.
+                    packages = self._next_packages()
+            except DeadlineException:
+                logger.info("Fin de la escucha por tiempo limite.")
+                return
+            for package in packages:
+                yield package
+
+    def _next_packages(self):
+        """
+        Read the next package of the bus, answering the token if we want it.
+        The port should be locked. If more bytes than the package were read
+        the packages that follow are read too, so nothing is left for the
+        next time the port is locked.
+
+        :return: list with the packages read, empty if none could be read.
+        """
+        try:
+            bytes_chain = self._read(3)
+            if not bytes_chain:
+                # Nadie habla en el bus.
+                raise IndexError()
+            packages = list()
+            while bytes_chain:
+                package, bytes_chain = self._sync_package(bytes_chain)
+                if package is None:
+                    break
+                packages.append(package)
+            if not packages:
+                return packages
+            # Solo se responde el token si es lo ultimo que se leyo.
+            package = packages[-1]
+
+            if self.token_burst:
+                if self._slave_queue and package.function == 7:
+                    self._token_turn(package.sender)
+            elif self.want_master.isSet() and package.function == 7:
+                self.accept_token(package.sender)
+                self.check_master(ser_locked=True)
+                if self.im_master:
+                    self.want_master.clear()
+            return packages
+        except IndexError:
+            logger.warning(
+                'Funcion read_ser no recibe nada.')
+            self.check_master(ser_locked=True)
+            if self.im_master and not self.want_master.isSet():
+                self.want_master.clear()
+                raise NoSlaveException()
+            return []
+
+    def _sync_package(self, bytes_chain):
+        """
+        Decode the package that starts in ``bytes_chain``, reading the bytes
+        missing. If there's no valid package the first byte is discarded and
+        the next one is tried, up to the length of the longest package.
+
+        :return: tuple (package or None, bytes read after the package).
+        """
+        for _ in range(cfg.MAX_DATA_LENGTH + 3):
+            if len(bytes_chain) < 3:
+                bytes_chain += self._read(3 - len(bytes_chain))
+            if not bytes_chain:
+                break
+            try:
+                function, data_length = decode.function_length(bytes_chain[1:2])
+                package_length = data_length + 3
+                if len(bytes_chain) < package_length:
+                    bytes_chain += self._read(package_length-len(bytes_chain))
+                package = Package(bytes_chain=bytes_chain[:package_length])
+                return package, bytes_chain[package_length:]
+            except (ChecksumException, DecodeError):
+                logger.info("Paquete perdido.")
+                bytes_chain = bytes_chain[1:]
+        return None, b''
 
     def accept_token(self, sender):
         """
@@ -259,18 +619,85 @@ class SerialInterface(object):
         """
         logger.info('Aceptando oferta de token.')
         token_rta = Package(destination=sender, function=7)
-        self._ser.write(token_rta.bytes_chain)
-        echo_package = self.get_package_from_length(len(token_rta.bytes_chain))
+        self._write(token_rta.bytes_chain)
+        self.check_echo(token_rta.bytes_chain)
         response = self.get_package_from_length(
             cfg.TOKEN_ACCEPTANCE_RTA_SIZE)
         package = Package(destination=sender, function=7)
-        self._ser.write(bytes(package))
-        echo_package = self.listen_package()
+        self._write(package.bytes_chain)
+        self.check_echo(package.bytes_chain)
         response = self.listen_package()
         return response
 
-    def offer_token(self, destination):
+    def queue_package(self, package, deadline=None):
+        """
+        Queue ``package`` to send it in the next token turn, see
+        ``token_burst``. If you are master it's sent right now.
+
+        :param package: The package to send.
+        :type package: :class:`Package`
+        :param deadline: Time limit to send it. If it expires or is cancelled
+            while queued the package is not sent.
+        :type deadline: :class:`Deadline` | int | float
+        :return: :class:`concurrent.futures.Future` with the answer, or the
+            exception of :func:`send_package`. Cancel it to remove the package
+            from the queue.
+        """
+        future = Future()
+        deadline = self._deadline(deadline)
+        if self.im_master:
+            try:
+                future.set_result(self.send_package(package, deadline=deadline))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        self._slave_queue.append((package, future, deadline))
+        return future
+
+    def _token_turn(self, sender):
+        """
+        Accept the token offered by ``sender``, send the queued packages
+        until the queue is empty or ``TOKEN_BURST_BUDGET`` expires and give
+        the token back to ``sender``. The port should be locked.
+
+        :return: The amount of packages sent.
+        """
+        try:
+            self.accept_token(sender)
+        except (ReadException, ChecksumException, WriteException) as error:
+            logger.warning("No se pudo aceptar el token: %s", error)
+            return 0
+        self.im_master = True
+        budget = time.monotonic() + cfg.TOKEN_BURST_BUDGET
+        sent = 0
+        # Al menos un paquete por turno, aunque el presupuesto sea muy corto.
+        while self._slave_queue and (not sent or time.monotonic() < budget):
+            package, future, deadline = self._slave_queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if deadline is not None:
+                    deadline.check()
+                future.set_result(self._transaction(package, deadline=deadline))
+            except (WriteException, ReadException, ChecksumException,
+                    DeadlineException) as error:
+                future.set_exception(error)
+            sent += 1
+        logger.info("Enviados %s paquetes con el token, %s en espera.",
+                    sent, len(self._slave_queue))
+        try:
+            self.offer_token(sender, check=False)
+            self.im_master = False
+        except (ReadException, ChecksumException, WriteException) as error:
+            logger.error("Error devolviendo el token al nodo %s: %s", sender, error)
+            self.check_master(ser_locked=True)
+        return sent
+
+    def offer_token(self, destination, check=True):
         """
+        :param destination: The ``lan_dir`` of the node that receives the token.
+        :param check: If True, confirm with :func:`check_master` that the
+            node took the token. Without it the answer of the node is enough.
         :return: None
         :raise:
             TokenExeption: Si no se pudo hacer el traspaso de token.
@@ -280,14 +707,16 @@ class SerialInterface(object):
 
         logger.info("Ofreciendo token al nodo {}.".format(destination))
         token_offer = Package(destination=destination, function=7)
-        self._ser.write(token_offer.bytes_chain)
-        echo_package = self.get_package_from_length(len(token_offer.bytes_chain))
+        self._write(token_offer.bytes_chain)
+        self.check_echo(token_offer.bytes_chain)
         response = self.get_package_from_length(
             cfg.TOKEN_OFFER_RTA_SIZE)
         package = Package(destination=destination, function=7)
-        self._ser.write(bytes(package))
-        echo_package = self.listen_package()
+        self._write(package.bytes_chain)
+        self.check_echo(package.bytes_chain)
         response = self.listen_package()
+        if not check:
+            return
         self.check_master()
         if self.im_master:
             logger.error(
@@ -312,7 +741,7 @@ class SerialInterface(object):
         bytes_chain = b''
         self._ser.flushInput()
         while time.time() < timeout:
-            bytes_chain += self._ser.read()
+            bytes_chain += self._read()
         self.im_master = len(bytes_chain) == 0
         if not ser_locked:
             self.using_ser.release()
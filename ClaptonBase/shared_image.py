@@ -0,0 +1,232 @@
+"""
+.. module:: shared_image
+    :platform: Unix
+    :synopsis: Image of the memory of the nodes in shared memory
+
+The process that polls the nodes writes every :class:`MemoryContainer` in a
+:class:`SharedImage` and the processes that analyze the data attach to it by
+name and read the memory directly, without pickling nor copying.
+
+The memory of each node and instance is divided in regions with a sequence
+number each one (a seqlock). The writer makes the numbers of the regions it
+writes odd, writes the data and makes them even again. A reader copies the
+range it wants and checks that the numbers were even and didn't change, or
+reads again::
+
+    header:  'CLPSHM' | version | nodes | memory size | region size
+    for each node and instance (RAM, EEPROM):
+             sequences (uint64 by region) | timestamps (float64 by region) | data
+
+There must be only one writer for each image. Requires ``numpy``
+(``pip install ClaptonBase[analysis]``).
+"""
+import struct
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .cfg import (SHARED_IMAGE_MEMORY_SIZE, SHARED_IMAGE_READ_TRIES,
+                  SHARED_IMAGE_REGION_SIZE)
+from .containers import INSTANCE_CODES
+from .exceptions import ReadException
+from .utils import get_logger
+
+logger = get_logger('shared_image')
+
+HEADER = struct.Struct('<6sBBHH')
+MAGIC = b'CLPSHM'
+VERSION = 1
+NODES = 16
+
+
+class SharedImage(object):
+    """
+    RAM and EEPROM of the 16 nodes of a TKLan in a
+    ``multiprocessing.shared_memory`` segment.
+    """
+
+    def __init__(self, name=None, create=False,
+                 memory_size=SHARED_IMAGE_MEMORY_SIZE,
+                 region_size=SHARED_IMAGE_REGION_SIZE):
+        """
+        Use :func:`create` in the writer and :func:`attach` in the readers.
+
+        :param name: Name of the segment. If ``create`` and is None a random
+            name is used, see :attr:`name`.
+        :param create: If True make a new segment, if not attach to ``name``.
+        :param memory_size: Bytes of each memory instance of each node.
+        :param region_size: Bytes of each region with its own sequence.
+        """
+        if create:
+            if memory_size % region_size:
+                raise ValueError('memory_size tiene que ser multiplo de region_size.')
+            size = self._size(memory_size, region_size)
+            self._segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+            HEADER.pack_into(self._segment.buf, 0, MAGIC, VERSION, NODES,
+                             memory_size, region_size)
+            logger.info("Imagen compartida {} creada.".format(self._segment.name))
+        else:
+            self._segment = shared_memory.SharedMemory(name=name)
+            _untrack(self._segment)
+            magic, version, nodes, memory_size, region_size = \
+                HEADER.unpack_from(self._segment.buf)
+            if (magic, version, nodes) != (MAGIC, VERSION, NODES):
+                self._segment.close()
+                raise ValueError('{} no es una imagen compartida.'.format(name))
+        self.owner = create
+        self.memory_size = memory_size
+        self.region_size = region_size
+        self._regions = memory_size // region_size
+        self._sequences = dict()
+        self._timestamps = dict()
+        self._data = dict()
+        offset = HEADER.size + (-HEADER.size % 8)
+        for node in range(NODES):
+            for instance in INSTANCE_CODES:
+                key = (node, instance)
+                self._sequences[key] = np.ndarray(self._regions, dtype=np.uint64,
+                                                  buffer=self._segment.buf, offset=offset)
+                offset += self._regions * 8
+                self._timestamps[key] = np.ndarray(self._regions, dtype=np.float64,
+                                                   buffer=self._segment.buf, offset=offset)
+                offset += self._regions * 8
+                self._data[key] = np.ndarray(memory_size, dtype=np.uint8,
+                                             buffer=self._segment.buf, offset=offset)
+                offset += memory_size + (-memory_size % 8)
+        if create:
+            for timestamps in self._timestamps.values():
+                timestamps[:] = np.nan
+
+    @staticmethod
+    def _size(memory_size, region_size):
+        block = 2 * 8 * (memory_size // region_size) + memory_size + (-memory_size % 8)
+        return HEADER.size + (-HEADER.size % 8) + NODES * len(INSTANCE_CODES) * block
+
+    @classmethod
+    def create(cls, name=None, **kwargs):
+        """
+        Make a new image to write it.
+
+        :rtype: :class:`SharedImage`
+        """
+        return cls(name, create=True, **kwargs)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Open the image ``name`` made in another process.
+
+        :rtype: :class:`SharedImage`
+        """
+        return cls(name)
+
+    @property
+    def name(self):
+        return self._segment.name
+
+    def _key(self, node, instance):
+        key = (node, instance)
+        if key not in self._data:
+            raise KeyError(key)
+        return key
+
+    def _span(self, start, length):
+        if start < 0 or length < 0 or start + length > self.memory_size:
+            raise IndexError('Rango fuera de la imagen: {0} + {1}'.format(start, length))
+        return start // self.region_size, (start + length - 1) // self.region_size + 1
+
+    def write(self, container):
+        """
+        Write the data of ``container`` in the image.
+
+        :type container: :class:`MemoryContainer`
+        """
+        key = self._key(container.node, container.instance)
+        first, last = self._span(container.start, container.length)
+        if not container.length:
+            return
+        sequences = self._sequences[key]
+        sequences[first:last] += 1
+        self._data[key][container.start:container.start + container.length] = \
+            np.frombuffer(container.data, dtype=np.uint8)
+        self._timestamps[key][first:last] = \
+            np.nan if container.timestamp is None else container.timestamp
+        sequences[first:last] += 1
+
+    def write_many(self, containers):
+        """
+        Write every container of ``containers``, like the result of
+        :func:`BusManager.poll`.
+        """
+        for container in containers:
+            self.write(container)
+
+    def view(self, node, instance):
+        """
+        :return: numpy array with the memory ``instance`` of ``node``. It's a
+            view of the shared memory, so it can change while you use it; use
+            :func:`read` or :func:`sequences` to have consistent data.
+        """
+        return self._data[self._key(node, instance)]
+
+    def sequences(self, node, instance):
+        """
+        :return: Copy of the sequence numbers of the regions of the memory
+            ``instance`` of ``node``. If they are even and equal before and
+            after using a :func:`view`, the view was consistent.
+        """
+        return self._sequences[self._key(node, instance)].copy()
+
+    def read(self, node, instance, start=0, length=None, out=None):
+        """
+        Consistent copy of a range of the memory.
+
+        :param node: ``lan_dir`` of the node.
+        :param instance: 'RAM' or 'EEPROM'.
+        :param start: First byte.
+        :param length: Amount of bytes, by default until the end.
+        :param out: numpy array of uint8 where copy the bytes, to avoid
+            allocating one in each read.
+        :return: tuple (array with the bytes, oldest timestamp of the regions
+            read, NaN if they were never written).
+
+        raises:
+            * ReadException: If the writer didn't let read a consistent copy
+              after ``SHARED_IMAGE_READ_TRIES``.
+        """
+        key = self._key(node, instance)
+        if length is None:
+            length = self.memory_size - start
+        first, last = self._span(start, length)
+        if out is None:
+            out = np.empty(length, dtype=np.uint8)
+        sequences = self._sequences[key][first:last]
+        data = self._data[key][start:start + length]
+        for _ in range(SHARED_IMAGE_READ_TRIES):
+            before = sequences.copy()
+            if np.any(before & 1):
+                continue
+            out[:length] = data
+            timestamp = np.min(self._timestamps[key][first:last]) if length else np.nan
+            if np.array_equal(before, sequences):
+                return out[:length], float(timestamp)
+        raise ReadException()
+
+    def close(self):
+        """
+        Release the arrays and close the segment. The writer also deletes it.
+        """
+        self._sequences = self._timestamps = self._data = dict()
+        self._segment.close()
+        if self.owner:
+            self._segment.unlink()
+
+
+def _untrack(segment):
+    # Hasta Python 3.13 el resource_tracker de un proceso que solo se conecta
+    # al segmento lo borra cuando ese proceso termina.
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, 'shared_memory')
+    except (ImportError, AttributeError, KeyError):
+        pass
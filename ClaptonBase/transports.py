@@ -0,0 +1,362 @@
+"""
+.. module:: transports
+    :platform: Unix
+    :synopsis: Transports used by :class:`SerialInterface` to reach the TKLan
+
+A transport has the same methods than ``serial.Serial`` that are used by
+:class:`SerialInterface` (``open``, ``close``, ``isOpen``, ``read``,
+``write`` and ``flushInput``), so any of them, or a ``serial.Serial``, can be
+used as the port of the interface. :func:`transport_for` choose one from the
+name of the port:
+
+* ``/dev/ttyAMA0`` or any URL of pyserial (``rfc2217://host:port``,
+  ``socket://host:port``, ...): :class:`SerialTransport`.
+* ``fd:///dev/ttyAMA0``: :class:`FdTransport`, that configures the port with
+  termios and reads with ``os.readv`` in a buffer that is reused.
+* ``tcp://host:port``: :class:`TcpTransport`, for the terminal servers of the
+  remote cabinets in raw TCP mode.
+"""
+import os
+import select
+import socket
+import termios
+import time
+from abc import ABC, abstractmethod
+
+import serial
+
+from . import cfg
+from .exceptions import WriteException
+from .utils import get_logger
+
+logger = get_logger('transports')
+
+
+class Transport(ABC):
+    """
+    Base class of the transports. ``read(n)`` returns up to ``n`` bytes,
+    less if ``timeout`` expires, like ``serial.Serial``. ``write`` raises
+    :class:`WriteException` if it can't write everything in
+    ``write_timeout``.
+    """
+
+    def __init__(self, port, baudrate=cfg.DEFAULT_BAUDRATE,
+                 timeout=cfg.DEFAULT_SERIAL_TIMEOUT,
+                 write_timeout=cfg.TRANSPORT_WRITE_TIMEOUT):
+        self.port = port
+        self._baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self._baudrate = baudrate
+
+    @abstractmethod
+    def open(self):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @abstractmethod
+    def isOpen(self):
+        pass
+
+    @abstractmethod
+    def read(self, n=1):
+        pass
+
+    @abstractmethod
+    def write(self, data):
+        pass
+
+    @abstractmethod
+    def flushInput(self):
+        pass
+
+
+class SerialTransport(Transport):
+    """
+    The port opened with pyserial. Accepts the paths of the ports and the
+    URLs of ``serial.serial_for_url``.
+    """
+
+    def __init__(self, port, baudrate=cfg.DEFAULT_BAUDRATE,
+                 timeout=cfg.DEFAULT_SERIAL_TIMEOUT,
+                 write_timeout=cfg.TRANSPORT_WRITE_TIMEOUT):
+        super(SerialTransport, self).__init__(port, baudrate, timeout, write_timeout)
+        self._serial = serial.serial_for_url(port, baudrate=baudrate, timeout=timeout,
+                                             write_timeout=write_timeout, do_not_open=True)
+
+    @property
+    def baudrate(self):
+        return self._serial.baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self._serial.baudrate = baudrate
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        # El Transport lo fija antes de crear el puerto.
+        self._timeout = timeout
+        port = getattr(self, '_serial', None)
+        if port is not None:
+            port.timeout = timeout
+
+    def open(self):
+        self._serial.open()
+
+    def close(self):
+        self._serial.close()
+
+    def isOpen(self):
+        return self._serial.isOpen()
+
+    def read(self, n=1):
+        return self._serial.read(n)
+
+    def write(self, data):
+        try:
+            return self._serial.write(data)
+        except serial.SerialTimeoutException:
+            raise WriteException
+
+    def flushInput(self):
+        self._serial.flushInput()
+
+
+class BufferedTransport(Transport):
+    """
+    Base class of the transports over a non-blocking file descriptor. Every
+    read is done in the same buffer, waiting with ``select`` until the
+    ``timeout``, so the only new object of each read are the bytes returned.
+    """
+
+    def __init__(self, port, baudrate=cfg.DEFAULT_BAUDRATE,
+                 timeout=cfg.DEFAULT_SERIAL_TIMEOUT,
+                 write_timeout=cfg.TRANSPORT_WRITE_TIMEOUT):
+        super(BufferedTransport, self).__init__(port, baudrate, timeout, write_timeout)
+        self._buffer = memoryview(bytearray(cfg.TRANSPORT_BUFFER_SIZE))
+
+    @abstractmethod
+    def fileno(self):
+        pass
+
+    @abstractmethod
+    def _readinto(self, view):
+        """
+        Read the available bytes in ``view``.
+
+        :return: The amount of bytes read, None if there's no bytes or 0 if
+            the other end closed.
+        """
+
+    @abstractmethod
+    def _send(self, view):
+        """
+        :return: The amount of bytes written or None if the transport is
+            busy.
+        """
+
+    def read(self, n=1):
+        if n > len(self._buffer):
+            self._buffer = memoryview(bytearray(n))
+        view = self._buffer
+        read = 0
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while read < n and self.isOpen():
+            count = self._readinto(view[read:n])
+            if count == 0:
+                break
+            if count:
+                read += count
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            select.select([self.fileno()], [], [], remaining)
+        return bytes(view[:read])
+
+    def write(self, data):
+        if not self.isOpen():
+            raise serial.SerialException('El puerto no esta abierto.')
+        view = memoryview(data)
+        written = 0
+        deadline = None if self.write_timeout is None else time.monotonic() + self.write_timeout
+        while written < len(view):
+            count = self._send(view[written:])
+            if count is not None:
+                written += count
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                logger.error("No se pudo escribir en {0}: {1} de {2} bytes.".format(
+                    self.port, written, len(view)))
+                raise WriteException
+            select.select([], [self.fileno()], [], remaining)
+        return written
+
+    def flushInput(self):
+        while self.isOpen() and self._readinto(self._buffer):
+            pass
+
+
+class FdTransport(BufferedTransport):
+    """
+    Serial port configured with termios in raw mode (8N1, without flow
+    control) and read in non-blocking mode.
+    """
+
+    def __init__(self, port, baudrate=cfg.DEFAULT_BAUDRATE,
+                 timeout=cfg.DEFAULT_SERIAL_TIMEOUT,
+                 write_timeout=cfg.TRANSPORT_WRITE_TIMEOUT):
+        super(FdTransport, self).__init__(port, baudrate, timeout, write_timeout)
+        self._fd = None
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self._baudrate = baudrate
+        if self._fd is not None:
+            self._configure()
+
+    def _configure(self):
+        speed = getattr(termios, 'B{}'.format(self._baudrate), None)
+        if speed is None:
+            raise ValueError('Velocidad no soportada: {}'.format(self._baudrate))
+        try:
+            attributes = termios.tcgetattr(self._fd)
+            attributes[0] = termios.IGNPAR
+            attributes[1] = 0
+            attributes[2] = termios.CS8 | termios.CREAD | termios.CLOCAL
+            attributes[3] = 0
+            attributes[4] = attributes[5] = speed
+            attributes[6][termios.VMIN] = 0
+            attributes[6][termios.VTIME] = 0
+            termios.tcsetattr(self._fd, termios.TCSANOW, attributes)
+        except termios.error as error:
+            raise OSError(*error.args)
+
+    def open(self):
+        self._fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            self._configure()
+            termios.tcflush(self._fd, termios.TCIOFLUSH)
+        except (OSError, termios.error) as error:
+            self.close()
+            raise OSError(*error.args)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def isOpen(self):
+        return self._fd is not None
+
+    def fileno(self):
+        return self._fd
+
+    def _readinto(self, view):
+        # Con VMIN = 0 la tty devuelve 0 bytes cuando no hay datos.
+        try:
+            return os.readv(self._fd, [view]) or None
+        except BlockingIOError:
+            return None
+
+    def _send(self, view):
+        try:
+            return os.write(self._fd, view)
+        except BlockingIOError:
+            return None
+
+    def flushInput(self):
+        if self._fd is not None:
+            termios.tcflush(self._fd, termios.TCIFLUSH)
+
+
+class TcpTransport(BufferedTransport):
+    """
+    Socket to a terminal server that forwards the bytes to the serial port
+    without any protocol (raw TCP). The ``baudrate`` is configured in the
+    server. For servers with RFC 2217 use a :class:`SerialTransport` with the
+    URL ``rfc2217://host:port``.
+    """
+
+    def __init__(self, port, baudrate=cfg.DEFAULT_BAUDRATE,
+                 timeout=cfg.DEFAULT_SERIAL_TIMEOUT,
+                 write_timeout=cfg.TRANSPORT_WRITE_TIMEOUT):
+        """
+        :param port: ``tcp://host:port`` or ``host:port``.
+        """
+        super(TcpTransport, self).__init__(port, baudrate, timeout, write_timeout)
+        address = port[len('tcp://'):] if port.startswith('tcp://') else port
+        host, tcp_port = address.rsplit(':', 1)
+        self.address = (host, int(tcp_port))
+        self._socket = None
+
+    def open(self):
+        self._socket = socket.create_connection(self.address, timeout=cfg.TCP_CONNECT_TIMEOUT)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.setblocking(False)
+        logger.info("Conectado a {0}:{1}.".format(*self.address))
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def isOpen(self):
+        return self._socket is not None
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def _readinto(self, view):
+        try:
+            count = self._socket.recv_into(view)
+        except BlockingIOError:
+            return None
+        except OSError as error:
+            count = 0
+            logger.error("Error en la conexion con {0}:{1}: {2}".format(
+                self.address[0], self.address[1], error))
+        if not count:
+            # El servidor cerro la conexion. El hilo de conexion de
+            # SerialInterface se encarga de reconectar.
+            self.close()
+        return count
+
+    def _send(self, view):
+        try:
+            return self._socket.send(view)
+        except BlockingIOError:
+            return None
+
+
+def transport_for(port, baudrate=cfg.DEFAULT_BAUDRATE, timeout=cfg.DEFAULT_SERIAL_TIMEOUT,
+                  write_timeout=cfg.TRANSPORT_WRITE_TIMEOUT):
+    """
+    :param port: The path or URL of the port. See :mod:`transports`.
+    :return: The transport for ``port``, closed.
+    :rtype: :class:`Transport`
+    """
+    if port.startswith('tcp://'):
+        return TcpTransport(port, baudrate, timeout, write_timeout)
+    if port.startswith('fd://'):
+        return FdTransport(port[len('fd://'):], baudrate, timeout, write_timeout)
+    return SerialTransport(port, baudrate, timeout, write_timeout)
@@ -59,3 +59,13 @@ class GiveMasterEvent(MasterEvent):
     def clear(self, *args, **kwargs):
         self.node = None
         super(GiveMasterEvent, self).clear(*args, **kwargs)
+
+
+def wire_time(length, baudrate):
+    """
+    :param length: Amount of bytes.
+    :param baudrate: Speed of the port in bits per second.
+    :return: Seconds that ``length`` bytes take in the line (start, 8 data
+        bits and stop for each byte).
+    """
+    return length * cfg.BITS_PER_BYTE / baudrate
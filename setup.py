@@ -9,4 +9,5 @@ setup(
     packages=['ClaptonBase',],
     test_suite='tests',
     install_requires=['pyserial', 'bitarray'],
+    extras_require={'analysis': ['numpy'], 'gateway': ['pyzmq']},
 )
@@ -1,6 +1,7 @@
 from .fixtures import (mocked_serial, node, ser_answer_all,
                        ser_raises_read_exception, ser_raises_write_exception,
-                       virtual_node, mock_read, memo_instance)
+                       virtual_node, mock_read, memo_instance,
+                       simulated_serial, bus_frames)
 
 
 def pytest_addoption(parser):
@@ -1,10 +1,12 @@
 import os
+import random
 import mock
 import serial
 import pytest
 from ClaptonBase.cfg import READ_FUNCTIONS, WRITE_FUNCTIONS
 from ClaptonBase.containers import Node, Package, MemoryContainer
 from ClaptonBase.exceptions import ReadException, WriteException
+from ClaptonBase.mock_serial import SimulatedPort, VirtualNode
 from ClaptonBase.serial_interface import SerialInterface
 
 @pytest.fixture
@@ -114,3 +116,31 @@ def node():
 @pytest.fixture
 def virtual_node():
     return Node(1, ser=ser_answer_all())
+
+
+@pytest.fixture
+def simulated_serial():
+    ser = SerialInterface()
+    ser._ser = SimulatedPort([VirtualNode(1), VirtualNode(2)])
+    ser.im_master = True
+    return ser
+
+
+@pytest.fixture
+def bus_frames():
+    """
+    500 valid frames of random nodes and functions, always the same.
+    """
+    generator = random.Random(0)
+    lengths = {0: (0,), 1: (2,), 2: range(2, 9), 3: (2,), 4: range(2, 9),
+               5: (3,), 6: range(2, 9), 7: (0,)}
+    frames = list()
+    for i in range(500):
+        function = generator.randrange(8)
+        data = bytes(generator.randrange(256)
+                     for i in range(generator.choice(lengths[function])))
+        frames.append(Package(sender=generator.randrange(1, 4),
+                              destination=generator.randrange(1, 4),
+                              function=function,
+                              data=data).bytes_chain)
+    return frames
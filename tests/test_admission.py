@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+from ClaptonBase.admission import AdmissionController
+from ClaptonBase.cfg import PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_POLLING
+from ClaptonBase.containers import Node, Package
+from ClaptonBase.exceptions import OverloadException
+
+
+def read_package(length=1):
+    return Package(destination=1, function=1, data=bytes([0, length]))
+
+
+class TestAdmissionController(object):
+
+    def test_estimate_grows_with_the_answer(self):
+        controller = AdmissionController(baudrate=2400)
+        short = controller.estimate(read_package(1))
+        long = controller.estimate(read_package(20))
+        # 19 bytes mas de respuesta a 10 bits por byte.
+        assert long - short == pytest.approx(19 * 10 / 2400.)
+        assert AdmissionController(baudrate=9600).estimate(read_package(20)) < long
+        assert controller.capacity > 0
+
+    def test_priority_is_served_first(self):
+        controller = AdmissionController(max_wait=(None, None, None))
+        order = list()
+
+        def request(priority):
+            with controller.admit(read_package(), priority):
+                order.append(priority)
+
+        with controller.admit(read_package()):
+            threads = [threading.Thread(target=request, args=(priority,))
+                       for priority in (PRIORITY_POLLING, PRIORITY_NORMAL, PRIORITY_INTERACTIVE)]
+            for thread in threads:
+                thread.start()
+                # Cada pedido entra a la cola antes que el siguiente.
+                while sum(item['depth'] for item in controller.report()['priorities']) < \
+                        threads.index(thread) + 1:
+                    time.sleep(.001)
+        for thread in threads:
+            thread.join(timeout=2)
+        assert order == [PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_POLLING]
+
+    def test_full_queue_rejects(self):
+        controller = AdmissionController(limits=(1, 1, 0), max_wait=(None, None, None))
+        with pytest.raises(OverloadException):
+            with controller.admit(read_package(), PRIORITY_POLLING):
+                pass
+        assert controller.report()['priorities'][PRIORITY_POLLING]['rejected'] == 1
+
+    def test_poll_over_max_wait_is_rejected(self):
+        controller = AdmissionController(baudrate=2400, max_wait=(None, None, .01))
+        # Una lectura de 31 bytes tarda mas que la espera maxima.
+        with controller.admit(read_package(31)):
+            with pytest.raises(OverloadException):
+                with controller.admit(read_package(), PRIORITY_POLLING):
+                    pass
+        with controller.admit(read_package(), PRIORITY_POLLING):
+            pass
+        report = controller.report()['priorities'][PRIORITY_POLLING]
+        assert (report['rejected'], report['admitted']) == (1, 1)
+
+    def test_stale_poll_is_shed(self):
+        controller = AdmissionController(baudrate=115200, max_wait=(None, None, .05))
+        errors = list()
+
+        def poll():
+            try:
+                with controller.admit(read_package(), PRIORITY_POLLING):
+                    pass
+            except OverloadException as error:
+                errors.append(error)
+
+        with controller.admit(read_package()):
+            thread = threading.Thread(target=poll)
+            thread.start()
+            thread.join(timeout=2)
+        assert len(errors) == 1
+        report = controller.report()['priorities'][PRIORITY_POLLING]
+        assert (report['shed'], report['depth']) == (1, 0)
+
+    def test_thread_priority(self):
+        controller = AdmissionController(limits=(1, 1, 0))
+        with controller.priority(PRIORITY_POLLING):
+            with pytest.raises(OverloadException):
+                with controller.admit(read_package()):
+                    pass
+        with controller.admit(read_package()):
+            pass
+
+
+class TestSerialAdmission(object):
+
+    def test_send_package_is_admitted(self, simulated_serial):
+        simulated_serial.admission = AdmissionController()
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        with simulated_serial.admission.priority(PRIORITY_INTERACTIVE):
+            node.read_ram(0, 2)
+        report = simulated_serial.admission.report()
+        assert report['priorities'][PRIORITY_INTERACTIVE]['admitted'] == 1
+        assert report['priorities'][PRIORITY_NORMAL]['admitted'] >= 1
+        assert report['utilization'] > 0
+
+    def test_send_packages_is_admitted_once(self, simulated_serial):
+        controller = AdmissionController()
+        simulated_serial.admission = controller
+        packages = [Package(destination=1, function=0), Package(destination=2, function=0)]
+        assert controller.estimate(packages) == pytest.approx(
+            sum(controller.estimate(package) for package in packages))
+        answers = simulated_serial.send_packages(iter(packages), priority=PRIORITY_POLLING)
+        assert [answer.sender for answer in answers] == [1, 2]
+        report = controller.report()
+        assert report['priorities'][PRIORITY_POLLING]['admitted'] == 1
+        assert report['priorities'][PRIORITY_NORMAL]['admitted'] == 0
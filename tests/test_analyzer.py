@@ -0,0 +1,76 @@
+import csv
+import random
+
+import pytest
+from ClaptonBase.analyzer import CaptureAnalyzer
+from ClaptonBase.capture import RX, TX, CaptureReader, CaptureWriter
+
+
+def write_capture(path, frames, garbage=b'', sessions=1, seed=0):
+    """
+    Write ``frames`` in ``sessions`` sessions, with the bytes of the bus split
+    in records of random size and ``garbage`` before the frame 10.
+    """
+    generator = random.Random(seed)
+    per_session = -(-len(frames) // sessions)
+    for session in range(sessions):
+        writer = CaptureWriter(path)
+        stream = b''
+        for index in range(session * per_session, min((session + 1) * per_session, len(frames))):
+            if index == 10:
+                stream += garbage
+            stream += frames[index]
+        writer.record(TX, frames[0])
+        while stream:
+            size = generator.randrange(1, 12)
+            writer.record(RX, stream[:size])
+            stream = stream[size:]
+        writer.close()
+
+
+class TestCaptureAnalyzer(object):
+
+    def test_statistics(self, tmpdir, bus_frames):
+        path = str(tmpdir.join('bus.cap'))
+        frames = bus_frames[:200]
+        write_capture(path, frames, garbage=b'\x00\x05')
+        stats = CaptureAnalyzer(path, workers=1).run()
+        assert stats['frames'] == 200
+        assert stats['bytes'] == sum(len(frame) for frame in frames) + 2
+        assert stats['error_bytes'] == 2
+        assert sum(node['sent'] for node in stats['nodes'].values()) == 200
+        assert sum(stats['functions'].values()) == 200
+        assert sum(count for limit, count in stats['gaps']) == 199
+        assert stats['start'] <= stats['end']
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_chunks_give_same_result(self, tmpdir, bus_frames, workers):
+        path = str(tmpdir.join('bus.cap'))
+        write_capture(path, bus_frames, garbage=b'\x00\x05\x07', sessions=3)
+        whole = CaptureAnalyzer(path, workers=1).run()
+        analyzer = CaptureAnalyzer(path, workers=workers, chunk_size=256)
+        assert len(analyzer.chunks()) > 10
+        assert analyzer.run() == whole
+
+    def test_chunks_start_at_records(self, tmpdir, bus_frames):
+        path = str(tmpdir.join('bus.cap'))
+        write_capture(path, bus_frames[:100], sessions=2)
+        reader = CaptureReader(path)
+        offsets = [offset for offset, timestamp, direction, data in reader.records(raw=True)]
+        bounds = reader.chunks(7)
+        reader.close()
+        assert set(bounds[:-1]) <= set(offsets)
+
+    def test_export_frames(self, tmpdir, bus_frames):
+        path = str(tmpdir.join('bus.cap'))
+        frames = bus_frames[:150]
+        write_capture(path, frames, sessions=2)
+        table = str(tmpdir.join('frames.csv'))
+        analyzer = CaptureAnalyzer(path, workers=2, chunk_size=200)
+        analyzer.export_frames(table)
+        with open(table) as table_file:
+            rows = list(csv.DictReader(table_file))
+        assert len(rows) == 150
+        assert [bytes.fromhex(row['data']) for row in rows] == [frame[2:-1] for frame in frames]
+        times = [float(row['timestamp']) for row in rows]
+        assert times == sorted(times)
@@ -0,0 +1,268 @@
+import binascii
+import os
+
+import pytest
+from ClaptonBase import apps, decode, encode
+from ClaptonBase.apps import AppFlasher, FlashJournal, HexImage, E2_START
+from ClaptonBase.containers import Node
+from ClaptonBase.exceptions import (BadLineException, ReadException,
+                                    WriteException)
+
+
+def make_record(address, data, record_type=0):
+    raw = bytes([len(data), address >> 8, address & 0xff, record_type]) + data
+    return ':{}'.format(binascii.hexlify(raw + encode.make_checksum(raw)).decode().upper())
+
+
+def make_hex(chunks):
+    lines = [make_record(address, data) for address, data in chunks]
+    lines.append(':00000001FF')
+    return '\n'.join(lines).encode()
+
+
+PROGRAM = make_hex([
+    (0, b'\xa5\x05' + bytes(range(2, 16))),
+    (16, bytes(range(16, 32))),
+    (200, b'\x01\x02\x03\x04'),
+    (E2_START, b'\x11\x00\x22\x00\x33\x00'),
+])
+
+
+class TestHexImage(object):
+
+    def test_from_bytes(self):
+        image = HexImage.from_bytes(PROGRAM)
+        assert image.data[16:32] == bytes(range(16, 32))
+        assert image.data[204:206] == b'\xff\x3f'
+        assert image.units() == [0, 1, 2, 3, 25, E2_START // 8]
+
+    def test_extended_linear_address(self):
+        content = b'\n'.join([make_record(0, b'\x00\x00', 4).encode(),
+                              make_record(16, b'\x01\x02').encode()])
+        assert HexImage.from_bytes(content).data[16:18] == b'\x01\x02'
+
+    @pytest.mark.parametrize("content", [
+        b':10000000',
+        b'10000000A5',
+        b':0400000001020304F1',
+        b':02000000ZZZZ00',
+    ])
+    def test_from_bytes_raises_bad_line(self, content):
+        with pytest.raises(BadLineException):
+            HexImage.from_bytes(content)
+
+    def test_changed_units(self):
+        image = HexImage.from_bytes(PROGRAM)
+        previous = HexImage.from_bytes(PROGRAM)
+        previous.write(20, b'\x00')
+        assert image.changed_units(previous) == [2]
+
+
+class TestAppFlasher(object):
+
+    def test_frames_merge_units(self, simulated_serial):
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        flasher = AppFlasher(node, HexImage.from_bytes(PROGRAM))
+        assert flasher.frames([0, 1, 2, 3, 25]) == [
+            ('PROGRAM', 0, 3), ('PROGRAM', 3, 1), ('PROGRAM', 25, 1)]
+
+    def test_flash_writes_image(self, simulated_serial):
+        virtual = simulated_serial._ser.nodes[1]
+        image = HexImage.from_bytes(PROGRAM)
+        report = AppFlasher(Node(1, ser=simulated_serial), image).flash()
+        assert virtual.app[:32] == image.data[:32]
+        assert virtual.app[200:204] == b'\x01\x02\x03\x04'
+        assert virtual.eeprom[:3] == b'\x11\x22\x33'
+        assert virtual.app_active
+        assert report['written'] == report['units']
+
+    def test_reflash_only_writes_changes(self, simulated_serial):
+        port = simulated_serial._ser
+        image = HexImage.from_bytes(PROGRAM)
+        AppFlasher(Node(1, ser=simulated_serial), image).flash()
+        patched = HexImage.from_bytes(PROGRAM)
+        patched.write(18, b'\xaa\xbb')
+        del port.written[:]
+        report = AppFlasher(Node(1, ser=simulated_serial), patched).flash()
+        writes = [f for f in port.written if decode.function_length(f[1:2])[0] == 6]
+        assert report['written'] == 1
+        # Deactivate, one frame and activate.
+        assert len(writes) == 3
+        assert port.nodes[1].app[18:20] == b'\xaa\xbb'
+
+    def test_flash_with_previous_doesnt_read(self, simulated_serial):
+        port = simulated_serial._ser
+        image = HexImage.from_bytes(PROGRAM)
+        patched = HexImage.from_bytes(PROGRAM)
+        patched.write(200, b'\x00\x00')
+        report = AppFlasher(Node(1, ser=simulated_serial), patched).flash(previous=image)
+        reads = [f for f in port.written if decode.function_length(f[1:2])[0] == 5]
+        assert not reads
+        assert report['written'] == 1
+
+    def test_flash_unchanged_keeps_app_active(self, simulated_serial):
+        image = HexImage.from_bytes(PROGRAM)
+        AppFlasher(Node(1, ser=simulated_serial), image).flash()
+        report = AppFlasher(Node(1, ser=simulated_serial), image).flash()
+        assert report['frames'] == 0
+
+    def test_flash_unchanged_reactivates_app(self, simulated_serial):
+        virtual = simulated_serial._ser.nodes[1]
+        image = HexImage.from_bytes(PROGRAM)
+        AppFlasher(Node(1, ser=simulated_serial), image).flash()
+        # Un flash interrumpido despues de escribir todo.
+        virtual.app_active = False
+        report = AppFlasher(Node(1, ser=simulated_serial), image).flash()
+        assert report['frames'] == 0
+        assert virtual.app_active
+
+    def test_unconfirmed_keeps_app_inactive(self, simulated_serial):
+        virtual = simulated_serial._ser.nodes[1]
+        flasher = AppFlasher(Node(1, ser=simulated_serial), HexImage.from_bytes(PROGRAM))
+        write_frame = flasher.write_frame
+
+        def fail_first(frame):
+            if frame[1] == 0:
+                raise WriteException
+            return write_frame(frame)
+
+        flasher.write_frame = fail_first
+        report = flasher.flash(verify=False)
+        assert report['unconfirmed']
+        assert not virtual.app_active
+
+
+class TestFlashJournal(object):
+
+    def test_confirm_is_saved(self, tmpdir):
+        path = str(tmpdir.join('flash.journal'))
+        journal = FlashJournal(path, 100)
+        journal.confirm([0, 9, 99])
+        journal.close()
+        reopened = FlashJournal(path, 100)
+        assert 9 in reopened and 99 in reopened and 10 not in reopened
+        assert len(reopened) == 3
+
+    def test_size_mismatch_starts_empty(self, tmpdir):
+        path = str(tmpdir.join('flash.journal'))
+        journal = FlashJournal(path, 100)
+        journal.confirm([1])
+        journal.close()
+        assert len(FlashJournal(path, 300)) == 0
+
+    def test_for_flash_key(self, tmpdir):
+        image = HexImage.from_bytes(PROGRAM)
+        journal = FlashJournal.for_flash(image, 1, '/dev/ttyUSB0', str(tmpdir))
+        other = FlashJournal.for_flash(image, 2, '/dev/ttyUSB0', str(tmpdir))
+        assert journal.path != other.path
+
+    def test_resume_after_lost_link(self, simulated_serial, tmpdir):
+        port = simulated_serial._ser
+        virtual = port.nodes[1]
+        image = HexImage.from_bytes(make_hex(
+            [(address, bytes([address & 0xff]) * 16) for address in range(16, 496, 16)]))
+        write_app = virtual._write_app
+        written = []
+
+        def drop_link(data):
+            written.append(data)
+            if len(written) == 4:
+                port.connected = False
+            return write_app(data)
+
+        virtual._write_app = drop_link
+        journal = FlashJournal.for_flash(image, 1, 'simulated', str(tmpdir))
+        with pytest.raises(ReadException):
+            AppFlasher(Node(1, ser=simulated_serial), image).flash(journal=journal)
+        confirmed = len(FlashJournal.for_flash(image, 1, 'simulated', str(tmpdir)))
+        assert confirmed
+
+        port.connected = True
+        virtual._write_app = write_app
+        journal = FlashJournal.for_flash(image, 1, 'simulated', str(tmpdir))
+        report = AppFlasher(Node(1, ser=simulated_serial), image).flash(journal=journal)
+        assert report['resumed'] == confirmed
+        assert virtual.app[16:496] == image.data[16:496]
+        assert not os.path.exists(journal.path)
+
+    def test_verify_fixes_unconfirmed(self, simulated_serial):
+        virtual = simulated_serial._ser.nodes[1]
+        image = HexImage.from_bytes(PROGRAM)
+        flasher = AppFlasher(Node(1, ser=simulated_serial), image)
+        flasher.node.identify()
+        virtual.app_active = False
+        assert flasher.verify([1, 2]) == [1, 2]
+        assert virtual.app[8:24] == image.data[8:24]
+        assert flasher.verify([1, 2]) == []
+
+
+class TestAppReadback(object):
+
+    def test_to_hex_roundtrip(self):
+        image = HexImage.from_bytes(PROGRAM)
+        text = image.to_hex()
+        assert text.endswith(':00000001FF\n')
+        again = HexImage.from_bytes(text.encode())
+        assert again.data == image.data and again.mask == image.mask
+
+    def test_to_hex_extended_address(self):
+        image = HexImage()
+        image.write(0x10010, b'\x01\x02')
+        text = image.to_hex()
+        assert ':020000040001F9' in text
+        assert HexImage.from_bytes(text.encode()).data[0x10010:0x10012] == b'\x01\x02'
+
+    def test_read_app_image(self, simulated_serial):
+        port = simulated_serial._ser
+        virtual = port.nodes[1]
+        virtual.app[:200] = bytes(range(200))
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        calls = []
+        data = node.read_app_image(end=100, progress=lambda done, total: calls.append((done, total)),
+                                   batch=2)
+        assert data == bytes(range(200))
+        assert calls[-1] == (200, 200)
+        reads = [f for f in port.written if decode.function_length(f[1:2])[0] == 5]
+        assert len(reads) == 7
+
+
+class TestHexImageCache(object):
+
+    def test_load_is_shared(self, tmpdir):
+        path = tmpdir.join('program.hex')
+        path.write_binary(PROGRAM)
+        image = HexImage.load(str(path))
+        assert HexImage.load(str(path)) is image
+        assert image.data == HexImage.from_bytes(PROGRAM).data
+
+    def test_load_from_sidecar(self, tmpdir, monkeypatch):
+        path = tmpdir.join('sidecar.hex')
+        content = make_hex([(32, b'\x10\x20\x30\x40'), (E2_START, b'\x05\x00')])
+        path.write_binary(content)
+        image = HexImage.load(str(path), cache_dir=str(tmpdir))
+        assert tmpdir.join('sidecar.hex.clpcache').check()
+        apps._images.clear()
+
+        def fail(*args, **kwargs):
+            raise AssertionError('The HEX file should not be parsed again')
+        monkeypatch.setattr(HexImage, 'from_bytes', fail)
+        cached = HexImage.load(str(path), cache_dir=str(tmpdir))
+        assert cached is not image
+        assert cached.data == image.data and cached.mask == image.mask
+        assert cached.units() == image.units()
+        assert cached.digest() == image.digest()
+
+    def test_sidecar_of_other_content_is_ignored(self, tmpdir):
+        path = tmpdir.join('changed.hex')
+        path.write_binary(PROGRAM)
+        HexImage.load(str(path))
+        path.write_binary(make_hex([(0, b'\x01\x02')]))
+        assert HexImage.load(str(path)).data[:2] == b'\x01\x02'
+
+    def test_frame_data(self):
+        image = HexImage.from_bytes(PROGRAM)
+        assert image.frame_data(('PROGRAM', 2, 1)) == (8, bytes(range(16, 24)))
+        assert image.frame_data(('E2', E2_START // 8, 1)) == (0, b'\x11\x22\x33\xff')
+        assert image.frame_data(('PROGRAM', 2, 1)) is image.frame_data(('PROGRAM', 2, 1))
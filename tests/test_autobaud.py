@@ -0,0 +1,84 @@
+import pytest
+from ClaptonBase import cfg
+from ClaptonBase.autobaud import count_frames, port_timeout
+from ClaptonBase.containers import Package
+from ClaptonBase.mock_serial import SimulatedPort, VirtualNode
+from ClaptonBase.serial_interface import SerialInterface
+
+TRAFFIC = b''.join(Package(sender=1, destination=2, function=3, data=bytes([index, 4])).bytes_chain
+                   for index in range(4))
+
+
+class BusyPort(SimulatedPort):
+    """
+    Bus with a master that never stops talking.
+    """
+
+    def read(self, n=1):
+        if not self.rx:
+            self.rx.extend(TRAFFIC)
+        return super(BusyPort, self).read(n)
+
+
+def interface(port, baudrate=2400):
+    port.baudrate = baudrate
+    return SerialInterface(transport=port, baudrate=baudrate)
+
+
+class TestCountFrames(object):
+
+    def test_valid_frames(self):
+        assert count_frames(TRAFFIC) == (4, len(TRAFFIC))
+        assert count_frames(b'\x00' + TRAFFIC[:-1]) == (3, len(TRAFFIC) - 5)
+
+    def test_garbage(self):
+        frames, framed = count_frames(bytes(byte ^ 0xa5 for byte in TRAFFIC * 4))
+        assert framed < cfg.CALIBRATION_MIN_COVERAGE * len(TRAFFIC) * 4
+
+
+class TestCalibrate(object):
+
+    def test_listen(self):
+        port = BusyPort([VirtualNode(1)], line_baudrate=9600)
+        ser = interface(port)
+        result = ser.calibrate(period=.02)
+        assert (result['baudrate'], result['method']) == (9600, 'listen')
+        assert result['frames'] >= cfg.CALIBRATION_MIN_FRAMES
+        assert port.baudrate == 9600
+        assert port.timeout == pytest.approx(port_timeout(9600))
+        # Con otro master en el bus no se escribe nada.
+        assert not port.written
+
+    def test_probe_silent_bus(self):
+        port = SimulatedPort([VirtualNode(3)], line_baudrate=9600)
+        ser = interface(port)
+        result = ser.calibrate(period=.02)
+        assert (result['baudrate'], result['method']) == (9600, 'probe')
+        assert result['turnaround'] >= 0
+        assert ser.calibration is result
+        assert ser._timeout == port.timeout == pytest.approx(
+            port_timeout(9600, result['turnaround']))
+        ser.im_master = True
+        assert ser.send_package(Package(destination=3, function=0)).sender == 3
+
+    def test_fastest_that_works(self):
+        port = SimulatedPort([VirtualNode(1)], line_baudrate=2400)
+        ser = interface(port, baudrate=9600)
+        assert ser.calibrate(period=.02)['baudrate'] == 2400
+        assert port_timeout(2400) > port_timeout(9600)
+
+    def test_no_rate(self):
+        port = SimulatedPort([VirtualNode(1)], line_baudrate=4800)
+        port.timeout = .25
+        ser = interface(port)
+        assert ser.calibrate(lan_dirs=[1, 2], period=.02) is None
+        assert (port.baudrate, port.timeout) == (2400, .25)
+
+    def test_on_connect(self, monkeypatch):
+        monkeypatch.setattr(cfg, 'WAIT_MASTER_PERIOD', .02)
+        port = SimulatedPort([VirtualNode(1)], line_baudrate=9600)
+        ser = interface(port)
+        ser.autobaud = True
+        assert ser._do_connect()
+        assert ser.calibration['baudrate'] == 9600
+        assert ser.im_master
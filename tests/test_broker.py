@@ -0,0 +1,158 @@
+import os
+import socket
+import stat
+import time
+
+import pytest
+from ClaptonBase.broker import Broker, BrokerClient
+from ClaptonBase.containers import Package
+from ClaptonBase.exceptions import BrokerException
+
+
+@pytest.fixture
+def broker(simulated_serial, tmpdir):
+    broker = Broker(simulated_serial, path=str(tmpdir.join('broker.sock'))).start()
+    yield broker
+    broker.stop()
+
+
+def wait_until(condition, timeout=2):
+    limit = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > limit:
+            raise AssertionError('timeout')
+        time.sleep(.005)
+
+
+class TestBroker(object):
+
+    def test_client_operations(self, broker):
+        broker.ser._ser.nodes[1].ram[:4] = b'\x01\x02\x03\x04'
+        client = BrokerClient(broker.path, timeout=2)
+        assert client.read(1, 'RAM', 1, 2).data == b'\x02\x03'
+        client.write(2, 'EEPROM', 0, b'\x0a\x0b')
+        assert broker.ser._ser.nodes[2].eeprom[:2] == b'\x0a\x0b'
+        answer = client.send_package(Package(destination=2, function=3, data=b'\x00\x02'))
+        assert answer.data == b'\x0a\x0b'
+        client.close()
+
+    def test_error_is_sent_to_the_client(self, broker):
+        client = BrokerClient(broker.path, timeout=2)
+        with pytest.raises(BrokerException) as error:
+            client.read(7, 'RAM', 0, 1)
+        assert error.value.error['type'] == 'WriteException'
+        client.close()
+
+    def test_equal_reads_are_sent_once(self, broker):
+        results = list()
+        with broker.ser.using_ser:
+            # El primero lo toma el hilo del bus y queda esperando el puerto.
+            broker._submit_read({'lan_dir': 1, 'instance': 'RAM', 'start': 0, 'length': 2},
+                                lambda result, error: results.append(result), 5)
+            wait_until(lambda: not broker._queue)
+            for i in range(5):
+                broker._submit_read({'lan_dir': 1, 'instance': 'RAM', 'start': 0, 'length': 2},
+                                    lambda result, error: results.append(result), 5)
+        wait_until(lambda: len(results) == 6)
+        assert len(broker.ser._ser.written) == 2
+
+    def test_priority(self, broker):
+        with broker.ser.using_ser:
+            broker.submit(None, Package(destination=1, function=0), lambda *args: None,
+                          lambda *args: None)
+            wait_until(lambda: not broker._queue)
+            for lan_dir, priority in ((1, 9), (2, 1)):
+                broker.submit(None, Package(destination=lan_dir, function=0), lambda *args: None,
+                              lambda *args: None, priority)
+        wait_until(lambda: len(broker.ser._ser.written) == 3)
+        assert [frame[0] & 0x0f for frame in broker.ser._ser.written] == [1, 2, 1]
+
+    def test_subscription(self, broker):
+        client = BrokerClient(broker.path, timeout=2)
+        readings = list()
+        number = client.subscribe(2, 'RAM', 0, 2, .05, readings.append)
+        wait_until(lambda: len(readings) >= 3)
+        client.unsubscribe(number)
+        count = len(readings)
+        time.sleep(.1)
+        assert len(readings) <= count + 1
+        assert all(memory.node == 2 and memory.length == 2 for memory in readings)
+        client.close()
+
+    def test_subscription_limits(self, broker):
+        broker.max_subscriptions = 2
+        client = BrokerClient(broker.path, timeout=2)
+        with pytest.raises(BrokerException) as error:
+            client.subscribe(2, 'RAM', 0, 2, broker.min_period / 2, lambda memory: None)
+        assert error.value.error['type'] == 'ValueError'
+        for _ in range(2):
+            client.subscribe(2, 'RAM', 0, 2, 10, lambda memory: None)
+        with pytest.raises(BrokerException):
+            client.subscribe(2, 'RAM', 0, 2, 10, lambda memory: None)
+        client.close()
+
+    def test_socket_mode(self, broker):
+        assert stat.S_IMODE(os.stat(broker.path).st_mode) == broker.mode
+
+    def test_running_broker_is_kept(self, broker):
+        with pytest.raises(BrokerException):
+            Broker(broker.ser, path=broker.path).start()
+        assert stat.S_ISSOCK(os.stat(broker.path).st_mode)
+
+    def test_stale_socket_is_replaced(self, simulated_serial, tmpdir):
+        path = str(tmpdir.join('broker.sock'))
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        broker = Broker(simulated_serial, path=path).start()
+        client = BrokerClient(path, timeout=2)
+        assert client.send_package(Package(destination=1, function=0)).sender == 1
+        client.close()
+        broker.stop()
+
+    def test_path_is_not_a_socket(self, simulated_serial, tmpdir):
+        path = tmpdir.join('broker.sock')
+        path.write('data')
+        with pytest.raises(BrokerException):
+            Broker(simulated_serial, path=str(path)).start()
+        assert path.read() == 'data'
+
+    def test_wrong_subscription_is_rejected(self, broker):
+        client = BrokerClient(broker.path, timeout=2)
+        for lan_dir, instance, start, length in ((2, 'FOO', 0, 2), (2, 'RAM', 300, 2),
+                                                 (99, 'RAM', 0, 2)):
+            with pytest.raises(BrokerException):
+                client.subscribe(lan_dir, instance, start, length, 1, lambda memory: None)
+        assert not broker._subscriptions
+        readings = list()
+        client.subscribe(2, 'RAM', 0, 2, .05, readings.append)
+        wait_until(lambda: len(readings) >= 2)
+        client.close()
+
+    def test_failed_subscription_is_dropped(self, broker):
+        client = BrokerClient(broker.path, timeout=2)
+        good, bad = list(), list()
+        client.subscribe(2, 'RAM', 0, 2, .05, good.append)
+        number = client.subscribe(1, 'RAM', 0, 2, .05, bad.append)
+        submit = broker.submit
+
+        def failing(key, *args, **kwargs):
+            if key[1] == 1:
+                raise RuntimeError('broken')
+            return submit(key, *args, **kwargs)
+
+        broker.submit = failing
+        wait_until(lambda: bad and number not in broker._subscriptions)
+        assert isinstance(bad[-1], BrokerException)
+        count = len(good)
+        wait_until(lambda: len(good) > count + 1)
+        client.close()
+
+    @pytest.mark.parametrize("priority", [-1, 100, 'high'])
+    def test_wrong_priority(self, broker, priority):
+        client = BrokerClient(broker.path, timeout=2)
+        with pytest.raises(BrokerException) as error:
+            client.read(1, 'RAM', 0, 1, priority=priority)
+        assert error.value.error['type'] == 'ValueError'
+        assert not broker._queue
+        client.close()
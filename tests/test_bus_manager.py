@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from ClaptonBase.apps import HexImage
+from ClaptonBase.bus_manager import BusManager
+from ClaptonBase.containers import MemoryContainer
+from ClaptonBase.exceptions import WriteException
+from ClaptonBase.mock_serial import SimulatedPort, VirtualNode
+from ClaptonBase.serial_interface import SerialInterface
+
+
+def simulated_interface(lan_dirs, port):
+    ser = SerialInterface(serial_port=port)
+    ser._ser = SimulatedPort([VirtualNode(lan_dir) for lan_dir in lan_dirs], port=port)
+    ser.im_master = True
+    return ser
+
+
+@pytest.fixture
+def manager():
+    manager = BusManager({
+        'a': simulated_interface([1, 2], 'bus-a'),
+        'b': simulated_interface([3], 'bus-b'),
+    })
+    yield manager
+    for worker in manager._workers.values():
+        worker.shutdown()
+
+
+class TestBusManager(object):
+
+    def test_node_is_kept(self, manager):
+        assert manager.node(('a', 1)) is manager.node(('a', 1))
+        assert manager.node(('b', 1))._ser is manager.interfaces['b']
+
+    def test_node_is_kept_between_threads(self, manager):
+        barrier = threading.Barrier(8)
+        nodes = list()
+
+        def get_node():
+            barrier.wait()
+            nodes.append(manager.node(('a', 5)))
+
+        threads = [threading.Thread(target=get_node) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(node is nodes[0] for node in nodes)
+        assert nodes[0].health is manager.node(('a', 5)).health
+
+    def test_scan(self, manager):
+        found = manager.scan()
+        assert sorted(found) == [('a', 1), ('a', 2), ('b', 3)]
+        assert all(node.status == 1 for node in found.values())
+
+    def test_map_runs_in_the_worker_of_each_bus(self, manager):
+        results, errors = manager.map(
+            lambda node: threading.current_thread().name, [('a', 1), ('a', 2), ('b', 3)])
+        assert results[('a', 1)] == results[('a', 2)] != results[('b', 3)]
+        assert not errors
+
+    def test_read_ram_merges_results_and_errors(self, manager):
+        manager.interfaces['a']._ser.nodes[1].ram[5:7] = b'\x01\x02'
+        results, errors = manager.read_ram([('a', 1), ('b', 3), ('b', 9)], 5, 2)
+        assert results[('a', 1)].data == b'\x01\x02'
+        assert isinstance(results[('b', 3)], MemoryContainer)
+        assert isinstance(errors[('b', 9)], WriteException)
+
+    def test_poll(self, manager):
+        polls = [(('a', 2), 'EEPROM', 0, 4), (('b', 3), 'RAM', 1, 3)]
+        results, errors = manager.poll(polls)
+        assert results[polls[0]].instance == 'EEPROM'
+        assert len(results[polls[1]].data) == 3
+
+    def test_flash(self, manager, tmpdir):
+        image = HexImage()
+        image.write(16, bytes(range(32)))
+        results, errors = manager.flash([('a', 1), ('b', 3)], image, journal_dir=str(tmpdir))
+        assert not errors
+        assert manager.interfaces['b']._ser.nodes[3].app[16:48] == bytes(range(32))
+        assert results[('a', 1)]['written'] == 4
+        assert not tmpdir.listdir()
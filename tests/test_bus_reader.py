@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from ClaptonBase import cfg
+from ClaptonBase.bus_reader import BusReader, Subscription
+from ClaptonBase.containers import Package
+
+
+def traffic(port, count):
+    for index in range(count):
+        port.rx.extend(Package(sender=1, destination=2, function=3,
+                               data=bytes([index, 1])).bytes_chain)
+
+
+def wait_for(condition, timeout=2.):
+    limit = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < limit
+        time.sleep(.01)
+
+
+@pytest.fixture
+def listening(simulated_serial, monkeypatch):
+    monkeypatch.setattr(cfg, 'WAIT_MASTER_PERIOD', .05)
+    simulated_serial.im_master = False
+    return simulated_serial
+
+
+class TestListenPackages(object):
+
+    def test_port_free_between_packages(self, listening):
+        traffic(listening._ser, 3)
+        packages = listening.listen_packages()
+        for _ in range(3):
+            next(packages)
+            assert not listening.using_ser.locked()
+        packages.close()
+
+    def test_partial_read_is_not_silence(self, listening):
+        checks = list()
+        listening.check_master = lambda **kwargs: checks.append(kwargs)
+        listening._ser.rx.extend(b'\x12')
+        assert listening._next_packages() == []
+        assert not checks
+        assert listening._next_packages() == []
+        assert checks
+
+    def test_sync_after_garbage(self, listening):
+        listening._ser.rx.extend(b'\xff')
+        traffic(listening._ser, 2)
+        packages = listening.listen_packages()
+        assert [next(packages).data[0] for _ in range(2)] == [0, 1]
+        packages.close()
+
+
+class TestBusReader(object):
+
+    def test_subscriptions(self, listening):
+        traffic(listening._ser, 5)
+        reader = BusReader(listening)
+        first, second = reader.subscribe(), reader.subscribe()
+        reader.start()
+        try:
+            for subscription in (first, second):
+                packages = [subscription.get(timeout=1.) for _ in range(5)]
+                assert [package.data[0] for package in packages] == list(range(5))
+        finally:
+            reader.stop()
+        assert first.closed and list(first) == []
+
+    def test_send_when_master(self, listening):
+        traffic(listening._ser, 2)
+        reader = BusReader(listening)
+        subscription = reader.subscribe()
+        reader.start()
+        try:
+            assert subscription.get(timeout=1.) is not None
+            # Cuando el bus queda en silencio somos master y se puede enviar
+            # mientras el lector sigue vivo.
+            wait_for(lambda: listening.im_master)
+            answer = listening.send_package(Package(destination=1, function=0), deadline=1.)
+            assert answer.sender == 1
+        finally:
+            reader.stop()
+
+    def test_slow_subscriber(self, listening):
+        reader = BusReader(listening)
+        subscription = Subscription(reader, maxsize=2)
+        for index in range(5):
+            subscription._put(index)
+        assert subscription.dropped == 3
+        assert [subscription.get(0), subscription.get(0), subscription.get(0)] == [3, 4, None]
@@ -0,0 +1,107 @@
+import itertools
+import struct
+
+import pytest
+from ClaptonBase.capture import (RX, TX, CaptureReader, CaptureWriter,
+                                 ReplaySerial)
+from ClaptonBase.containers import Node, Package
+from ClaptonBase.exceptions import CaptureException
+from ClaptonBase.serial_interface import SerialInterface
+
+
+class TestCapture(object):
+
+    def test_write_and_read_records(self, tmpdir):
+        path = str(tmpdir.join('bus.cap'))
+        writer = CaptureWriter(path)
+        writer.record(TX, b'\x01\x00\xff')
+        writer.record(RX, b'')
+        writer.record(RX, b'\x01\x00\xff\x10\x00\xf0')
+        writer.close()
+        records = [(direction, bytes(data))
+                   for offset, timestamp, direction, data in CaptureReader(path).records()]
+        assert records == [(TX, b'\x01\x00\xff'), (RX, b'\x01\x00\xff\x10\x00\xf0')]
+
+    def test_append_keeps_previous_session(self, tmpdir):
+        path = str(tmpdir.join('bus.cap'))
+        for data in (b'\x01', b'\x02'):
+            writer = CaptureWriter(path)
+            writer.record(RX, data)
+            writer.close()
+        records = list(CaptureReader(path).records())
+        assert [bytes(record[3]) for record in records] == [b'\x01', b'\x02']
+        assert records[0][1] <= records[1][1]
+
+    def test_truncated_record_is_ignored(self, tmpdir):
+        path = str(tmpdir.join('bus.cap'))
+        writer = CaptureWriter(path)
+        writer.record(RX, b'\x01\x02\x03')
+        writer.close()
+        with open(path, 'r+b') as capture_file:
+            capture_file.truncate(len(open(path, 'rb').read()) - 1)
+        assert list(CaptureReader(path).records()) == []
+
+    def test_not_a_capture(self, tmpdir):
+        path = tmpdir.join('other.cap')
+        path.write_binary(b'something else')
+        with pytest.raises(CaptureException):
+            CaptureReader(str(path))
+        with pytest.raises(CaptureException):
+            CaptureWriter(str(path))
+
+    def test_serial_interface_records(self, simulated_serial, tmpdir):
+        path = str(tmpdir.join('bus.cap'))
+        simulated_serial.start_capture(path)
+        node = Node(1, ser=simulated_serial)
+        node.read_ram(0, 2)
+        simulated_serial.stop_capture()
+        request = Package(destination=1, function=1, data=b'\x00\x02').bytes_chain
+        records = [(direction, bytes(data))
+                   for offset, timestamp, direction, data in CaptureReader(path).records()]
+        assert records[0] == (TX, request)
+        rx = b''.join(data for direction, data in records if direction == RX)
+        assert rx.startswith(request)
+        assert len(rx) == len(request) + 5
+
+
+class TestReplaySerial(object):
+
+    def record_session(self, simulated_serial, path):
+        simulated_serial._ser.nodes[2].ram[:4] = b'\x0a\x0b\x0c\x0d'
+        simulated_serial.start_capture(path)
+        node = Node(2, ser=simulated_serial)
+        node.identify()
+        memo = node.read_ram(0, 4)
+        simulated_serial.stop_capture()
+        return memo
+
+    def test_replay_send_package(self, simulated_serial, tmpdir):
+        path = str(tmpdir.join('session.cap'))
+        recorded = self.record_session(simulated_serial, path)
+        ser = SerialInterface()
+        ser._ser = ReplaySerial(path)
+        ser.im_master = True
+        node = Node(2, ser=ser)
+        node.identify()
+        assert node.read_ram(0, 4).data == recorded.data
+        assert ser._ser.mismatches == 0
+
+    def test_replay_listen_packages(self, simulated_serial, tmpdir):
+        path = str(tmpdir.join('session.cap'))
+        self.record_session(simulated_serial, path)
+        ser = SerialInterface()
+        ser._ser = ReplaySerial(path)
+        listener = ser.listen_packages()
+        packages = list(itertools.islice(listener, 4))
+        listener.close()
+        assert [package.function for package in packages] == [0, 0, 1, 1]
+        assert packages[3].data == b'\x0a\x0b\x0c\x0d'
+
+    def test_replay_with_original_speed(self, tmpdir):
+        path = str(tmpdir.join('slow.cap'))
+        writer = CaptureWriter(path)
+        writer.record(RX, b'\x01')
+        writer._file.write(struct.pack('<dBH', 1e9, RX, 1) + b'\x02')
+        writer.close()
+        replay = ReplaySerial(path, speed=1e12)
+        assert replay.read(2) == b'\x01\x02'
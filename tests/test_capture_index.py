@@ -0,0 +1,69 @@
+import os
+
+import pytest
+from ClaptonBase.capture import RX, CaptureReader
+from ClaptonBase.capture_index import CaptureIndex
+from ClaptonBase.exceptions import CaptureException
+from tests.test_analyzer import write_capture
+
+
+def capture_frames(path):
+    """
+    :return: list of (timestamp, bytes) of each frame in a capture written
+        by ``write_capture`` without garbage.
+    """
+    reader = CaptureReader(path)
+    records = [(timestamp, bytes(data))
+               for offset, timestamp, direction, data in reader.records() if direction == RX]
+    reader.close()
+    stream = b''.join(data for timestamp, data in records)
+    times = [timestamp for timestamp, data in records for byte in data]
+    frames = list()
+    position = 0
+    while position < len(stream):
+        size = (stream[position + 1] & 0b00011111) + 3
+        frames.append((times[position], stream[position:position + size]))
+        position += size
+    return frames
+
+
+class TestCaptureIndex(object):
+
+    def test_build_and_read_frames(self, tmpdir, bus_frames):
+        path = str(tmpdir.join('bus.cap'))
+        write_capture(path, bus_frames[:300], sessions=2)
+        index = CaptureIndex.build(path, workers=2, chunk_size=300)
+        assert len(index) == 300
+        assert os.path.exists(path + '.clpidx')
+        expected = capture_frames(path)
+        for number in (0, 1, 150, 299):
+            timestamp, package = index.frame(number)
+            assert package.bytes_chain == bus_frames[number]
+            assert timestamp == pytest.approx(expected[number][0])
+        index.close()
+
+    def test_select_by_node_and_time(self, tmpdir, bus_frames):
+        path = str(tmpdir.join('bus.cap'))
+        write_capture(path, bus_frames)
+        index = CaptureIndex.open(path, chunk_size=1000)
+        expected = capture_frames(path)
+        start, end = expected[100][0], expected[400][0]
+        selected = [(timestamp, frame) for timestamp, frame in expected
+                    if start <= timestamp <= end and (frame[0] >> 4 == 2 or frame[0] & 0x0f == 2)]
+        found = list(index.frames(start, end, node=2))
+        assert [package.bytes_chain for timestamp, package in found] == \
+            [frame for timestamp, frame in selected]
+        assert len(index.select(start=start, end=end)) == \
+            len([frame for timestamp, frame in expected if start <= timestamp <= end])
+        index.close()
+
+    def test_open_rebuilds_stale_index(self, tmpdir, bus_frames):
+        path = str(tmpdir.join('bus.cap'))
+        write_capture(path, bus_frames[:100])
+        CaptureIndex.build(path).close()
+        write_capture(path, bus_frames[100:150])
+        with pytest.raises(CaptureException):
+            CaptureIndex(path)
+        index = CaptureIndex.open(path)
+        assert len(index) == 150
+        index.close()
@@ -1,8 +1,14 @@
+import time
+from threading import Event, Thread
+
 import pytest
 
-from ClaptonBase.containers import MemoryContainer, Node, Package
-from ClaptonBase.exceptions import (ChecksumException, DecodeError, EncodeError,
-                                    InvalidPackage, NodeNotExists)
+from ClaptonBase.containers import (MemoryContainer, Node, Package, pack_batch,
+                                    unpack_batch)
+from ClaptonBase.exceptions import (ActiveAppException, ChecksumException,
+                                    DeadlineException, DecodeError, EncodeError,
+                                    InvalidPackage, NodeNotExists,
+                                    WriteException)
 from ClaptonBase.serial_interface import SerialInterface
 
 
@@ -313,3 +319,169 @@ class TestNode(object):
     def test_write_memo_raises_type_error(self, node, start, data, instance):
         with pytest.raises(TypeError):
             node._write_memo(start, data, instance)
+
+    def test_write_app_refused_with_active_app(self, simulated_serial):
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        node.app_active = False
+        # El nodo rechaza la escritura con 0x00 si la aplicacion esta activa.
+        simulated_serial._ser.nodes[1].app_active = True
+        with pytest.raises(ActiveAppException):
+            node.write_app(0, b'\x00\x01')
+        assert node.app_active
+
+
+    def test_deactivate_app_times_out(self, simulated_serial):
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        checks = list()
+
+        def still_active():
+            checks.append(time.monotonic())
+            return True, True
+
+        node.check_app_state = still_active
+        with pytest.raises(ActiveAppException):
+            node.deactivate_app(timeout=.25)
+        # Se consulta cada APP_DEACTIVATE_POLL_PERIOD, no sin pausa.
+        assert 2 <= len(checks) <= 5
+        assert checks[-1] - checks[0] >= .2
+
+
+class TestReadCoalescing(object):
+
+    def slow_serial(self, simulated_serial, started, release):
+        send_package = simulated_serial.send_package
+
+        def slow(package):
+            started.set()
+            release.wait(2)
+            return send_package(package)
+
+        simulated_serial.send_package = slow
+        return simulated_serial
+
+    def test_covered_reads_wait_the_first(self, simulated_serial):
+        started, release = Event(), Event()
+        simulated_serial._ser.nodes[1].ram[:8] = bytes(range(10, 18))
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        del simulated_serial._ser.written[:]
+        self.slow_serial(simulated_serial, started, release)
+        results = dict()
+        first = Thread(target=lambda: results.update(first=node.read_ram(0, 8)))
+        first.start()
+        started.wait(2)
+        others = [Thread(target=lambda i=i: results.update({i: node.read_ram(i, 3)}))
+                  for i in range(4)]
+        for thread in others:
+            thread.start()
+        release.set()
+        for thread in [first] + others:
+            thread.join(2)
+        assert len(simulated_serial._ser.written) == 1
+        assert results['first'].data == bytes(range(10, 18))
+        for i in range(4):
+            assert results[i].start == i
+            assert results[i].data == bytes(range(10 + i, 13 + i))
+
+    def test_waiting_reader_respects_its_deadline(self, simulated_serial):
+        started, release = Event(), Event()
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        self.slow_serial(simulated_serial, started, release)
+        first = Thread(target=node.read_ram, args=(0, 8))
+        first.start()
+        started.wait(2)
+        begin = time.monotonic()
+        with simulated_serial.within(.1):
+            with pytest.raises(DeadlineException):
+                node.read_ram(0, 4)
+        assert time.monotonic() - begin < 1
+        release.set()
+        first.join(2)
+
+    def test_not_covered_read_is_sent(self, simulated_serial):
+        started, release = Event(), Event()
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        del simulated_serial._ser.written[:]
+        self.slow_serial(simulated_serial, started, release)
+        first = Thread(target=node.read_ram, args=(0, 4))
+        first.start()
+        started.wait(2)
+        second = Thread(target=node.read_eeprom, args=(0, 4))
+        second.start()
+        release.set()
+        first.join(2)
+        second.join(2)
+        assert len(simulated_serial._ser.written) == 2
+
+    def test_error_is_shared(self, simulated_serial):
+        started, release = Event(), Event()
+        node = Node(9, ser=self.slow_serial(simulated_serial, started, release))
+        errors = list()
+
+        def read():
+            try:
+                node.read_ram(0, 2)
+            except WriteException as error:
+                errors.append(error)
+
+        threads = [Thread(target=read) for i in range(3)]
+        threads[0].start()
+        started.wait(2)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        assert len(errors) == 3
+        assert not node._flights
+
+
+class TestSerialization(object):
+
+    def test_package(self):
+        package = Package(destination=3, function=1, data=b'\x00\x04')
+        encoded = package.to_bytes()
+        assert len(encoded) == package.encoded_size == len(package.bytes_chain) + 1
+        decoded = Package.from_buffer(memoryview(b'\xff' + encoded), 1)
+        assert decoded.bytes_chain == package.bytes_chain
+
+    def test_memory_container_is_not_copied(self):
+        container = MemoryContainer(2, 'EEPROM', 10, timestamp=12.5, data=b'\x01\x02\x03')
+        buffer = bytearray(container.to_bytes())
+        decoded = MemoryContainer.from_buffer(buffer)
+        assert (decoded.node, decoded.instance, decoded.start, decoded.timestamp) == \
+            (2, 'EEPROM', 10, 12.5)
+        assert decoded.data == b'\x01\x02\x03'
+        buffer[-1] = 9
+        assert decoded.data[-1] == 9
+        assert MemoryContainer.from_buffer(
+            MemoryContainer(1, 'RAM', 0, data=b'').to_bytes()).timestamp is None
+
+    def test_node_descriptor(self, node):
+        node.buffer_size = 64
+        node.status = 1
+        decoded = Node.from_buffer(node.to_bytes())
+        assert decoded.as_dict()['buffer'] == 64
+        with pytest.deprecated_call():
+            assert decoded.__dict__()['buffer'] == 64
+        assert (decoded.lan_dir, decoded.status, decoded.last_seen) == \
+            (node.lan_dir, 1, node.last_seen)
+
+    def test_batch(self):
+        containers = [MemoryContainer(node, 'RAM', node, timestamp=1., data=bytes([node] * node))
+                      for node in range(1, 5)]
+        decoded = unpack_batch(pack_batch(containers))
+        assert [(item.node, bytes(item.data)) for item in decoded] == \
+            [(item.node, item.data) for item in containers]
+        assert unpack_batch(pack_batch([])) == []
+        with pytest.raises(TypeError):
+            pack_batch([containers[0], Package(destination=1, function=0)])
+
+    @pytest.mark.parametrize("buffer", [b'', b'\x02\x00', b'\x01\x01\x00\x00\x00'])
+    def test_invalid_buffer(self, buffer):
+        with pytest.raises(DecodeError):
+            MemoryContainer.from_buffer(buffer)
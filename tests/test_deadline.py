@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+from ClaptonBase.admission import AdmissionController
+from ClaptonBase.containers import Node, Package
+from ClaptonBase.deadline import Deadline
+from ClaptonBase.exceptions import (CancelledException, DeadlineException,
+                                    WriteException)
+from ClaptonBase.retry import RetryPolicy
+
+
+class TestDeadline(object):
+
+    def test_expires(self):
+        deadline = Deadline(.05)
+        assert 0 < deadline.remaining() <= .05
+        assert not deadline.expired
+        deadline.check()
+        time.sleep(.06)
+        assert deadline.expired
+        with pytest.raises(DeadlineException):
+            deadline.check()
+
+    def test_cancel(self):
+        deadline = Deadline()
+        assert deadline.remaining() is None
+        deadline.cancel()
+        assert deadline.expired
+        with pytest.raises(CancelledException):
+            deadline.check()
+
+    def test_coerce(self):
+        deadline = Deadline()
+        assert Deadline.coerce(deadline) is deadline
+        assert Deadline.coerce(None) is None
+        assert Deadline.coerce(1.).remaining() == pytest.approx(1., abs=.1)
+
+    def test_acquire(self):
+        lock = threading.Lock()
+        lock.acquire()
+        start = time.monotonic()
+        with pytest.raises(DeadlineException):
+            Deadline(.1).acquire(lock)
+        assert .1 <= time.monotonic() - start < .5
+        lock.release()
+        Deadline(.1).acquire(lock)
+        assert lock.locked()
+
+    def test_cancel_while_waiting(self):
+        lock = threading.Lock()
+        lock.acquire()
+        deadline = Deadline()
+        threading.Timer(.05, deadline.cancel).start()
+        start = time.monotonic()
+        with pytest.raises(CancelledException):
+            deadline.acquire(lock)
+        assert time.monotonic() - start < .5
+
+
+class TestSerialDeadline(object):
+
+    def test_wait_port(self, simulated_serial):
+        simulated_serial.using_ser.acquire()
+        try:
+            with pytest.raises(DeadlineException):
+                simulated_serial.send_package(Package(destination=1, function=0), deadline=.05)
+        finally:
+            simulated_serial.using_ser.release()
+        assert not simulated_serial._ser.written
+        assert simulated_serial.send_package(Package(destination=1, function=0),
+                                             deadline=1.).sender == 1
+
+    def test_retries_until_deadline(self, simulated_serial):
+        policy = RetryPolicy(retries=10, delay=.1, factor=1.)
+        start = time.monotonic()
+        with pytest.raises(WriteException):
+            simulated_serial.send_package(Package(destination=5, function=0),
+                                          retry=policy, deadline=.25)
+        assert time.monotonic() - start < .25
+        assert len(simulated_serial._ser.written) == 3
+
+    def test_thread_deadline(self, simulated_serial):
+        with simulated_serial.within(Deadline()) as deadline:
+            deadline.cancel()
+            with pytest.raises(CancelledException):
+                Node(1, ser=simulated_serial).read_ram(0, 2)
+        assert not simulated_serial._ser.written
+        assert Node(1, ser=simulated_serial).read_ram(0, 2).length == 2
+
+    def test_listen_until_cancelled(self, simulated_serial):
+        simulated_serial.im_master = False
+        port = simulated_serial._ser
+        for _ in range(3):
+            port.rx.extend(Package(sender=1, destination=2, function=0).bytes_chain)
+        deadline = Deadline()
+        packages = list()
+        for package in simulated_serial.listen_packages(deadline=deadline):
+            packages.append(package)
+            deadline.cancel()
+        assert len(packages) == 1
+        assert not simulated_serial.using_ser.locked()
+
+    def test_admission_deadline(self):
+        controller = AdmissionController(baudrate=115200)
+        package = Package(destination=1, function=3, data=b'\x00\x08')
+        with controller.admit(package):
+            with pytest.raises(DeadlineException):
+                with controller.admit(package, deadline=Deadline(.05)):
+                    pass
+        report = controller.report()['priorities']
+        assert sum(stats['shed'] for stats in report) == 1
+        assert sum(stats['depth'] for stats in report) == 0
@@ -0,0 +1,142 @@
+import time
+
+import pytest
+from ClaptonBase import cfg
+from ClaptonBase.admission import AdmissionController
+from ClaptonBase.bus_manager import BusManager
+from ClaptonBase.containers import Node, Package
+from ClaptonBase.exceptions import (CollisionException, DeadlineException,
+                                    QuarantineException, WriteException)
+from ClaptonBase.health import NodeHealth
+from ClaptonBase.mock_serial import SimulatedPort, VirtualNode
+from ClaptonBase.serial_interface import SerialInterface
+
+
+class TestNodeHealth(object):
+
+    def test_transitions(self):
+        health = NodeHealth(window=10, suspect_rate=.1, quarantine_failures=3,
+                            absent_probes=2, backoff=(0, 0))
+        for _ in range(5):
+            health.success()
+        assert health.failure() == cfg.NODE_SUSPECT
+        assert health.failure() == cfg.NODE_SUSPECT
+        assert health.failure() == cfg.NODE_QUARANTINE
+        assert health.allow()
+        assert health.failure() == cfg.NODE_QUARANTINE
+        assert health.allow()
+        assert health.failure() == cfg.NODE_ABSENT
+        assert health.allow()
+        assert health.success() == cfg.NODE_OK
+
+    def test_backoff(self):
+        health = NodeHealth(quarantine_failures=1, backoff=(10, 40))
+        health.failure()
+        assert health.blocked
+        assert not health.allow()
+        assert health.next_probe - time.monotonic() == pytest.approx(10, abs=.5)
+        health.next_probe = time.monotonic()
+        # Solo una prueba a la vez.
+        assert health.allow()
+        assert not health.allow()
+        health.failure()
+        assert health.next_probe - time.monotonic() == pytest.approx(20, abs=.5)
+
+
+class TestNodeWithHealth(object):
+
+    def test_quarantine_fails_fast(self, simulated_serial):
+        node = Node(7, ser=simulated_serial)
+        node.health = NodeHealth(quarantine_failures=2, backoff=(60, 60))
+        for _ in range(2):
+            with pytest.raises(WriteException):
+                node.read_ram(0, 1)
+        assert node.status == cfg.NODE_QUARANTINE
+        written = len(simulated_serial._ser.written)
+        with pytest.raises(QuarantineException):
+            node.read_ram(0, 1)
+        assert len(simulated_serial._ser.written) == written
+
+    def test_recovers(self, simulated_serial):
+        node = Node(7, ser=simulated_serial)
+        node.health = NodeHealth(quarantine_failures=1, backoff=(0, 0))
+        with pytest.raises(WriteException):
+            node.read_ram(0, 1)
+        simulated_serial._ser.nodes[7] = VirtualNode(7)
+        node.read_ram(0, 1)
+        assert node.status == cfg.NODE_OK
+        assert node.last_seen is not None
+
+    def test_aborted_probe_is_released(self, simulated_serial):
+        node = Node(7, ser=simulated_serial)
+        node.health = NodeHealth(quarantine_failures=1, backoff=(0, 0))
+        with pytest.raises(WriteException):
+            node.read_ram(0, 1)
+        send_package = simulated_serial.send_package
+
+        def expired(*args, **kwargs):
+            raise DeadlineException()
+
+        simulated_serial.send_package = expired
+        with pytest.raises(DeadlineException):
+            node.read_ram(0, 1)
+        assert node.health.probe_due()
+        simulated_serial.send_package = send_package
+        simulated_serial._ser.nodes[7] = VirtualNode(7)
+        node.read_ram(0, 1)
+        assert node.status == cfg.NODE_OK
+
+    def test_collision_is_not_a_failure(self, simulated_serial):
+        node = Node(1, ser=simulated_serial)
+        node.health = NodeHealth(quarantine_failures=1, backoff=(0, 0))
+
+        def collision(*args, **kwargs):
+            raise WriteException() from CollisionException()
+
+        simulated_serial.send_package = collision
+        for _ in range(3):
+            with pytest.raises(WriteException):
+                node.read_ram(0, 1)
+        assert node.health.state == cfg.NODE_OK
+        assert node.health.failure_rate == 0
+
+
+class TestReprobe(object):
+
+    def test_reprobe_quarantined_nodes(self):
+        ser = SerialInterface(serial_port='simulated')
+        ser._ser = SimulatedPort([VirtualNode(1)])
+        ser.im_master = True
+        manager = BusManager([ser])
+        manager.node((0, 2)).health = NodeHealth(quarantine_failures=1, backoff=(0, 0))
+        results, errors = manager.read_ram([(0, 1), (0, 2)], 0, 1)
+        assert isinstance(errors[(0, 2)], WriteException)
+        assert manager.node((0, 2)).health.blocked
+        ser._ser.nodes[2] = VirtualNode(2)
+        futures = manager.reprobe()
+        assert list(futures) == [(0, 2)]
+        assert futures[(0, 2)].result(timeout=5)
+        assert manager.node((0, 2)).status == cfg.NODE_OK
+        assert manager.reprobe() == {}
+        for worker in manager._workers.values():
+            worker.shutdown()
+
+    def test_reprobe_is_not_shed(self):
+        ser = SerialInterface(serial_port='simulated')
+        ser._ser = SimulatedPort([VirtualNode(1)])
+        ser.im_master = True
+        # Los pedidos de polling se descartan enseguida.
+        ser.admission = AdmissionController(max_wait=(None, None, .01))
+        manager = BusManager([ser])
+        node = manager.node((0, 1))
+        node.health = NodeHealth(quarantine_failures=1, backoff=(0, 0))
+        node.health.failure()
+        with ser.admission.admit(Package(destination=1, function=0)):
+            future = manager.reprobe()[(0, 1)]
+            time.sleep(.1)
+        assert future.result(timeout=5)
+        assert node.status == cfg.NODE_OK
+        report = ser.admission.report()['priorities'][cfg.PRIORITY_POLLING]
+        assert (report['admitted'], report['shed']) == (1, 0)
+        for worker in manager._workers.values():
+            worker.shutdown()
@@ -0,0 +1,87 @@
+import pytest
+from ClaptonBase.bus_manager import BusManager
+from ClaptonBase.containers import MemoryContainer, Node
+from ClaptonBase.mock_serial import SimulatedPort, VirtualNode
+from ClaptonBase.node_state import NodeState, refresh_order
+from ClaptonBase.serial_interface import SerialInterface
+
+
+@pytest.fixture
+def state(tmpdir):
+    state = NodeState(str(tmpdir.join('bus.state')))
+    yield state
+    state.close()
+
+
+def shutdown(manager):
+    for worker in manager._workers.values():
+        worker.shutdown()
+    for state in manager.states.values():
+        state.close()
+
+
+def simulated_interface(nodes):
+    ser = SerialInterface(serial_port='simulated')
+    ser._ser = SimulatedPort(nodes)
+    ser.im_master = True
+    return ser
+
+
+class TestNodeState(object):
+
+    def test_node_is_saved_in_place(self, state, simulated_serial):
+        node = Node(1, ser=simulated_serial)
+        node.state = state
+        node.identify()
+        node.read_ram(0, 2)
+        restored = state.nodes()
+        assert list(restored) == [1]
+        assert (restored[1].buffer_size, restored[1].status, restored[1].last_seen) == \
+            (node.buffer_size, 1, node.last_seen)
+        assert restored[1].state is state
+
+    def test_memory_survives_reopen(self, state):
+        state.save_memory(MemoryContainer(3, 'EEPROM', 4, timestamp=7., data=b'\x01\x02'))
+        state.save_memory(MemoryContainer(3, 'EEPROM', 10, timestamp=8., data=b'\x03'))
+        state.close()
+        reopened = NodeState(state.path)
+        memory = reopened.memory(3, 'EEPROM')
+        assert [(item.start, item.data, item.timestamp) for item in memory] == \
+            [(4, b'\x01\x02', 8.), (10, b'\x03', 8.)]
+        assert reopened.memory(3, 'RAM') == []
+        reopened.close()
+
+    def test_other_format_is_discarded(self, state):
+        state.save_memory(MemoryContainer(1, 'RAM', 0, data=b'\x01'))
+        state.close()
+        other = NodeState(state.path, memory_size=64)
+        assert other.known_ranges(1, 'RAM') == []
+        other.close()
+
+    def test_refresh_order(self):
+        nodes = dict((lan_dir, Node(lan_dir, ser=None)) for lan_dir in (1, 2, 3))
+        nodes[1].last_seen = 20.
+        nodes[2].last_seen = 10.
+        assert refresh_order(nodes) == [3, 2, 1]
+
+
+class TestWarmStart(object):
+
+    def test_restore_and_refresh(self, tmpdir):
+        virtual = VirtualNode(2)
+        virtual.ram[:4] = b'\x01\x02\x03\x04'
+        manager = BusManager([simulated_interface([virtual])], state_dir=str(tmpdir))
+        manager.node((0, 2)).identify()
+        manager.poll([((0, 2), 'RAM', 0, 4)])
+        shutdown(manager)
+
+        virtual.ram[:4] = b'\x05\x06\x07\x08'
+        interface = simulated_interface([virtual])
+        manager = BusManager([interface], state_dir=str(tmpdir))
+        # Antes de refrescar ya esta la memoria guardada.
+        assert manager.states[0].memory(2, 'RAM')[0].data == b'\x01\x02\x03\x04'
+        futures = manager.warm_start()
+        futures[(0, 2)].result(timeout=5)
+        assert manager.node((0, 2)).buffer_size == virtual.buffer_size
+        assert manager.states[0].memory(2, 'RAM')[0].data == b'\x05\x06\x07\x08'
+        shutdown(manager)
@@ -0,0 +1,119 @@
+import math
+
+import pytest
+from ClaptonBase import cfg
+from ClaptonBase.containers import Node, Package
+from ClaptonBase.exceptions import WriteException
+from ClaptonBase.planner import BusPlanner, TrafficMeter
+
+
+class TestBusPlanner(object):
+
+    def test_transaction_cost(self):
+        planner = BusPlanner(baudrate=2400)
+        item = planner.add_poll(1, 'RAM', 0, 8)
+        # Pedido de 5 bytes y respuesta de 8 + 3.
+        assert planner.item_bytes(item) == 16
+        assert planner.item_cost(item) == pytest.approx(16 * 10 / 2400. + cfg.NODE_TURNAROUND)
+        assert BusPlanner(baudrate=9600).item_cost(item) < planner.item_cost(item)
+
+    def test_split_in_frames(self):
+        planner = BusPlanner()
+        poll = planner.add_poll(1, 'EEPROM', 10, 64)
+        assert [package.data[1] for package in poll.packages] == [31, 31, 2]
+        assert [package.data[0] for package in poll.packages] == [10, 41, 72]
+        write = planner.add_write(1, 'RAM', 0, 40)
+        assert [len(package.data) for package in write.packages] == [31, 11]
+        assert all(len(package.bytes_chain) <= cfg.MAX_DATA_LENGTH + 3
+                   for package in poll.packages + write.packages)
+
+    def test_absent_nodes(self):
+        planner = BusPlanner(baudrate=9600, timeout=.25)
+        scan = planner.add_scan(lan_dirs=[1, 2], present=[1])
+        attempts = cfg.SEND_PACKAGE_TRIES + 1
+        assert planner.absent_attempts(scan.absent[0])[0] == attempts
+        assert planner.item_cost(scan) == pytest.approx(
+            planner.cost(scan.packages[0]) + attempts * (3 * 10 / 9600. + .25))
+        assert planner.report()['blocking'] == pytest.approx(attempts * (3 * 10 / 9600. + .25))
+
+    def test_occupancy(self):
+        planner = BusPlanner(baudrate=2400)
+        cost = planner.item_cost(planner.add_poll(1, 'RAM', 0, 31, period=1.))
+        planner.add_poll(2, 'RAM', 0, 8)
+        report = planner.report()
+        assert report['occupancy'] == pytest.approx(cost)
+        assert report['feasible']
+        best_effort = report['items'][1]
+        assert best_effort['rate'] == pytest.approx((1 - cost) / planner.item_cost(planner.items[1]))
+
+    def test_latency(self):
+        planner = BusPlanner(baudrate=2400)
+        planner.add_poll(1, 'RAM', 0, 31, period=1.)
+        planner.add_poll(2, 'RAM', 0, 8, period=1.)
+        request = Package(destination=3, function=0)
+        report = planner.report()
+        assert planner.latency(request) == pytest.approx(
+            report['blocking'] + planner.cost(request))
+        assert planner.latency(request, cfg.PRIORITY_NORMAL) == planner.latency(request)
+        assert planner.latency(request, cfg.PRIORITY_POLLING) == pytest.approx(
+            report['cycle'] + planner.cost(request))
+        planner.add_poll(3, 'RAM', 0, 31, period=.1)
+        assert planner.latency(request, cfg.PRIORITY_POLLING) == math.inf
+        assert planner.latency(request) < 1
+
+    def test_overcommitted(self):
+        planner = BusPlanner(baudrate=2400)
+        item = planner.add_poll(1, 'RAM', 0, 31, period=.1)
+        report = planner.report()
+        assert report['occupancy'] > 1
+        assert not report['feasible']
+        # Las lecturas se atrasan: no se logra el periodo pedido.
+        assert report['items'][0]['rate'] == pytest.approx(1. / planner.item_cost(item))
+        assert report['items'][0]['rate'] < 10
+
+    def test_against_simulated_bus(self, simulated_serial):
+        meter = TrafficMeter()
+        simulated_serial.meter = meter
+        planner = BusPlanner()
+        planner.add_poll(1, 'RAM', 0, 40, period=1.)
+        planner.add_poll(2, 'EEPROM', 5, 8)
+        planner.add_write(2, 'RAM', 0, 35)
+        planner.add_scan(lan_dirs=[1, 2, 3], present=[1, 2])
+        for item in planner.items:
+            for package in item.packages:
+                simulated_serial.send_package(package)
+            for package in item.absent:
+                with pytest.raises(WriteException):
+                    simulated_serial.send_package(package)
+        report = planner.report()
+        measured = meter.report()
+        assert measured['bytes'] == report['bytes']
+        assert measured['transactions'] == sum(len(item.packages) + len(item.absent)
+                                               for item in planner.items)
+
+    def test_node_traffic(self, simulated_serial):
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        meter = TrafficMeter()
+        simulated_serial.meter = meter
+        planner = BusPlanner()
+        item = planner.add_poll(1, 'RAM', 0, 16)
+        node.read_ram(0, 16)
+        assert meter.total_bytes == planner.item_bytes(item)
+
+
+class TestTrafficMeter(object):
+
+    def test_window(self):
+        meter = TrafficMeter(baudrate=2400, window=10.)
+        meter.started = 0.
+        meter.record(240, now=1.)
+        meter.busy(.5, now=1.)
+        meter.record(240, now=9.)
+        report = meter.report(now=10.)
+        assert report['bytes'] == 480
+        assert report['utilization'] == pytest.approx(2. / 10)
+        assert report['busy'] == pytest.approx(.05)
+        report = meter.report(now=15.)
+        assert (report['bytes'], report['transactions']) == (240, 0)
+        assert meter.total_bytes == 480
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+from ClaptonBase import cfg
+from ClaptonBase.containers import MemoryContainer, Node
+from ClaptonBase.publisher import (HEADER, UPDATE, Publisher, changed_ranges,
+                                   decode_memory, decode_nodes, decode_status)
+
+
+class Socket(object):
+
+    def __init__(self):
+        self.sent = list()
+        self.closed = False
+
+    def send_multipart(self, parts):
+        self.sent.append(parts)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def publisher():
+    return Publisher(socket=Socket())
+
+
+def memory(node, start, data, instance='RAM', timestamp=1000.):
+    return MemoryContainer(node, instance, start, timestamp=timestamp, data=data)
+
+
+class TestChangedRanges(object):
+
+    def test_unknown_bytes_changed(self):
+        assert changed_ranges(bytearray(), bytearray(), 0, b'\x01\x02') == [(0, 2)]
+
+    def test_close_changes_are_merged(self):
+        image = bytearray(40)
+        known = bytearray(b'\x01' * 40)
+        data = bytearray(40)
+        data[2] = data[5] = data[30] = 1
+        assert changed_ranges(image, known, 0, bytes(data)) == [(2, 6), (30, 31)]
+        assert changed_ranges(image, known, 0, bytes(40)) == []
+
+
+class TestPublisher(object):
+
+    def test_batch_and_delta(self, publisher):
+        size = publisher.publish_memory([memory(1, 0, b'\x01\x02\x03\x04'),
+                                         memory(2, 10, b'\x05', 'EEPROM', 1000.5)])
+        topic, payload = publisher.socket.sent[-1]
+        assert topic == cfg.MSG_MEMORY_PREFIX.encode()
+        assert size == len(payload) == HEADER.size + 2 * UPDATE.size + 5
+        decoded = decode_memory(payload)
+        assert [(item.node, item.instance, item.start, item.data) for item in decoded] == \
+            [(1, 'RAM', 0, b'\x01\x02\x03\x04'), (2, 'EEPROM', 10, b'\x05')]
+        assert decoded[1].timestamp == pytest.approx(1000.5)
+        # Solo cambia el ultimo byte.
+        publisher.publish_memory([memory(1, 0, b'\x01\x02\x03\x09')])
+        decoded = decode_memory(publisher.socket.sent[-1][1])
+        assert [(item.start, item.data) for item in decoded] == [(3, b'\x09')]
+
+    def test_nothing_changed(self, publisher):
+        publisher.publish_memory([memory(1, 0, b'\x01')])
+        assert publisher.publish_memory([memory(1, 0, b'\x01')]) == 0
+        assert len(publisher.socket.sent) == 1
+
+    def test_reset(self, publisher):
+        publisher.publish_memory([memory(1, 0, b'\x01'), memory(2, 0, b'\x02')])
+        publisher.reset(1)
+        publisher.publish_memory([memory(1, 0, b'\x01'), memory(2, 0, b'\x02')])
+        assert [item.node for item in decode_memory(publisher.socket.sent[-1][1])] == [1]
+
+    def test_status(self, publisher, simulated_serial):
+        node = Node(1, ser=simulated_serial)
+        node.identify()
+        publisher.publish_nodes([node, Node(2, ser=simulated_serial)])
+        publisher.publish_master(simulated_serial)
+        publisher.publish_connection(simulated_serial)
+        (node_topic, nodes), (master_topic, master), (con_topic, con) = publisher.socket.sent
+        assert [item[:2] for item in decode_nodes(nodes)] == [(1, node.status), (2, 0)]
+        assert decode_nodes(nodes)[1][2] is None
+        assert master_topic == cfg.MSG_MASTER_PREFIX.encode()
+        assert decode_status(master)[0] is True
+        assert decode_status(con)[0] is True
+
+    def test_zmq_inproc(self):
+        zmq = pytest.importorskip('zmq')
+        context = zmq.Context()
+        publisher = Publisher('inproc://clapton', context=context)
+        subscriber = context.socket(zmq.SUB)
+        subscriber.connect('inproc://clapton')
+        subscriber.setsockopt(zmq.SUBSCRIBE, cfg.MSG_MEMORY_PREFIX.encode())
+        time.sleep(.1)
+        publisher.publish_memory([memory(3, 4, b'\x0a')])
+        assert subscriber.poll(1000)
+        topic, payload = subscriber.recv_multipart()
+        assert decode_memory(payload)[0].data == b'\x0a'
+        subscriber.close()
+        publisher.close()
+        context.term()
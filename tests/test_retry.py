@@ -0,0 +1,124 @@
+import time
+
+import pytest
+from ClaptonBase import cfg, retry
+from ClaptonBase.containers import Node, Package
+from ClaptonBase.exceptions import (ChecksumException, CollisionException,
+                                    ReadException, WriteException)
+from ClaptonBase.retry import RetryPolicy
+
+
+def caused(error, cause):
+    error.__cause__ = cause
+    return error
+
+
+class TestRetryPolicy(object):
+
+    def test_rule_by_cause(self):
+        policy = RetryPolicy(retries=3, rules={ChecksumException: {'retries': 0},
+                                               ReadException: {'delay': 1.}})
+        key, fields = policy.rule(caused(WriteException(), ChecksumException()))
+        assert key is ChecksumException
+        assert fields['retries'] == 0
+        # CollisionException es un ReadException.
+        key, fields = policy.rule(CollisionException())
+        assert key is ReadException
+        assert fields['delay'] == 1. and fields['retries'] == 3
+        assert policy.rule(WriteException())[0] is None
+
+    def test_backoff(self):
+        attempts = RetryPolicy(retries=4, delay=.1, factor=2., max_delay=.3).start()
+        delays = [attempts.backoff(WriteException()) for _ in range(5)]
+        assert delays[:4] == pytest.approx([.1, .2, .3, .3])
+        assert delays[4] is None
+
+    def test_jitter(self):
+        attempts = RetryPolicy(retries=100, delay=.1, factor=1., jitter=.5).start()
+        delays = [attempts.backoff(WriteException()) for _ in range(100)]
+        assert all(.05 <= delay <= .1 for delay in delays)
+        assert len(set(delays)) > 1
+
+    def test_counts_by_rule(self):
+        attempts = RetryPolicy(retries=1, rules={ChecksumException: {'retries': 2}}).start()
+        checksum = caused(WriteException(), ChecksumException())
+        assert attempts.backoff(checksum) is not None
+        assert attempts.backoff(WriteException()) is not None
+        assert attempts.backoff(checksum) is not None
+        assert attempts.backoff(WriteException()) is None
+        assert attempts.backoff(checksum) is None
+
+    def test_deadline(self):
+        attempts = RetryPolicy(retries=10, delay=.2, deadline=.3).start()
+        assert attempts.backoff(WriteException()) == pytest.approx(.2)
+        # La siguiente espera (.4) ya pasa el tiempo limite.
+        assert attempts.backoff(WriteException()) is None
+
+    def test_replace(self):
+        policy = retry.DEFAULT.replace(retries=7, rules={ChecksumException: {'retries': 0}})
+        assert policy.retries == 7
+        assert CollisionException in policy.rules and ChecksumException in policy.rules
+        assert ChecksumException not in retry.DEFAULT.rules
+        assert retry.DEFAULT.retries == cfg.SEND_PACKAGE_TRIES
+
+
+class TestSerialRetry(object):
+
+    def test_absent_node(self, simulated_serial):
+        port = simulated_serial._ser
+        with pytest.raises(WriteException) as error:
+            simulated_serial.send_package(Package(destination=5, function=0))
+        assert isinstance(error.value.__cause__, ReadException)
+        assert len(port.written) == cfg.SEND_PACKAGE_TRIES + 1
+
+    def test_call_override(self, simulated_serial):
+        port = simulated_serial._ser
+        with pytest.raises(WriteException):
+            simulated_serial.send_package(Package(destination=5, function=0),
+                                          retry=RetryPolicy(retries=0))
+        assert len(port.written) == 1
+
+    def test_thread_policy(self, simulated_serial):
+        port = simulated_serial._ser
+        with simulated_serial.retrying(RetryPolicy(retries=5)):
+            with pytest.raises(WriteException):
+                Node(5, ser=simulated_serial).read_ram(0, 1)
+        assert len(port.written) == 6
+        del port.written[:]
+        with pytest.raises(WriteException):
+            simulated_serial.send_package(Package(destination=5, function=0))
+        assert len(port.written) == cfg.SEND_PACKAGE_TRIES + 1
+
+    def test_retry_succeeds(self, simulated_serial):
+        port = simulated_serial._ser
+        write = port.write
+        failures = [2]
+
+        def flaky(data):
+            written = write(data)
+            if failures[0]:
+                failures[0] -= 1
+                port.rx[-1] ^= 0xff
+            return written
+
+        port.write = flaky
+        answer = simulated_serial.send_package(Package(destination=1, function=0))
+        assert answer.sender == 1
+        assert len(port.written) == 3
+
+    def test_collision_delay(self, simulated_serial):
+        port = simulated_serial._ser
+        write = port.write
+
+        def collide(data):
+            written = write(data)
+            port.rx[0] ^= 0xff
+            return written
+
+        port.write = collide
+        policy = retry.DEFAULT.replace(
+            rules={CollisionException: {'delay': .05, 'factor': 1., 'jitter': 0.}})
+        start = time.monotonic()
+        with pytest.raises(CollisionException):
+            simulated_serial.send_package(Package(destination=1, function=0), retry=policy)
+        assert time.monotonic() - start >= .05 * cfg.SEND_PACKAGE_TRIES
@@ -0,0 +1,48 @@
+import pytest
+from ClaptonBase.containers import Package
+from ClaptonBase.scanner import scan, valid_offsets
+
+
+class TestScanner(object):
+
+    def test_valid_offsets(self):
+        frame = Package(sender=1, destination=2, function=2, data=b'\x00\x05').bytes_chain
+        offsets, sizes = valid_offsets(b'\x00' + frame)
+        assert 1 in offsets.tolist()
+        assert sizes[offsets.tolist().index(1)] == len(frame)
+
+    def test_resync_on_checksum(self, bus_frames):
+        frames = bus_frames[:5]
+        stream = b''.join(frames[:2]) + b'\x13\x37' + b''.join(frames[2:])
+        found = scan(b'\xff' + stream)
+        assert len(found) == 5
+        assert (found.lead, found.errors) == (1, 2)
+        assert found.stop == len(stream) + 1
+
+    def test_frame_fields(self, bus_frames):
+        frames = bus_frames[:50]
+        found = scan(b''.join(frames))
+        packages = [Package(bytes_chain=frame) for frame in frames]
+        assert found.senders.tolist() == [package.sender for package in packages]
+        assert found.destinations.tolist() == [package.destination for package in packages]
+        assert found.functions.tolist() == [package.function for package in packages]
+        assert found.lengths.tolist() == [package.length for package in packages]
+
+    def test_frame_cut_at_the_end(self, bus_frames):
+        frame = bus_frames[0]
+        found = scan(frame + frame[:2])
+        assert found.offsets.tolist() == [0]
+        assert found.stop == len(frame)
+
+    @pytest.mark.parametrize('buffer', [b'', b'\x01', b'\x01\x02'])
+    def test_short_buffer(self, buffer):
+        found = scan(buffer)
+        assert len(found) == 0
+        assert found.lead == found.stop == 0
+
+    def test_limit(self, bus_frames):
+        frames = bus_frames[:10]
+        stream = b''.join(frames)
+        found = scan(stream, len(frames[0]) + 1)
+        assert len(found) == 2
+        assert found.stop == len(frames[0]) + len(frames[1])
@@ -2,10 +2,12 @@ import os
 import time
 
 import pytest
-from ClaptonBase import decode
-from ClaptonBase.containers import Package
-from ClaptonBase.exceptions import (ChecksumException, NoMasterException,
-                                    ReadException, WriteException)
+from ClaptonBase import cfg, decode
+from ClaptonBase.containers import Node, Package
+from ClaptonBase.exceptions import (ChecksumException, CollisionException,
+                                    NoMasterException, ReadException,
+                                    WriteException)
+from ClaptonBase.mock_serial import VirtualNode
 
 
 class TestSerial(object):
@@ -146,3 +148,93 @@ class TestSerial(object):
 
     def test_listen_packages(self):
         pass
+
+
+class TestEcho(object):
+
+    def test_no_local_echo(self, simulated_serial):
+        simulated_serial._ser.echo = False
+        simulated_serial.local_echo = False
+        simulated_serial._ser.nodes[1].ram[:2] = b'\x05\x06'
+        assert Node(1, ser=simulated_serial).read_ram(0, 2).data == b'\x05\x06'
+
+    def test_collision(self, simulated_serial):
+        port = simulated_serial._ser
+        write = port.write
+
+        def collide(data):
+            written = write(data)
+            port.rx[0] ^= 0xff
+            return written
+
+        port.write = collide
+        with pytest.raises(CollisionException):
+            simulated_serial.send_package(Package(destination=1, function=0))
+        assert len(port.written) == cfg.SEND_PACKAGE_TRIES + 1
+
+    def test_incomplete_echo(self, simulated_serial):
+        simulated_serial._ser.connected = False
+        with pytest.raises(ReadException):
+            simulated_serial.check_echo(b'\x01\x00\xff')
+
+
+class TokenMaster(VirtualNode):
+    """
+    Master of the simulated TKLan that answers the token packages.
+    """
+
+    def answer(self, package):
+        if package.function != 7:
+            return super(TokenMaster, self).answer(package)
+        self.received.append(package)
+        return Package(sender=self.lan_dir, destination=package.sender,
+                       function=7, data=b'\x00\x00', validate=False)
+
+
+class TestTokenBurst(object):
+
+    @pytest.fixture
+    def slave(self, simulated_serial):
+        master = TokenMaster(5)
+        simulated_serial._ser.nodes[5] = master
+        simulated_serial.im_master = False
+        simulated_serial.token_burst = True
+        simulated_serial._ser.nodes[1].ram[:2] = b'\x05\x06'
+        return simulated_serial
+
+    def offer(self, slave):
+        slave._ser.rx.extend(Package(sender=5, destination=0, function=7).bytes_chain)
+        listener = slave.listen_packages()
+        package = next(listener)
+        listener.close()
+        return package
+
+    def test_burst_with_queued_packages(self, slave):
+        futures = [slave.queue_package(Package(destination=1, function=1, data=b'\x00\x02')),
+                   slave.queue_package(Package(destination=2, function=0))]
+        assert self.offer(slave).function == 7
+        assert futures[0].result(timeout=0).data == b'\x05\x06'
+        assert futures[1].done()
+        # Aceptacion y devolucion del token, dos paquetes cada una.
+        assert len(slave._ser.nodes[5].received) == 4
+        assert not slave.im_master
+        assert not slave._slave_queue
+
+    def test_offer_ignored_without_work(self, slave):
+        self.offer(slave)
+        assert slave._ser.written == []
+        assert not slave.im_master
+
+    def test_burst_budget(self, slave, monkeypatch):
+        monkeypatch.setattr(cfg, 'TOKEN_BURST_BUDGET', 0)
+        futures = [slave.queue_package(Package(destination=1, function=0))
+                   for _ in range(3)]
+        self.offer(slave)
+        assert [future.done() for future in futures] == [True, False, False]
+        assert len(slave._slave_queue) == 2
+        assert not slave.im_master
+
+    def test_queue_package_as_master(self, simulated_serial):
+        simulated_serial._ser.nodes[1].ram[:1] = b'\x07'
+        future = simulated_serial.queue_package(Package(destination=1, function=1, data=b'\x00\x01'))
+        assert future.result(timeout=0).data == b'\x07'
@@ -0,0 +1,76 @@
+import multiprocessing
+import threading
+
+import numpy as np
+import pytest
+from ClaptonBase.containers import MemoryContainer
+from ClaptonBase.shared_image import SharedImage
+
+
+@pytest.fixture
+def image():
+    image = SharedImage.create(memory_size=64, region_size=16)
+    yield image
+    image.close()
+
+
+def read_in_process(name, queue):
+    image = SharedImage.attach(name)
+    data, timestamp = image.read(3, 'EEPROM', 10, 4)
+    queue.put((bytes(data), timestamp))
+    del data
+    image.close()
+
+
+class TestSharedImage(object):
+
+    def test_write_and_read(self, image):
+        image.write(MemoryContainer(2, 'RAM', 14, timestamp=5., data=b'\x01\x02\x03\x04'))
+        data, timestamp = image.read(2, 'RAM', 14, 4)
+        assert bytes(data) == b'\x01\x02\x03\x04'
+        assert timestamp == 5.
+        # Las dos regiones escritas cambiaron de secuencia.
+        assert image.sequences(2, 'RAM').tolist() == [2, 2, 0, 0]
+        assert np.isnan(image.read(2, 'EEPROM')[1])
+        assert image.view(2, 'RAM')[15] == 2
+
+    def test_out_array(self, image):
+        image.write(MemoryContainer(1, 'RAM', 0, timestamp=1., data=b'\x07' * 8))
+        out = np.zeros(8, dtype=np.uint8)
+        data, timestamp = image.read(1, 'RAM', 0, 8, out=out)
+        assert data.base is out or data is out
+        assert out.tolist() == [7] * 8
+
+    def test_out_of_range(self, image):
+        with pytest.raises(IndexError):
+            image.write(MemoryContainer(1, 'RAM', 60, data=b'\x00' * 8))
+        with pytest.raises(KeyError):
+            image.read(16, 'RAM')
+
+    def test_other_process(self, image):
+        image.write(MemoryContainer(3, 'EEPROM', 10, timestamp=2., data=b'\x0a\x0b\x0c\x0d'))
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=read_in_process, args=(image.name, queue))
+        process.start()
+        assert queue.get(timeout=10) == (b'\x0a\x0b\x0c\x0d', 2.)
+        process.join(timeout=10)
+        assert process.exitcode == 0
+
+    def test_reads_are_consistent(self, image):
+        stop = threading.Event()
+
+        def writer():
+            value = 0
+            while not stop.is_set():
+                value = (value + 1) % 256
+                image.write(MemoryContainer(4, 'RAM', 0, data=bytes([value]) * 64))
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            for _ in range(2000):
+                data, timestamp = image.read(4, 'RAM')
+                assert len(set(data.tolist())) == 1
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,101 @@
+import os
+import socket
+import time
+
+import pytest
+from ClaptonBase.containers import Node
+from ClaptonBase.exceptions import WriteException
+from ClaptonBase.mock_serial import TcpSimulator, VirtualNode
+from ClaptonBase.serial_interface import SerialInterface
+from ClaptonBase.transports import (FdTransport, SerialTransport, TcpTransport,
+                                    Transport, transport_for)
+
+
+@pytest.fixture
+def pty():
+    master, slave = os.openpty()
+    yield master, os.ttyname(slave)
+    os.close(master)
+    os.close(slave)
+
+
+class TestTransports(object):
+
+    @pytest.mark.parametrize('port, transport', [
+        ('/dev/ttyAMA0', SerialTransport),
+        ('loop://', SerialTransport),
+        ('fd:///dev/ttyAMA0', FdTransport),
+        ('tcp://127.0.0.1:4001', TcpTransport),
+    ])
+    def test_transport_for(self, port, transport):
+        assert isinstance(transport_for(port), transport)
+
+    def test_fd_read_and_write(self, pty):
+        master, path = pty
+        transport = FdTransport(path, baudrate=9600, timeout=.1)
+        transport.open()
+        os.write(master, b'\x01\x02\x03')
+        assert transport.read(2) == b'\x01\x02'
+        start = time.monotonic()
+        assert transport.read(5) == b'\x03'
+        assert time.monotonic() - start >= .09
+        assert transport.write(b'\x10\x00\xf0') == 3
+        assert os.read(master, 3) == b'\x10\x00\xf0'
+        transport.close()
+        assert not transport.isOpen()
+
+    def test_fd_flush_input(self, pty):
+        master, path = pty
+        transport = FdTransport(path, timeout=.05)
+        transport.open()
+        os.write(master, b'\x01\x02')
+        time.sleep(.05)
+        transport.flushInput()
+        assert transport.read(2) == b''
+        transport.close()
+
+    def test_fd_flush_input_closed(self, pty):
+        master, path = pty
+        FdTransport(path).flushInput()
+
+    def test_tcp_write_timeout(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        transport = TcpTransport('{0}:{1}'.format(*server.getsockname()), write_timeout=.1)
+        transport.open()
+        connection, address = server.accept()
+        # El servidor no lee: se llenan los buffers del socket.
+        with pytest.raises(WriteException):
+            transport.write(bytes(64 * 1024 * 1024))
+        transport.close()
+        connection.close()
+        server.close()
+
+    def test_abstract_transport(self):
+        with pytest.raises(TypeError):
+            Transport('/dev/ttyAMA0')
+
+    def test_tcp_node_read(self):
+        simulator = TcpSimulator([VirtualNode(1)])
+        simulator.simulated.nodes[1].ram[:3] = b'\x07\x08\x09'
+        ser = SerialInterface(transport=TcpTransport(simulator.url, timeout=.5))
+        ser._ser.open()
+        ser.im_master = True
+        node = Node(1, ser=ser)
+        assert node.read_ram(0, 3).data == b'\x07\x08\x09'
+        ser._ser.close()
+        simulator.close()
+
+    def test_tcp_server_closes(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        transport = TcpTransport('{0}:{1}'.format(*server.getsockname()), timeout=.5)
+        transport.open()
+        connection, address = server.accept()
+        connection.sendall(b'\x01')
+        connection.close()
+        server.close()
+        assert transport.read(2) == b'\x01'
+        assert not transport.isOpen()